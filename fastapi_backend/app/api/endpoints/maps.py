@@ -1,4 +1,5 @@
-from fastapi import APIRouter, Depends, HTTPException, status, File, UploadFile, Form
+from fastapi import APIRouter, Depends, HTTPException, status, File, UploadFile, Form, Query, Response, BackgroundTasks, Header
+from starlette.concurrency import run_in_threadpool
 from typing import List, Dict, Any, Optional
 from sqlalchemy.orm import Session
 import json
@@ -8,30 +9,343 @@ from pathlib import Path
 from app.database import get_db
 from app.api.schemas.map_schemas import (
     MapLayer, MapLayerCreate, MapLayerUpdate, 
-    MapView, MapViewCreate, MapViewUpdate
+    MapView, MapViewCreate, MapViewUpdate, SpatialJoinRequest, LayerFeaturesPatch, DbLayerCreate
 )
 from app.api.services.map_service import (
     get_map_layers, get_map_layer, create_map_layer, update_map_layer, delete_map_layer,
     get_map_views, get_map_view, create_map_view, update_map_view, delete_map_view,
-    get_all_available_layers, get_layer_by_id
+    get_all_available_layers, get_layer_by_id, get_static_layer_topojson, get_layer_default_fields,
+    spatial_join, patch_static_layer, get_static_layer_changes, create_db_layer,
+    get_static_layer_tile, prefetch_static_layer, get_static_layer_summary, get_static_layer_quality,
+    get_db_layer_summary, get_static_layer_encoded, get_static_layer_parts, get_static_layer_part,
+    get_layer_clusters, get_static_layer_export, get_static_layer_bbox, find_static_layer_export,
+    write_static_layer_export, import_layer_file, STATIC_EXPORT_FORMATS, get_layer_points,
+    get_static_layer_response_etag, fields_cache_key, known_static_layer_fields, save_static_layer_file
 )
+from app.api.services.http_ranges import range_response, file_range_response
+from app.api.services.http_cache import LAYER_CACHE_CONTROL, etag_matches, not_modified, cached_json_response
+from app.api.services.geoparquet import GeoParquetUnavailable
+from app.api.services.clustering import expand_cluster
+from app.api.services.tiles import prefetch_tiles, is_valid_tile
+from app.api.services.nspd_service import multi_thematic_search
+from app.api.services.geometry_validation import validate_features
+from app.api.services.geojson_encoding import prepare_collection, parse_fields, DEFAULT_QUANTIZATION, QUANTIZATION_LEVELS
 
 router = APIRouter(tags=["maps"])
 
+def parse_bbox(bbox: Optional[str]) -> Optional[List[float]]:
+    """Разбирает параметр bbox=min_lng,min_lat,max_lng,max_lat"""
+    if bbox is None:
+        return None
+    try:
+        values = [float(v) for v in bbox.split(",")]
+    except ValueError:
+        values = []
+    if len(values) != 4 or values[0] > values[2] or values[1] > values[3]:
+        raise HTTPException(status_code=400, detail="bbox должен быть задан как min_lng,min_lat,max_lng,max_lat")
+    return values
+
 # Добавляем эндпоинт для получения всех доступных слоев (НСПД и статические)
 @router.get("/maps/available-layers/", response_model=List[MapLayer])
-async def read_available_layers(db: Session = Depends(get_db)):
-    """Получить все доступные слои, включая слои из НСПД и статические слои"""
-    return get_all_available_layers(db)
+async def read_available_layers(
+    background_tasks: BackgroundTasks,
+    if_none_match: Optional[str] = Header(None, alias="If-None-Match"),
+    db: Session = Depends(get_db)
+):
+    """
+    Получить все доступные слои, включая слои из НСПД и статические слои.
+    Для слоев, сводка которых еще не посчитана, она считается в фоне после ответа.
+    Ответ отдается с ETag по содержимому: если список не изменился, возвращается 304
+    """
+    layers = get_all_available_layers(db)
+    for layer in layers:
+        if layer.source_type == "static" and getattr(layer, "summary", None) is None:
+            background_tasks.add_task(get_static_layer_summary, layer.id)
+    return cached_json_response([MapLayer.model_validate(layer) for layer in layers], if_none_match)
 
 # Новый эндпоинт для получения данных слоя по его ID
 @router.get("/maps/layer-data/{layer_id}")
-async def read_layer_data(layer_id: str, db: Session = Depends(get_db)):
-    """Получить данные слоя (GeoJSON) по ID слоя, включая слои из НСПД и статические слои"""
-    layer_data = get_layer_by_id(db, layer_id)
+async def read_layer_data(
+    layer_id: str,
+    background_tasks: BackgroundTasks,
+    precision: Optional[int] = Query(None, ge=0, le=15),
+    output_format: str = Query("geojson", alias="format"),
+    quantization: int = Query(DEFAULT_QUANTIZATION),
+    fields: Optional[str] = Query(None),
+    since: Optional[int] = Query(None, ge=0),
+    bbox: Optional[str] = Query(None),
+    zoom: Optional[float] = Query(None, ge=0, le=24),
+    range_header: Optional[str] = Header(None, alias="Range"),
+    if_range: Optional[str] = Header(None, alias="If-Range"),
+    if_none_match: Optional[str] = Header(None, alias="If-None-Match"),
+    db: Session = Depends(get_db)
+):
+    """
+    Получить данные слоя (GeoJSON) по ID слоя, включая слои из НСПД и статические слои
+    
+    - precision: число знаков после запятой в координатах (6 - около 10 см)
+    - format: geojson или topojson (только для статических слоев, с квантованием quantization:
+      10000, 100000 или 1000000);
+      fgb (FlatGeobuf) и geoparquet - файл статического слоя целиком (bbox, fields и precision
+      не применяются), FlatGeobuf можно читать по диапазонам с помощью его индекса
+    - fields: свойства объектов через запятую; по умолчанию - набор из каталога слоев, fields=* - все
+    - since: версия слоя, уже загруженная клиентом; вернутся только изменения после нее
+      (только для статических слоев)
+    - bbox: min_lng,min_lat,max_lng,max_lat - только объекты в прямоугольнике
+      (для слоев из БД и статических слоев; для слоев nspd_{тип} - обязательная область загрузки).
+      Статический слой читается по индексу своей копии FlatGeobuf, которая создается в фоне
+    - zoom: уровень масштаба карты; точки объединяются в кластеры этого уровня
+      (свойства cluster, cluster_id, point_count), раскрыть кластер можно через
+      /maps/clusters/{cluster_index}/{cluster_id}
+    
+    Статические слои в GeoJSON отдаются с ETag и поддержкой Range/If-Range,
+    поэтому прерванную загрузку можно продолжить с места обрыва.
+    Ответы (кроме since) содержат ETag и Cache-Control: no-cache; на If-None-Match
+    с тем же ETag возвращается 304. ETag статического слоя строится по версии файла,
+    и 304 отдается без загрузки слоя
+    """
+    bbox_values = parse_bbox(bbox)
+    field_list = parse_fields(fields) if fields is not None else get_layer_default_fields(layer_id)
+    
+    if since is not None:
+        if not layer_id.startswith("static_"):
+            raise HTTPException(status_code=400, detail="Изменения по версии доступны только для статических слоев")
+        changes = await run_in_threadpool(get_static_layer_changes, layer_id, since)
+        if changes is None:
+            raise HTTPException(status_code=404, detail=f"Слой с ID {layer_id} не найден")
+        if "upserted" in changes:
+            changes["upserted"] = prepare_collection(changes["upserted"], fields=field_list, precision=precision)
+        return changes
+    
+    if output_format == "topojson":
+        if not layer_id.startswith("static_"):
+            raise HTTPException(status_code=400, detail="TopoJSON доступен только для статических слоев")
+        if quantization not in QUANTIZATION_LEVELS:
+            allowed = ", ".join(str(level) for level in QUANTIZATION_LEVELS)
+            raise HTTPException(status_code=400, detail=f"quantization должен быть одним из значений: {allowed}")
+        etag = get_static_layer_response_etag(layer_id, "topojson", quantization, fields_cache_key(field_list))
+        if etag is not None and etag_matches(if_none_match, etag):
+            return not_modified(etag)
+        topology = await run_in_threadpool(get_static_layer_topojson, layer_id, quantization)
+        if topology is None:
+            raise HTTPException(status_code=404, detail=f"Слой с ID {layer_id} не найден")
+        return cached_json_response(prepare_collection(topology, fields=field_list), if_none_match, etag)
+    if output_format in STATIC_EXPORT_FORMATS:
+        if not layer_id.startswith("static_"):
+            raise HTTPException(status_code=400, detail=f"Формат {output_format} доступен только для статических слоев")
+        etag = get_static_layer_response_etag(layer_id, output_format)
+        if etag is not None and etag_matches(if_none_match, etag):
+            return not_modified(etag)
+        try:
+            exported = await run_in_threadpool(get_static_layer_export, layer_id, output_format)
+        except GeoParquetUnavailable as e:
+            raise HTTPException(status_code=501, detail=str(e))
+        if exported is None:
+            raise HTTPException(status_code=404, detail=f"Слой с ID {layer_id} не найден")
+        path, etag = exported
+        suffix, media_type = STATIC_EXPORT_FORMATS[output_format]
+        return file_range_response(path, etag, range_header, if_range, media_type, headers={
+            "Content-Disposition": f'attachment; filename="{layer_id[7:]}{suffix}"',
+            "Cache-Control": LAYER_CACHE_CONTROL
+        })
+    if output_format != "geojson":
+        raise HTTPException(status_code=400, detail=f"Неподдерживаемый формат: {output_format}")
+    
+    if zoom is not None:
+        clusters = await run_in_threadpool(get_layer_clusters, db, layer_id, zoom, bbox_values, field_list, precision)
+        if clusters is None:
+            raise HTTPException(status_code=404, detail=f"Слой с ID {layer_id} не найден")
+        return cached_json_response(clusters, if_none_match)
+    
+    if layer_id.startswith("static_") and bbox_values is not None:
+        has_export = await run_in_threadpool(find_static_layer_export, layer_id, "fgb") is not None
+        # Из копии FlatGeobuf объекты читаются в другом порядке, поэтому источник входит в ETag
+        etag = get_static_layer_response_etag(layer_id, "bbox", "fgb" if has_export else "layer",
+                                              bbox, fields_cache_key(field_list), precision)
+        if etag is not None and etag_matches(if_none_match, etag):
+            return not_modified(etag)
+        layer_data = await run_in_threadpool(get_static_layer_bbox, layer_id, bbox_values)
+        if layer_data is None:
+            raise HTTPException(status_code=404, detail=f"Слой с ID {layer_id} не найден")
+        if not has_export:
+            background_tasks.add_task(write_static_layer_export, layer_id, "fgb")
+        return cached_json_response(prepare_collection(layer_data, fields=field_list, precision=precision),
+                                    if_none_match, etag)
+    
+    if layer_id.startswith("static_"):
+        field_list = await run_in_threadpool(known_static_layer_fields, layer_id, field_list)
+        etag = get_static_layer_response_etag(layer_id, "encoded", fields_cache_key(field_list), precision)
+        if etag is not None and etag_matches(if_none_match, etag):
+            return not_modified(etag)
+        encoded = await run_in_threadpool(get_static_layer_encoded, layer_id, field_list, precision)
+        if encoded is None:
+            raise HTTPException(status_code=404, detail=f"Слой с ID {layer_id} не найден")
+        body, etag = encoded
+        return range_response(body, etag, range_header, if_range, headers={"Cache-Control": LAYER_CACHE_CONTROL})
+    
+    # Чтение и разбор слоя выполняются в пуле потоков, чтобы не блокировать цикл событий
+    layer_data = await run_in_threadpool(get_layer_by_id, db, layer_id, bbox_values)
     if layer_data is None:
         raise HTTPException(status_code=404, detail=f"Слой с ID {layer_id} не найден")
-    return layer_data
+    return cached_json_response(prepare_collection(layer_data, fields=field_list, precision=precision), if_none_match)
+
+# Раскрытие кластера точек из ответа с параметром zoom
+@router.get("/maps/clusters/{index_id}/{cluster_id}")
+async def read_cluster(
+    index_id: str, cluster_id: int,
+    leaves: bool = Query(False),
+    limit: int = Query(100, ge=1, le=10000),
+    offset: int = Query(0, ge=0)
+):
+    """
+    Содержимое кластера: кластеры и точки следующего уровня масштаба и expansion_zoom -
+    уровень, на котором кластер распадается. leaves=true - исходные точки кластера
+    (по limit штук, начиная с offset)
+    """
+    return await run_in_threadpool(expand_cluster, index_id, cluster_id, leaves, limit, offset)
+
+# Облегченное представление слоя для подписей
+@router.get("/maps/layer-data/{layer_id}/points")
+async def read_layer_points(
+    layer_id: str,
+    precision: Optional[int] = Query(None, ge=0, le=15),
+    fields: Optional[str] = Query(None),
+    bbox: Optional[str] = Query(None),
+    if_none_match: Optional[str] = Header(None, alias="If-None-Match"),
+    db: Session = Depends(get_db)
+):
+    """
+    Точки подписей объектов слоя (полюс недоступности полигона, середина линии)
+    с id объекта и свойствами по умолчанию. Позволяет сразу показать названия
+    и число объектов, пока полные геометрии загружаются целиком или по тайлам.
+    Для статических слоев точки считаются один раз для версии слоя
+    """
+    bbox_values = parse_bbox(bbox)
+    field_list = parse_fields(fields) if fields is not None else get_layer_default_fields(layer_id)
+    etag = None
+    if layer_id.startswith("static_"):
+        etag = get_static_layer_response_etag(layer_id, "points", bbox, fields_cache_key(field_list), precision)
+        if etag is not None and etag_matches(if_none_match, etag):
+            return not_modified(etag)
+    points = await run_in_threadpool(get_layer_points, db, layer_id, bbox_values)
+    if points is None:
+        raise HTTPException(status_code=404, detail=f"Слой с ID {layer_id} не найден")
+    return cached_json_response(prepare_collection(points, fields=field_list, precision=precision), if_none_match, etag)
+
+# Загрузка статического слоя по частям из целых объектов
+@router.get("/maps/layer-data/{layer_id}/parts")
+async def read_layer_parts(layer_id: str):
+    """Число частей статического слоя и их адреса; части можно загружать параллельно"""
+    if not layer_id.startswith("static_"):
+        raise HTTPException(status_code=400, detail="Загрузка по частям доступна только для статических слоев")
+    parts = await run_in_threadpool(get_static_layer_parts, layer_id)
+    if parts is None:
+        raise HTTPException(status_code=404, detail=f"Слой с ID {layer_id} не найден")
+    return parts
+
+@router.get("/maps/layer-data/{layer_id}/parts/{part}")
+async def read_layer_part(
+    layer_id: str, part: int,
+    precision: Optional[int] = Query(None, ge=0, le=15),
+    fields: Optional[str] = Query(None)
+):
+    """
+    Часть статического слоя. Поле etag одинаково для всех частей одной версии
+    слоя: если оно изменилось между частями, загрузку нужно начать заново
+    """
+    if not layer_id.startswith("static_"):
+        raise HTTPException(status_code=400, detail="Загрузка по частям доступна только для статических слоев")
+    collection = await run_in_threadpool(get_static_layer_part, layer_id, part)
+    if collection is None:
+        raise HTTPException(status_code=404, detail=f"Слой с ID {layer_id} не найден")
+    field_list = parse_fields(fields) if fields is not None else get_layer_default_fields(layer_id)
+    return prepare_collection(collection, fields=field_list, precision=precision)
+
+# Объекты статического слоя в тайле XYZ
+@router.get("/maps/layer-data/{layer_id}/tiles/{z}/{x}/{y}")
+async def read_layer_tile(
+    layer_id: str, z: int, x: int, y: int,
+    precision: Optional[int] = Query(None, ge=0, le=15),
+    fields: Optional[str] = Query(None)
+):
+    """Получить объекты статического слоя, пересекающиеся с тайлом z/x/y"""
+    if not layer_id.startswith("static_"):
+        raise HTTPException(status_code=400, detail="Тайлы доступны только для статических слоев")
+    if not is_valid_tile(z, x, y):
+        raise HTTPException(status_code=400, detail=f"Некорректный тайл {z}/{x}/{y}")
+    tile = await run_in_threadpool(get_static_layer_tile, layer_id, z, x, y)
+    if tile is None:
+        raise HTTPException(status_code=404, detail=f"Слой с ID {layer_id} не найден")
+    field_list = parse_fields(fields) if fields is not None else get_layer_default_fields(layer_id)
+    return prepare_collection(tile, fields=field_list, precision=precision)
+
+# Подсказки для предварительной загрузки соседних участков слоя
+@router.get("/maps/layer-data/{layer_id}/prefetch")
+async def prefetch_layer_data(
+    layer_id: str,
+    response: Response,
+    background_tasks: BackgroundTasks,
+    bbox: str = Query(...),
+    zoom: float = Query(..., ge=0, le=22),
+    dx: float = Query(0.0),
+    dy: float = Query(0.0)
+):
+    """
+    По текущему экрану (bbox, zoom) и направлению перемещения карты (dx - на восток,
+    dy - на север) возвращает тайлы, которые стоит загрузить заранее, и прогревает
+    их в кэше сервера после ответа. Те же адреса передаются в заголовке Link: rel=prefetch
+    """
+    if not layer_id.startswith("static_"):
+        raise HTTPException(status_code=400, detail="Предзагрузка доступна только для статических слоев")
+    tiles = await run_in_threadpool(prefetch_tiles, parse_bbox(bbox), zoom, dx, dy)
+    urls = [f"/api/maps/layer-data/{layer_id}/tiles/{z}/{x}/{y}" for z, x, y in tiles]
+    
+    background_tasks.add_task(prefetch_static_layer, layer_id, tiles)
+    if urls:
+        response.headers["Link"] = ", ".join(f"<{url}>; rel=prefetch" for url in urls)
+    return {
+        "layer_id": layer_id,
+        "tiles": [{"z": z, "x": x, "y": y, "url": url} for (z, x, y), url in zip(tiles, urls)],
+    }
+
+# Изменение отдельных объектов статического слоя без повторной загрузки файла
+@router.patch("/maps/layer-data/{layer_id}/features")
+async def patch_layer_features(layer_id: str, changes: LayerFeaturesPatch):
+    """
+    Добавить, заменить или удалить объекты статического слоя по id.
+    Каждый запрос увеличивает версию слоя; клиенты получают изменения через
+    GET /maps/layer-data/{layer_id}?since=<версия>
+    """
+    if not layer_id.startswith("static_"):
+        raise HTTPException(status_code=400, detail="Изменение объектов доступно только для статических слоев")
+    result = await run_in_threadpool(patch_static_layer, layer_id, changes.add, changes.replace, changes.delete)
+    if result is None:
+        raise HTTPException(status_code=404, detail=f"Слой с ID {layer_id} не найден")
+    return result
+
+# Пространственная привязка точек, прямоугольников и результатов поиска к полигонам слоя
+@router.post("/maps/spatial-join/")
+async def spatial_join_layer(request: SpatialJoinRequest):
+    """
+    Найти полигоны статического слоя (по умолчанию - муниципальные образования),
+    содержащие точки [lng, lat] или объекты FeatureCollection (например, результаты
+    поиска НСПД), либо пересекающиеся с прямоугольниками [min_lng, min_lat, max_lng, max_lat]
+    """
+    if any(len(point) < 2 for point in request.points):
+        raise HTTPException(status_code=400, detail="Точка должна быть задана как [lng, lat]")
+    if any(len(bbox) != 4 or bbox[0] > bbox[2] or bbox[1] > bbox[3] for bbox in request.bboxes):
+        raise HTTPException(status_code=400, detail="Прямоугольник должен быть задан как [min_lng, min_lat, max_lng, max_lat]")
+    
+    features = (request.features or {}).get("features") or []
+    fields = request.fields if request.fields is not None else get_layer_default_fields(request.layer_id)
+    # Первое обращение строит индекс по всему слою, поэтому выполняем в пуле потоков
+    result = await run_in_threadpool(
+        spatial_join, request.layer_id, request.points, request.bboxes, features,
+        fields, request.include_geometry
+    )
+    if result is None:
+        raise HTTPException(status_code=404, detail=f"Слой с ID {request.layer_id} не найден")
+    return result
 
 # Эндпоинты для работы со слоями карты
 @router.get("/maps/layers/", response_model=List[MapLayer])
@@ -48,6 +362,25 @@ async def read_map_layers(db: Session = Depends(get_db)):
         # Возвращаем пустой список в случае ошибки
         return []
 
+@router.get("/maps/layers/{layer_id}/summary")
+async def read_layer_summary(layer_id: str, db: Session = Depends(get_db)):
+    """
+    Сводка по слою без загрузки его данных: экстент, число объектов, типы геометрий,
+    число вершин, схема свойств и размер. Для статических слоев дополнительно
+    отдается статистика качества геометрий
+    """
+    if layer_id.startswith("static_"):
+        summary = await run_in_threadpool(get_static_layer_summary, layer_id)
+        if summary is None:
+            raise HTTPException(status_code=404, detail=f"Слой {layer_id} не найден")
+        quality = await run_in_threadpool(get_static_layer_quality, layer_id)
+        return {"layer_id": layer_id, **summary, "quality": quality}
+    if layer_id.isdigit():
+        summary = await run_in_threadpool(get_db_layer_summary, db, int(layer_id))
+        if summary is not None:
+            return {"layer_id": layer_id, **summary}
+    raise HTTPException(status_code=404, detail=f"Сводка для слоя {layer_id} недоступна")
+
 @router.get("/maps/layers/{layer_id}", response_model=MapLayer)
 async def read_map_layer(layer_id: int, db: Session = Depends(get_db)):
     """Получить слой карты по ID"""
@@ -77,6 +410,33 @@ async def delete_layer(layer_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Слой не найден")
     return None
 
+@router.post("/maps/db-layers/", response_model=MapLayer, status_code=status.HTTP_201_CREATED)
+async def create_db_geojson_layer(layer: DbLayerCreate, db: Session = Depends(get_db)):
+    """
+    Сохранить объекты в БД как слой (source_type="db_geojson").
+    Объекты берутся из features (FeatureCollection) или из результата поиска НСПД nspd_search;
+    данные слоя затем загружаются через /maps/layer-data/{id}?bbox=...
+    """
+    if (layer.features is None) == (layer.nspd_search is None):
+        raise HTTPException(status_code=400, detail="Нужно указать либо features, либо nspd_search")
+    
+    if layer.nspd_search is not None:
+        search = layer.nspd_search
+        collection = await run_in_threadpool(
+            multi_thematic_search, search.query, search.thematic_search,
+            search.north, search.east, search.south, search.west, search.fields
+        )
+        # Пустой или неполный результат из-за ошибки НСПД не сохраняется как слой
+        if collection.get("fallback") or collection.get("error") or collection.get("partial"):
+            raise HTTPException(status_code=503, detail=collection.get("message") or "NSPD API временно недоступен")
+    else:
+        collection = layer.features
+    
+    features = collection.get("features") or []
+    return await run_in_threadpool(
+        create_db_layer, db, layer.name, layer.description, layer.style, features
+    )
+
 # Эндпоинты для работы с представлениями карты
 @router.get("/maps/views/", response_model=List[MapView])
 async def read_map_views(db: Session = Depends(get_db)):
@@ -112,39 +472,72 @@ async def delete_view(view_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Представление не найдено")
     return None
 
-# Новый эндпоинт для загрузки статического GeoJSON слоя
+# Форматы загружаемых слоев по расширению файла
+UPLOAD_FORMATS = {".geojson": "geojson", ".fgb": "fgb", ".parquet": "geoparquet", ".geoparquet": "geoparquet"}
+
+# Новый эндпоинт для загрузки статического слоя
 @router.post("/maps/upload-layer/", status_code=status.HTTP_201_CREATED)
 async def upload_static_layer(
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     name: Optional[str] = Form(None),
     description: Optional[str] = Form(None),
     db: Session = Depends(get_db)
 ):
-    """Загрузить статический GeoJSON слой на сервер"""
+    """
+    Загрузить статический слой на сервер: GeoJSON, FlatGeobuf (.fgb) или GeoParquet
+    (.parquet, .geoparquet) в EPSG:4326. Слой сохраняется в GeoJSON, копия FlatGeobuf
+    для чтения по bbox создается в фоне
+    """
     # Проверка типа файла
-    if not file.filename.endswith('.geojson'):
+    input_format = UPLOAD_FORMATS.get(os.path.splitext(file.filename)[1].lower())
+    if input_format is None:
         raise HTTPException(
             status_code=400,
-            detail="Поддерживаются только файлы формата GeoJSON (.geojson)"
+            detail="Поддерживаются файлы GeoJSON (.geojson), FlatGeobuf (.fgb) и GeoParquet (.parquet, .geoparquet)"
         )
     
-    # Проверка содержимого GeoJSON
-    try:
-        # Читаем JSON из файла
-        content = await file.read()
-        geojson_data = json.loads(content.decode('utf-8'))
-        
-        # Проверяем, что это валидный GeoJSON
-        if 'type' not in geojson_data or (
-            geojson_data['type'] != 'FeatureCollection' and 
-            geojson_data['type'] != 'Feature'
-        ):
-            raise ValueError("Файл не является валидным GeoJSON")
-    except (json.JSONDecodeError, UnicodeDecodeError, ValueError) as e:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Ошибка при обработке файла: {str(e)}"
+    if input_format != "geojson":
+        # FlatGeobuf и GeoParquet читаются потоково из временного файла загрузки
+        try:
+            geojson_data = await run_in_threadpool(import_layer_file, file.file, input_format)
+        except GeoParquetUnavailable as e:
+            raise HTTPException(status_code=501, detail=str(e))
+        content = None
+    else:
+        # Проверка содержимого GeoJSON
+        try:
+            # Читаем JSON из файла
+            content = await file.read()
+            geojson_data = json.loads(content.decode('utf-8'))
+            
+            # Проверяем, что это валидный GeoJSON
+            if 'type' not in geojson_data or (
+                geojson_data['type'] != 'FeatureCollection' and 
+                geojson_data['type'] != 'Feature'
+            ):
+                raise ValueError("Файл не является валидным GeoJSON")
+        except (json.JSONDecodeError, UnicodeDecodeError, ValueError) as e:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Ошибка при обработке файла: {str(e)}"
+            )
+    
+    # Проверяем и исправляем геометрии при загрузке, чтобы не делать этого при каждом запросе
+    if geojson_data['type'] == 'FeatureCollection':
+        features, quality = await run_in_threadpool(
+            validate_features, geojson_data.get('features') or [], "upload"
         )
+        if quality.total and not features:
+            raise HTTPException(status_code=400, detail="В файле нет объектов с пригодной геометрией")
+        geojson_data['features'] = features
+    else:
+        features, quality = validate_features([geojson_data], "upload")
+        if not features:
+            raise HTTPException(status_code=400, detail="Геометрия объекта непригодна")
+        geojson_data = features[0]
+    if content is None or quality.repaired or quality.rejected:
+        content = json.dumps(geojson_data, ensure_ascii=False).encode('utf-8')
     
     # Генерируем безопасное имя файла
     original_filename = file.filename
@@ -171,11 +564,9 @@ async def upload_static_layer(
     
     # Сохраняем файл
     try:
-        with open(save_path, "wb") as f:
-            # Перематываем файл в начало
-            await file.seek(0)
-            # Читаем и записываем содержимое
-            f.write(await file.read())
+        # Записываем содержимое (исправленное, если геометрии пришлось исправлять,
+        # или преобразованное из FlatGeobuf и GeoParquet); версия слоя продолжает прежнюю
+        await run_in_threadpool(save_static_layer_file, save_path, geojson_data, content)
     except Exception as e:
         raise HTTPException(
             status_code=500, 
@@ -195,9 +586,12 @@ async def upload_static_layer(
         source_url=f"/static/layers/{safe_filename}",
         style={"fillColor": "#0080ff", "fillOpacity": 0.5, "outlineColor": "#000"}
     )
+    # Копия FlatGeobuf для чтения слоя по bbox
+    background_tasks.add_task(write_static_layer_export, layer_id, "fgb")
     
     return {
         "success": True,
         "message": "Слой успешно загружен",
-        "layer": layer
+        "layer": layer,
+        "quality": quality.as_dict()
     } 
\ No newline at end of file
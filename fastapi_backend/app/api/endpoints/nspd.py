@@ -1,15 +1,56 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response
 from typing import Optional
 from app.api.schemas.nspd_schemas import ThematicSearchRequest, FeatureCollection
-from app.api.services.nspd_service import thematic_search as nspd_thematic_search, get_fallback_response
+from app.api.services.nspd_service import (
+    multi_thematic_search as nspd_thematic_search, parse_thematic_types, get_fallback_response, nspd_admission,
+    search_cache_control
+)
+from app.api.services.rate_limit import is_trusted_proxy
+from app.api.services.geojson_encoding import apply_precision, parse_fields
+from app.api.services.suggest_index import suggest_index
+from app.api.services.clustering import CLUSTER_INDEX_TTL, cluster_index_id, cluster_collection, collection_fingerprint
+from app.api.services.cancellation import RequestCancelled, run_cancellable
+from app.api.services.http_cache import cached_json_response
+from app.api.services.map_service import STATIC_LAYER_CATALOG, schedule_static_layers_indexing
 import logging
 
 router = APIRouter(tags=["nspd"])
 
+# Статус ответа на запрос, клиент которого отключился (как в nginx); клиент его не получит
+CLIENT_CLOSED_REQUEST = 499
+
 logger = logging.getLogger(__name__)
 
-@router.post("/nspd/thematic-search/", response_model=FeatureCollection)
-async def search_thematic(request: ThematicSearchRequest):
+def get_client_id(request: Request) -> str:
+    """
+    Идентификатор клиента: адрес из X-Real-IP, если соединение пришло от доверенного
+    прокси (TRUSTED_PROXIES, например nginx), иначе адрес соединения
+    """
+    peer = request.client.host if request.client else "unknown"
+    real_ip = request.headers.get("x-real-ip")
+    if real_ip and is_trusted_proxy(peer):
+        return real_ip.strip()
+    return peer
+
+async def admit_nspd_request(request: Request):
+    """Зависимость: ставит запрос в очередь допуска к НСПД или отклоняет его с 429/503"""
+    async with nspd_admission.admit(get_client_id(request)):
+        yield
+
+def cluster_search_result(result: dict, zoom: Optional[float], *key_parts) -> dict:
+    """
+    Заменяет точки результата поиска кластерами уровня zoom. Индекс кластеров хранится
+    CLUSTER_INDEX_TTL секунд для раскрытия кластеров; в ключ входят параметры поиска
+    и отпечаток содержимого ответа, поэтому новый ответ НСПД получает новый индекс
+    """
+    if zoom is None:
+        return result
+    index_id = cluster_index_id("search", *key_parts, collection_fingerprint(result))
+    return cluster_collection(index_id, zoom, lambda: result, ttl=CLUSTER_INDEX_TTL)
+
+@router.post("/nspd/thematic-search/", response_model=FeatureCollection,
+             dependencies=[Depends(admit_nspd_request)])
+async def search_thematic(request: ThematicSearchRequest, http_request: Request):
     """
     Выполняет тематический поиск в НСПД
     
@@ -19,17 +60,36 @@ async def search_thematic(request: ThematicSearchRequest):
     - admin_del: Административные деления
     - zouit: Зоны с особыми условиями использования территорий
     - ter_zone: Территориальные зоны
+    
+    Несколько типов указываются через запятую, all - поиск сразу по всем типам
+    (запросы выполняются параллельно, у объектов указан тип в свойстве thematic_search)
+    
+    zoom - уровень масштаба карты: точки объединяются в кластеры
+    
+    Если клиент отключился, не дождавшись ответа, поиск прекращается
     """
     try:
-        result = nspd_thematic_search(
+        # Поиск выполняется в пуле потоков, чтобы не блокировать цикл событий,
+        # и прекращается, если клиент отключится
+        result = await run_cancellable(
+            http_request,
+            nspd_thematic_search,
             query=request.query,
-            thematic_search=request.thematic_search,
+            thematic_search_types=request.thematic_search,
             north=request.north,
             east=request.east,
             south=request.south,
-            west=request.west
+            west=request.west,
+            fields=request.fields
         )
-        return result
+        result = apply_precision(result, request.precision)
+        return cluster_search_result(
+            result, request.zoom, request.query, request.thematic_search,
+            request.north, request.east, request.south, request.west, request.fields, request.precision
+        )
+    except RequestCancelled:
+        logger.info(f"Клиент отключился, поиск '{request.query}' прекращен")
+        return Response(status_code=CLIENT_CLOSED_REQUEST)
     except Exception as e:
         logger.exception(f"Ошибка при выполнении тематического поиска (POST): {str(e)}")
         # Возвращаем пустую коллекцию вместо ошибки 500
@@ -39,14 +99,20 @@ async def search_thematic(request: ThematicSearchRequest):
             "message": "Произошла ошибка при поиске. Пожалуйста, попробуйте позже."
         }
 
-@router.get("/nspd/thematic-search/", response_model=FeatureCollection)
+@router.get("/nspd/thematic-search/", response_model=FeatureCollection,
+            dependencies=[Depends(admit_nspd_request)])
 async def search_thematic_get(
+    request: Request,
     query: str,
     thematic_search: str,
     north: Optional[float] = Query(None),
     east: Optional[float] = Query(None),
     south: Optional[float] = Query(None),
-    west: Optional[float] = Query(None)
+    west: Optional[float] = Query(None),
+    precision: Optional[int] = Query(None, ge=0, le=15),
+    fields: Optional[str] = Query(None),
+    zoom: Optional[float] = Query(None, ge=0, le=24),
+    if_none_match: Optional[str] = Header(None, alias="If-None-Match")
 ):
     """
     Выполняет тематический поиск в НСПД через GET запрос
@@ -57,6 +123,16 @@ async def search_thematic_get(
     - admin_del: Административные деления
     - zouit: Зоны с особыми условиями использования территорий
     - ter_zone: Территориальные зоны
+    
+    Несколько типов указываются через запятую, all - поиск сразу по всем типам
+    
+    precision - число знаков после запятой в координатах ответа (6 - около 10 см)
+    fields - свойства объектов через запятую, например fields=name,cad_number (по умолчанию все)
+    zoom - уровень масштаба карты: точки объединяются в кластеры (свойство point_count),
+    кластер раскрывается через /maps/clusters/{cluster_index}/{cluster_id}
+    
+    Успешный поиск по кадастровому номеру отдается с ETag и Cache-Control: max-age,
+    на If-None-Match с тем же ETag возвращается 304
     """
     try:
         # Логируем детали запроса для отладки
@@ -73,7 +149,7 @@ async def search_thematic_get(
             }
             
         # Проверяем, что тип тематического поиска валидный
-        if thematic_search not in ["objects", "cad_del", "admin_del", "zouit", "ter_zone"]:
+        if parse_thematic_types(thematic_search) is None:
             logger.warning(f"Получен неверный тип тематического поиска: {thematic_search}")
             return {
                 "type": "FeatureCollection",
@@ -81,14 +157,18 @@ async def search_thematic_get(
                 "message": f"Неподдерживаемый тип тематического поиска: {thematic_search}"
             }
         
-        # Выполняем поиск
-        result = nspd_thematic_search(
+        # Выполняем поиск в пуле потоков, чтобы не блокировать цикл событий;
+        # если клиент отключится (например, начал новый поиск), поиск прекращается
+        result = await run_cancellable(
+            request,
+            nspd_thematic_search,
             query=query,
-            thematic_search=thematic_search,
+            thematic_search_types=thematic_search,
             north=north,
             east=east,
             south=south,
-            west=west
+            west=west,
+            fields=parse_fields(fields)
         )
         
         # Проверяем, что получен валидный результат
@@ -104,7 +184,15 @@ async def search_thematic_get(
         feature_count = len(result.get("features", []))
         logger.info(f"Найдено объектов: {feature_count}")
         
-        return result
+        cache_control = search_cache_control(query, result)
+        result = apply_precision(result, precision)
+        result = cluster_search_result(result, zoom, query, thematic_search, north, east, south, west, fields, precision)
+        if cache_control is None:
+            return result
+        return cached_json_response(FeatureCollection.model_validate(result), if_none_match, cache_control=cache_control)
+    except RequestCancelled:
+        logger.info(f"Клиент отключился, поиск '{query}' прекращен")
+        return Response(status_code=CLIENT_CLOSED_REQUEST)
     except Exception as e:
         logger.exception(f"Необработанная ошибка при выполнении тематического поиска через GET: {str(e)}")
         # Возвращаем пустую коллекцию вместо ошибки 500
@@ -114,6 +202,40 @@ async def search_thematic_get(
             "message": "Произошла ошибка при поиске. Пожалуйста, попробуйте позже."
         }
 
+@router.get("/nspd/suggest")
+async def suggest(
+    request: Request,
+    q: str = Query(..., min_length=1),
+    limit: int = Query(10, ge=1, le=50),
+    upstream: bool = Query(False),
+    thematic_search: str = Query("all")
+):
+    """
+    Подсказки для строки поиска по префиксу q: названия объектов статических слоев
+    и объектов, уже найденных в НСПД. Отвечает из индекса в памяти без обращения к НСПД.
+    
+    upstream=true - если подсказок меньше limit, выполнить поиск в НСПД
+    (тип поиска thematic_search, по умолчанию all); найденное пополнит индекс
+    """
+    # Названия объектов статических слоев индексируются после первой загрузки слоя;
+    # пока индексация идет, новые запросы подсказок не запускают ее повторно
+    if any(not suggest_index.has_source(layer_id) for layer_id in STATIC_LAYER_CATALOG):
+        schedule_static_layers_indexing()
+    
+    suggestions = suggest_index.search(q, limit)
+    used_upstream = False
+    if upstream and len(suggestions) < limit and q.strip():
+        if parse_thematic_types(thematic_search) is None:
+            raise HTTPException(status_code=400, detail=f"Неподдерживаемый тип тематического поиска: {thematic_search}")
+        async with nspd_admission.admit(get_client_id(request)):
+            try:
+                await run_cancellable(request, nspd_thematic_search, q, thematic_search)
+            except RequestCancelled:
+                return Response(status_code=CLIENT_CLOSED_REQUEST)
+        used_upstream = True
+        suggestions = suggest_index.search(q, limit)
+    return {"query": q, "suggestions": suggestions, "upstream": used_upstream}
+
 @router.get("/nspd/fallback/", response_model=FeatureCollection)
 async def nspd_fallback():
     """
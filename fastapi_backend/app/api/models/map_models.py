@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, Table, DateTime, JSON, text
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, Table, DateTime, JSON, Index, text
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from app.database import Base
@@ -26,6 +26,9 @@ class MapLayer(Base):
     
     # Отношение к представлениям
     views = relationship("MapView", secondary=map_view_layers, back_populates="layers")
+    
+    # Объекты слоя, хранящиеся в БД (source_type="db_geojson")
+    features = relationship("LayerFeature", back_populates="layer", cascade="all, delete-orphan", lazy="dynamic")
 
 class MapView(Base):
     """Модель для представлений карты"""
@@ -53,4 +56,26 @@ class SearchableObject(Base):
     geometry = Column(JSON)
     properties = Column(JSON, default={})
     created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow) 
\ No newline at end of file
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow) 
+
+class LayerFeature(Base):
+    """Модель для объектов слоев, хранящихся в БД (по строке на объект)"""
+    __tablename__ = "layer_features"
+
+    id = Column(Integer, primary_key=True, index=True)
+    layer_id = Column(Integer, ForeignKey("map_layers.id", ondelete="CASCADE"), nullable=False)
+    feature_id = Column(String, nullable=True)  # Исходный id объекта (например, из НСПД)
+    geometry = Column(JSON)
+    properties = Column(JSON, default={})
+    # Экстент геометрии для выборки по прямоугольнику
+    min_x = Column(Float)
+    min_y = Column(Float)
+    max_x = Column(Float)
+    max_y = Column(Float)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    layer = relationship("MapLayer", back_populates="features")
+    
+    __table_args__ = (
+        Index("ix_layer_features_layer_bbox", "layer_id", "min_x", "max_x", "min_y", "max_y"),
+    )
@@ -1,6 +1,7 @@
 from pydantic import BaseModel, Field
 from typing import List, Dict, Any, Optional
 from datetime import datetime
+from app.api.schemas.nspd_schemas import ThematicSearchRequest
 
 # Базовые модели для слоев
 class MapLayerBase(BaseModel):
@@ -20,12 +21,37 @@ class MapLayerUpdate(MapLayerBase):
 
 class MapLayer(MapLayerBase):
     id: Any  # Может быть строкой или числом
+    default_fields: Optional[List[str]] = None  # Свойства объектов, отдаваемые по умолчанию
+    summary: Optional[Dict[str, Any]] = None  # Сводка по слою, если уже посчитана
     created_at: Optional[datetime] = None
     updated_at: Optional[datetime] = None
 
     class Config:
         from_attributes = True
 
+# Слой с объектами в БД: из переданной FeatureCollection или из результата поиска НСПД
+class DbLayerCreate(BaseModel):
+    name: str
+    description: Optional[str] = None
+    style: Dict[str, Any] = Field(default_factory=dict)
+    features: Optional[Dict[str, Any]] = None  # FeatureCollection
+    nspd_search: Optional[ThematicSearchRequest] = None
+
+# Запрос пространственной привязки к полигонам статического слоя
+class SpatialJoinRequest(BaseModel):
+    layer_id: str = "static_layer_category_39892"
+    points: List[List[float]] = Field(default_factory=list)  # [[lng, lat], ...]
+    bboxes: List[List[float]] = Field(default_factory=list)  # [[min_lng, min_lat, max_lng, max_lat], ...]
+    features: Optional[Dict[str, Any]] = None  # FeatureCollection, например результат поиска НСПД
+    fields: Optional[List[str]] = None  # По умолчанию - набор из каталога слоев
+    include_geometry: bool = True
+
+# Изменение отдельных объектов статического слоя
+class LayerFeaturesPatch(BaseModel):
+    add: List[Dict[str, Any]] = Field(default_factory=list)  # Новые объекты (id назначается, если не указан)
+    replace: List[Dict[str, Any]] = Field(default_factory=list)  # Объекты с id, заменяющие существующие
+    delete: List[Any] = Field(default_factory=list)  # id удаляемых объектов
+
 # Базовые модели для представлений
 class MapViewBase(BaseModel):
     name: str
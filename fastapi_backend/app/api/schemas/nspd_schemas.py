@@ -4,16 +4,19 @@ from typing import Dict, Any, Optional, List, Union
 class ThematicSearchRequest(BaseModel):
     """Схема для запроса тематического поиска в НСПД"""
     query: str
-    thematic_search: str  # objects, cad_del, admin_del, zouit, ter_zone
+    thematic_search: str  # objects, cad_del, admin_del, zouit, ter_zone, несколько через запятую или all
     north: Optional[float] = None
     east: Optional[float] = None
     south: Optional[float] = None
     west: Optional[float] = None
+    precision: Optional[int] = Field(None, ge=0, le=15)  # Знаков после запятой в координатах
+    fields: Optional[List[str]] = None  # Свойства объектов в ответе (None - все)
+    zoom: Optional[float] = Field(None, ge=0, le=24)  # Уровень масштаба для кластеризации точек
 
 class Feature(BaseModel):
     """Схема для представления GeoJSON Feature"""
     type: str = "Feature"
-    geometry: Dict[str, Any]
+    geometry: Optional[Dict[str, Any]] = None  # null - у объекта НСПД нет пригодной геометрии
     properties: Dict[str, Any] = Field(default_factory=dict)
     id: Optional[str] = None
 
@@ -22,4 +25,9 @@ class FeatureCollection(BaseModel):
     type: str = "FeatureCollection"
     features: List[Feature] = []
     fallback: Optional[bool] = False
-    message: Optional[str] = None 
\ No newline at end of file
+    error: Optional[bool] = False  # Поиск не выполнен из-за ошибки НСПД или сервера
+    message: Optional[str] = None
+    thematic_search: Optional[str] = None  # Тип, по которому выполнен поиск (с учетом распознанного кадастрового номера)
+    categories: Optional[Dict[str, int]] = None  # Число найденных объектов по типам (поиск по нескольким типам)
+    cluster_index: Optional[str] = None  # Индекс кластеров для раскрытия кластера (ответ с zoom)
+    zoom: Optional[float] = None
@@ -0,0 +1,99 @@
+import socket
+import threading
+from typing import Any, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+# Попытка, которая выполняется в текущем потоке: соединения регистрируются в ней при открытии
+_current = threading.local()
+
+
+class AbortableAttempt:
+    """
+    Соединения одной попытки HTTP-запроса. abort() закрывает их сокеты: блокирующее
+    ожидание ответа в потоке попытки сразу завершается ошибкой соединения, и поток
+    освобождается, не дожидаясь таймаута попытки
+    """
+
+    def __init__(self):
+        self.aborted = False
+        self._sockets: List[socket.socket] = []
+        self._lock = threading.Lock()
+
+    def register(self, sock: Optional[socket.socket]) -> None:
+        if sock is None:
+            return
+        with self._lock:
+            self._sockets.append(sock)
+            aborted = self.aborted
+        # Соединение открылось уже после отмены попытки
+        if aborted:
+            _shutdown(sock)
+
+    def abort(self) -> None:
+        with self._lock:
+            self.aborted = True
+            sockets = list(self._sockets)
+        for sock in sockets:
+            _shutdown(sock)
+
+
+def _shutdown(sock: socket.socket) -> None:
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        # Сокет уже закрыт: попытка завершилась раньше
+        pass
+
+
+class _AbortableHTTPConnection(HTTPConnection):
+    def connect(self) -> None:
+        super().connect()
+        attempt = getattr(_current, "attempt", None)
+        if attempt is not None:
+            attempt.register(self.sock)
+
+
+class _AbortableHTTPSConnection(HTTPSConnection):
+    def connect(self) -> None:
+        super().connect()
+        attempt = getattr(_current, "attempt", None)
+        if attempt is not None:
+            attempt.register(self.sock)
+
+
+class _AbortableHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _AbortableHTTPConnection
+
+
+class _AbortableHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _AbortableHTTPSConnection
+
+
+class _AbortableAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args: Any, **kwargs: Any) -> None:
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _AbortableHTTPConnectionPool,
+            "https": _AbortableHTTPSConnectionPool,
+        }
+
+
+def abortable_get(attempt: AbortableAttempt, url: str, **kwargs: Any) -> requests.Response:
+    """
+    requests.get, соединения которого можно закрыть из другого потока через attempt.abort().
+    Каждая попытка использует свою сессию, поэтому соединения разных попыток не смешиваются
+    """
+    if attempt.aborted:
+        raise requests.exceptions.ConnectionError("Попытка запроса отменена")
+    _current.attempt = attempt
+    try:
+        with requests.Session() as session:
+            session.mount("http://", _AbortableAdapter())
+            session.mount("https://", _AbortableAdapter())
+            return session.get(url, **kwargs)
+    finally:
+        _current.attempt = None
@@ -0,0 +1,276 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Тип бэкенда кэша по умолчанию: memory, sqlite, redis.
+# Для отдельного пространства имен можно задать CACHE_BACKEND_<NAMESPACE>,
+# например CACHE_BACKEND_LAYERS=memory
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")
+CACHE_SQLITE_PATH = os.getenv("CACHE_SQLITE_PATH", "./cache.db")
+CACHE_MEMORY_MAX_ENTRIES = int(os.getenv("CACHE_MEMORY_MAX_ENTRIES", "1024"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+# Как часто (секунд) удалять из SQLite записи с истекшим сроком
+CACHE_SQLITE_PURGE_INTERVAL = float(os.getenv("CACHE_SQLITE_PURGE_INTERVAL", "60"))
+
+
+class CacheBackend(ABC):
+    """Базовый интерфейс бэкенда кэша"""
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[Any]:
+        """Возвращает значение по ключу или None, если его нет или срок истек"""
+
+    @abstractmethod
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        """Сохраняет значение; ttl - время жизни в секундах (None - бессрочно)"""
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        """Удаляет значение по ключу"""
+
+    @abstractmethod
+    def clear(self) -> None:
+        """Очищает все значения этого пространства имен"""
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
+
+
+class InMemoryCacheBackend(CacheBackend):
+    """
+    Кэш внутри процесса (LRU с ограничением числа записей).
+    Значения хранятся без сериализации, как в обычном словаре.
+    Если задан max_bytes, суммарный размер значений (по функции sizeof)
+    тоже ограничен; значение больше max_bytes не сохраняется
+    """
+
+    def __init__(self, max_entries: int = CACHE_MEMORY_MAX_ENTRIES, max_bytes: Optional[int] = None,
+                 sizeof: Optional[Callable[[Any], int]] = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def _evict(self, key: str) -> None:
+        del self._data[key]
+        self._total_bytes -= self._sizes.pop(key, 0)
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at is not None and expires_at < time.time():
+                self._evict(key)
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        expires_at = time.time() + ttl if ttl else None
+        size = self.sizeof(value) if self.max_bytes is not None and self.sizeof else 0
+        with self._lock:
+            if key in self._data:
+                self._evict(key)
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            self._data[key] = (value, expires_at)
+            self._sizes[key] = size
+            self._total_bytes += size
+            while len(self._data) > self.max_entries or (
+                    self.max_bytes is not None and self._total_bytes > self.max_bytes):
+                self._evict(next(iter(self._data)))
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            if key in self._data:
+                self._evict(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._sizes.clear()
+            self._total_bytes = 0
+
+
+class SQLiteCacheBackend(CacheBackend):
+    """
+    Кэш в файле SQLite, общий для всех воркеров на одном хосте.
+    Значения сериализуются в JSON. Записи с истекшим сроком удаляются
+    при записи не чаще раза в CACHE_SQLITE_PURGE_INTERVAL секунд
+    """
+
+    def __init__(self, path: str = CACHE_SQLITE_PATH, namespace: str = "default"):
+        self.path = path
+        self.namespace = namespace
+        self._local = threading.local()
+        self._purged_at = 0.0
+        conn = self._connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+            "expires_at REAL, PRIMARY KEY (namespace, key))"
+        )
+        conn.commit()
+
+    def _connection(self) -> sqlite3.Connection:
+        # Соединения SQLite нельзя разделять между потоками, поэтому у каждого потока свое
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            # WAL позволяет читать параллельно с записью из других процессов
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[Any]:
+        try:
+            row = self._connection().execute(
+                "SELECT value, expires_at FROM cache WHERE namespace = ? AND key = ?",
+                (self.namespace, key)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"Ошибка чтения из SQLite-кэша: {str(e)}")
+            return None
+        if row is None:
+            return None
+        value, expires_at = row
+        if expires_at is not None and expires_at < time.time():
+            self.delete(key)
+            return None
+        return json.loads(value)
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        expires_at = time.time() + ttl if ttl else None
+        try:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (self.namespace, key, json.dumps(value, ensure_ascii=False), expires_at)
+            )
+            conn.commit()
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            logger.warning(f"Ошибка записи в SQLite-кэш: {str(e)}")
+        self._purge_expired()
+
+    def _purge_expired(self) -> None:
+        """Удаляет записи с истекшим сроком всех пространств имен (файл кэша общий)"""
+        now = time.time()
+        if now - self._purged_at < CACHE_SQLITE_PURGE_INTERVAL:
+            return
+        self._purged_at = now
+        try:
+            conn = self._connection()
+            conn.execute("DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at < ?", (now,))
+            conn.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"Ошибка очистки устаревших записей SQLite-кэша: {str(e)}")
+
+    def delete(self, key: str) -> None:
+        try:
+            conn = self._connection()
+            conn.execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (self.namespace, key))
+            conn.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"Ошибка удаления из SQLite-кэша: {str(e)}")
+
+    def clear(self) -> None:
+        try:
+            conn = self._connection()
+            conn.execute("DELETE FROM cache WHERE namespace = ?", (self.namespace,))
+            conn.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"Ошибка очистки SQLite-кэша: {str(e)}")
+
+
+class RedisCacheBackend(CacheBackend):
+    """
+    Кэш в Redis, общий для воркеров на нескольких хостах.
+    Требует установленного пакета redis
+    """
+
+    def __init__(self, url: str = REDIS_URL, namespace: str = "default"):
+        import redis  # Опциональная зависимость
+
+        self.client = redis.Redis.from_url(url)
+        self.prefix = f"mgis:{namespace}:"
+
+    def get(self, key: str) -> Optional[Any]:
+        try:
+            value = self.client.get(self.prefix + key)
+        except Exception as e:
+            logger.warning(f"Ошибка чтения из Redis: {str(e)}")
+            return None
+        return json.loads(value) if value is not None else None
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        try:
+            self.client.set(
+                self.prefix + key,
+                json.dumps(value, ensure_ascii=False),
+                ex=int(ttl) if ttl else None
+            )
+        except Exception as e:
+            logger.warning(f"Ошибка записи в Redis: {str(e)}")
+
+    def delete(self, key: str) -> None:
+        try:
+            self.client.delete(self.prefix + key)
+        except Exception as e:
+            logger.warning(f"Ошибка удаления из Redis: {str(e)}")
+
+    def clear(self) -> None:
+        try:
+            for key in self.client.scan_iter(match=self.prefix + "*"):
+                self.client.delete(key)
+        except Exception as e:
+            logger.warning(f"Ошибка очистки Redis: {str(e)}")
+
+
+# Созданные бэкенды по пространствам имен
+_backends: Dict[str, CacheBackend] = {}
+
+
+def get_cache_backend(namespace: str, backend: Optional[str] = None) -> CacheBackend:
+    """
+    Возвращает бэкенд кэша для пространства имен (nspd, layers и т.д.).
+    Тип берется из аргумента, CACHE_BACKEND_<NAMESPACE> или CACHE_BACKEND
+    """
+    if namespace in _backends:
+        return _backends[namespace]
+
+    backend_type = (
+        backend
+        or os.getenv(f"CACHE_BACKEND_{namespace.upper()}")
+        or CACHE_BACKEND
+    ).lower()
+
+    instance: CacheBackend
+    try:
+        if backend_type == "sqlite":
+            instance = SQLiteCacheBackend(CACHE_SQLITE_PATH, namespace=namespace)
+        elif backend_type == "redis":
+            instance = RedisCacheBackend(REDIS_URL, namespace=namespace)
+        else:
+            instance = InMemoryCacheBackend()
+    except Exception as e:
+        # Например, не установлен пакет redis или недоступен файл кэша
+        logger.warning(f"Не удалось создать кэш '{backend_type}' для '{namespace}', используем память: {str(e)}")
+        instance = InMemoryCacheBackend()
+
+    logger.info(f"Кэш '{namespace}': {type(instance).__name__}")
+    _backends[namespace] = instance
+    return instance
@@ -0,0 +1,89 @@
+import re
+from typing import Optional
+
+# Уровни кадастрового номера по числу частей и тип тематического поиска для каждого:
+# 77 - кадастровый округ, 77:01 - район, 77:01:0001001 - квартал (кадастровые деления),
+# 77:01:0001001:1234 - объект недвижимости (участок, здание, помещение)
+CADASTRAL_LEVELS = {
+    1: ("okrug", "cad_del"),
+    2: ("district", "cad_del"),
+    3: ("quarter", "cad_del"),
+    4: ("object", "objects"),
+}
+
+# Реестровые номера зон: 77:01-6.123 - ЗОУИТ, 77:01-7.45 - территориальная зона
+ZONE_TYPES = {
+    "6": ("zouit", "zouit"),
+    "7": ("ter_zone", "ter_zone"),
+}
+
+_SEGMENT_LENGTHS = (2, 2, 7, 9)
+_SEPARATORS = re.compile(r"\s*[:：;]\s*")
+_ZONE_NUMBER = re.compile(r"^(\d{1,2}):(\d{1,2})\s*-\s*(\d+)\.(\d+)$")
+_SPACED_NUMBER = re.compile(r"\d{1,2} \d{1,2} \d{6,7}( \d+)?")
+
+
+class QueryAnalysis:
+    """Результат разбора поискового запроса"""
+
+    def __init__(self, query: str, kind: Optional[str] = None, thematic_search: Optional[str] = None):
+        # Запрос в каноническом виде: он же используется в ключе кэша
+        self.query = query
+        # Уровень кадастрового номера или тип зоны; None - обычный текстовый запрос
+        self.kind = kind
+        # Тип тематического поиска, в котором объект может быть найден
+        self.thematic_search = thematic_search
+
+    @property
+    def is_cadastral(self) -> bool:
+        return self.kind is not None
+
+
+def _canonical_segments(segments):
+    """Проверяет части кадастрового номера и приводит их к каноническому виду"""
+    if not 1 <= len(segments) <= 4:
+        return None
+    result = []
+    for i, segment in enumerate(segments):
+        if not segment.isdigit() or len(segment) > _SEGMENT_LENGTHS[i]:
+            return None
+        if i < 2:
+            # Номера округа и района всегда двузначные: 7:1 -> 07:01
+            segment = segment.zfill(2)
+        elif i == 3:
+            # Номер объекта в квартале пишется без ведущих нулей
+            segment = segment.lstrip("0") or "0"
+        result.append(segment)
+    return result
+
+
+def analyze_query(query: str) -> QueryAnalysis:
+    """
+    Разбирает поисковый запрос: нормализует пробелы и разделители и определяет,
+    является ли он кадастровым номером (и какого уровня) или реестровым номером зоны.
+    Для таких запросов возвращается тип тематического поиска, в котором их нужно искать
+    """
+    text = " ".join(query.split())
+    if not text:
+        return QueryAnalysis(text)
+
+    zone = _ZONE_NUMBER.match(text)
+    if zone and zone.group(3) in ZONE_TYPES:
+        okrug, district, zone_type, number = zone.groups()
+        kind, thematic_search = ZONE_TYPES[zone_type]
+        return QueryAnalysis(f"{okrug.zfill(2)}:{district.zfill(2)}-{zone_type}.{number}", kind, thematic_search)
+
+    if _SEPARATORS.search(text):
+        segments = _SEPARATORS.split(text)
+    elif _SPACED_NUMBER.fullmatch(text):
+        # Номер квартала или объекта, набранный через пробелы: 77 01 0001001 1234.
+        # Номер квартала должен быть полным (6-7 цифр), иначе "12 34 56" - обычный текст
+        segments = text.split(" ")
+    else:
+        segments = None
+    if segments:
+        canonical = _canonical_segments(segments)
+        if canonical is not None:
+            kind, thematic_search = CADASTRAL_LEVELS[len(canonical)]
+            return QueryAnalysis(":".join(canonical), kind, thematic_search)
+    return QueryAnalysis(text)
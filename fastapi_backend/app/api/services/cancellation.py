@@ -0,0 +1,91 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Optional
+
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+
+
+class RequestCancelled(Exception):
+    """Клиент отключился, работа по его запросу прекращена"""
+
+    def __init__(self, stage: str = "request"):
+        super().__init__(f"Запрос отменен ({stage})")
+        # Этап, на котором работа была прервана (для метрик)
+        self.stage = stage
+
+
+class CancelToken:
+    """
+    Признак отмены запроса, общий для потоков, выполняющих его работу.
+    Блокирующие ожидания (паузы между попытками, ожидание ответа НСПД)
+    прерываются сразу после отмены, вычисления проверяют признак между шагами
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        # Завершается при отмене: его можно ждать вместе с другими future в wait()
+        self.future: Future = Future()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self) -> None:
+        self._event.set()
+        if not self.future.done():
+            self.future.set_result(True)
+
+    def check(self, stage: str = "request") -> None:
+        """Выбрасывает RequestCancelled, если запрос отменен"""
+        if self._event.is_set():
+            raise RequestCancelled(stage)
+
+    def sleep(self, seconds: float, stage: str = "request") -> None:
+        """Пауза, которая прерывается отменой запроса"""
+        if self._event.wait(max(0.0, seconds)):
+            raise RequestCancelled(stage)
+
+
+def check_cancelled(cancel: Optional[CancelToken], stage: str) -> None:
+    if cancel is not None:
+        cancel.check(stage)
+
+
+async def _wait_disconnect(request: Request) -> None:
+    """Ждет отключения клиента (тело запроса к этому моменту уже прочитано)"""
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+def _discard_result(task: "asyncio.Future[Any]") -> None:
+    # Брошенная работа завершается с RequestCancelled - исключение не нужно выводить в лог
+    if not task.cancelled():
+        task.exception()
+
+
+async def run_cancellable(request: Request, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """
+    Выполняет func(*args, cancel=token, **kwargs) в пуле потоков и следит за соединением.
+    Если клиент отключился, token отменяется и RequestCancelled выбрасывается сразу,
+    не дожидаясь func: она прекратит работу на ближайшей проверке token
+    """
+    token = CancelToken()
+    work = asyncio.ensure_future(run_in_threadpool(func, *args, cancel=token, **kwargs))
+    disconnect = asyncio.ensure_future(_wait_disconnect(request))
+    try:
+        await asyncio.wait({work, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        token.cancel()
+        work.add_done_callback(_discard_result)
+        raise
+    finally:
+        disconnect.cancel()
+    if work.done():
+        return work.result()
+    token.cancel()
+    work.add_done_callback(_discard_result)
+    raise RequestCancelled("client")
@@ -0,0 +1,265 @@
+import os
+import json
+import math
+import hashlib
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional
+
+from fastapi import HTTPException
+
+from app.api.services.cache_backend import get_cache_backend
+
+# Параметры кластеризации (как у supercluster): радиус кластера в пикселях
+# при размере тайла CLUSTER_EXTENT, уровни масштаба, на которых строятся кластеры
+CLUSTER_RADIUS = float(os.getenv("CLUSTER_RADIUS", "40"))
+CLUSTER_EXTENT = 512
+CLUSTER_MIN_ZOOM = 0
+CLUSTER_MAX_ZOOM = int(os.getenv("CLUSTER_MAX_ZOOM", "16"))
+# Сколько хранить индекс для результатов поиска (индексы слоев живут, пока слой не изменится)
+CLUSTER_INDEX_TTL = int(os.getenv("CLUSTER_INDEX_TTL", "600"))
+
+# Построенные индексы кластеров; ссылаются на объекты ответа и не сериализуются
+cluster_index_cache = get_cache_backend("cluster_index", backend="memory")
+
+
+def _lng_x(lng: float) -> float:
+    return lng / 360 + 0.5
+
+
+def _lat_y(lat: float) -> float:
+    sin = math.sin(math.radians(max(-85.0511287798, min(85.0511287798, lat))))
+    return 0.5 - 0.25 * math.log((1 + sin) / (1 - sin)) / math.pi
+
+
+def _x_lng(x: float) -> float:
+    return (x - 0.5) * 360
+
+
+def _y_lat(y: float) -> float:
+    return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y))))
+
+
+class _Node:
+    """Точка или кластер на одном уровне масштаба (координаты в долях мира Web Mercator)"""
+
+    __slots__ = ("x", "y", "zoom", "id", "parent_id", "num_points", "source")
+
+    def __init__(self, x: float, y: float, id: int, num_points: int, source: Optional[int]):
+        self.x = x
+        self.y = y
+        # Наименьший уровень, на котором узел уже обработан
+        self.zoom = math.inf
+        self.id = id
+        self.parent_id = -1
+        self.num_points = num_points
+        # Номер исходного объекта (None - кластер)
+        self.source = source
+
+
+def _is_point(feature: Any) -> bool:
+    geometry = feature.get("geometry") if isinstance(feature, dict) else None
+    if not isinstance(geometry, dict) or geometry.get("type") != "Point":
+        return False
+    coords = geometry.get("coordinates")
+    return isinstance(coords, (list, tuple)) and len(coords) >= 2
+
+
+class ClusterIndex:
+    """
+    Иерархический индекс кластеров точек (алгоритм supercluster): кластеры строятся
+    сверху вниз по уровням масштаба, на каждом уровне соседние точки предыдущего
+    уровня в радиусе CLUSTER_RADIUS пикселей объединяются через сетку с ячейкой
+    в радиус. Объекты, не являющиеся точками, не кластеризуются и отдаются как есть
+    """
+
+    def __init__(self, collection: Dict[str, Any], index_id: str):
+        self.index_id = index_id
+        features = collection.get("features") or []
+        self.features = features
+        # Остальные поля коллекции (version, message и т.д.) повторяются в каждом ответе
+        self.meta = {key: value for key, value in collection.items() if key != "features"}
+        self.others = [f for f in features if not _is_point(f)]
+        points = []
+        for i, feature in enumerate(features):
+            if _is_point(feature):
+                lng, lat = feature["geometry"]["coordinates"][:2]
+                points.append(_Node(_lng_x(lng), _lat_y(lat), i, 1, i))
+        self.levels: Dict[int, List[_Node]] = {CLUSTER_MAX_ZOOM + 1: points}
+        for z in range(CLUSTER_MAX_ZOOM, CLUSTER_MIN_ZOOM - 1, -1):
+            self.levels[z] = self._cluster(self.levels[z + 1], z)
+
+    @property
+    def point_count(self) -> int:
+        return len(self.levels[CLUSTER_MAX_ZOOM + 1])
+
+    def _cluster(self, nodes: List[_Node], zoom: int) -> List[_Node]:
+        r = CLUSTER_RADIUS / (CLUSTER_EXTENT * 2 ** zoom)
+        grid: Dict[tuple, List[int]] = defaultdict(list)
+        for i, node in enumerate(nodes):
+            grid[(int(node.x // r), int(node.y // r))].append(i)
+
+        clusters = []
+        for i, node in enumerate(nodes):
+            if node.zoom <= zoom:
+                continue
+            node.zoom = zoom
+            cx, cy = int(node.x // r), int(node.y // r)
+            neighbors = []
+            for gx in (cx - 1, cx, cx + 1):
+                for gy in (cy - 1, cy, cy + 1):
+                    for j in grid.get((gx, gy), ()):
+                        other = nodes[j]
+                        if other.zoom > zoom and (other.x - node.x) ** 2 + (other.y - node.y) ** 2 <= r * r:
+                            neighbors.append(other)
+            if not neighbors:
+                clusters.append(node)
+                continue
+            # Номер кластера кодирует позицию узла и уровень, на котором лежат его дочерние узлы
+            cluster_id = (i << 5) + (zoom + 1)
+            num_points = node.num_points
+            wx, wy = node.x * node.num_points, node.y * node.num_points
+            for other in neighbors:
+                other.zoom = zoom
+                other.parent_id = cluster_id
+                num_points += other.num_points
+                wx += other.x * other.num_points
+                wy += other.y * other.num_points
+            node.parent_id = cluster_id
+            clusters.append(_Node(wx / num_points, wy / num_points, cluster_id, num_points, None))
+        return clusters
+
+    def _to_feature(self, node: _Node) -> Dict[str, Any]:
+        if node.source is not None:
+            return self.features[node.source]
+        count = node.num_points
+        abbreviated = f"{round(count / 1000)}k" if count >= 10000 else f"{round(count / 100) / 10}k" if count >= 1000 else str(count)
+        return {
+            "type": "Feature",
+            "id": str(node.id),
+            "geometry": {"type": "Point", "coordinates": [_x_lng(node.x), _y_lat(node.y)]},
+            "properties": {
+                "cluster": True,
+                "cluster_id": node.id,
+                "point_count": count,
+                "point_count_abbreviated": abbreviated,
+            },
+        }
+
+    def get_clusters(self, zoom: float, bbox: Optional[List[float]] = None) -> List[Dict[str, Any]]:
+        """Кластеры и отдельные точки уровня zoom в прямоугольнике bbox (по умолчанию весь мир)"""
+        z = max(CLUSTER_MIN_ZOOM, min(CLUSTER_MAX_ZOOM + 1, int(zoom)))
+        nodes = self.levels[z]
+        if bbox is not None:
+            min_x, max_x = _lng_x(bbox[0]), _lng_x(bbox[2])
+            min_y, max_y = _lat_y(bbox[3]), _lat_y(bbox[1])
+            nodes = [n for n in nodes if min_x <= n.x <= max_x and min_y <= n.y <= max_y]
+        return [self._to_feature(n) for n in nodes]
+
+    def _children(self, cluster_id: int) -> List[_Node]:
+        origin = cluster_id & 31
+        if not CLUSTER_MIN_ZOOM < origin <= CLUSTER_MAX_ZOOM + 1:
+            raise KeyError(cluster_id)
+        children = [n for n in self.levels[origin] if n.parent_id == cluster_id]
+        if not children:
+            raise KeyError(cluster_id)
+        return children
+
+    def get_children(self, cluster_id: int) -> List[Dict[str, Any]]:
+        """Кластеры и точки, из которых состоит кластер (на следующем уровне масштаба)"""
+        return [self._to_feature(n) for n in self._children(cluster_id)]
+
+    def get_expansion_zoom(self, cluster_id: int) -> int:
+        """Уровень масштаба, на котором кластер распадается на несколько частей"""
+        expansion_zoom = (cluster_id & 31) - 1
+        while expansion_zoom <= CLUSTER_MAX_ZOOM:
+            children = self._children(cluster_id)
+            expansion_zoom += 1
+            if len(children) != 1 or children[0].source is not None:
+                break
+            cluster_id = children[0].id
+        return expansion_zoom
+
+    def get_leaves(self, cluster_id: int, limit: int = 100, offset: int = 0) -> List[Dict[str, Any]]:
+        """Исходные точки кластера (с пропуском offset первых)"""
+        leaves: List[Dict[str, Any]] = []
+        stack = list(reversed(self._children(cluster_id)))
+        skipped = 0
+        while stack and len(leaves) < limit:
+            node = stack.pop()
+            if node.source is None:
+                stack.extend(reversed(self._children(node.id)))
+            elif skipped < offset:
+                skipped += 1
+            else:
+                leaves.append(self.features[node.source])
+        return leaves
+
+
+def cluster_index_id(*key_parts: Any) -> str:
+    """Идентификатор индекса кластеров по ключу источника данных (версии слоя, параметрам поиска)"""
+    return hashlib.sha1(":".join(str(part) for part in key_parts).encode("utf-8")).hexdigest()[:16]
+
+
+def collection_fingerprint(collection: Dict[str, Any]) -> str:
+    """
+    Отпечаток содержимого коллекции: идентификаторы, геометрии и свойства объектов.
+    Для данных без версии (ответы НСПД) по нему отличаются разные ответы с одинаковым числом объектов
+    """
+    digest = hashlib.sha1()
+    for feature in collection.get("features") or []:
+        if isinstance(feature, dict):
+            digest.update(json.dumps(
+                [feature.get("id"), feature.get("geometry"), feature.get("properties")],
+                ensure_ascii=False, sort_keys=True, default=str
+            ).encode("utf-8"))
+        digest.update(b"\n")
+    digest.update(str(collection.get("message")).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def cluster_collection(index_id: str, zoom: float, load: Callable[[], Optional[Dict[str, Any]]],
+                       bbox: Optional[List[float]] = None, ttl: Optional[float] = None) -> Optional[Dict[str, Any]]:
+    """
+    FeatureCollection, в которой точки заменены кластерами уровня zoom (в пределах bbox).
+    Индекс строится один раз для index_id из коллекции, которую возвращает load
+    (None - данных нет), и переиспользуется, в том числе для раскрытия кластеров
+    """
+    index = cluster_index_cache.get(index_id)
+    if index is None:
+        collection = load()
+        if collection is None:
+            return None
+        index = ClusterIndex(collection, index_id)
+        # Заглушка, ошибка и неполный ответ НСПД не запоминаются: следующий запрос их обновит
+        if not any(collection.get(flag) for flag in ("fallback", "error", "partial")):
+            cluster_index_cache.set(index_id, index, ttl=ttl)
+    result = dict(index.meta)
+    result["features"] = index.get_clusters(zoom, bbox) + index.others
+    result["cluster_index"] = index_id
+    result["zoom"] = zoom
+    return result
+
+
+def get_cluster_index(index_id: str) -> ClusterIndex:
+    index = cluster_index_cache.get(index_id)
+    if index is None:
+        raise HTTPException(status_code=404, detail="Индекс кластеров не найден или устарел, повторите запрос данных")
+    return index
+
+
+def expand_cluster(index_id: str, cluster_id: int, leaves: bool = False,
+                   limit: int = 100, offset: int = 0) -> Dict[str, Any]:
+    """Содержимое кластера: дочерние кластеры и точки или (leaves=True) исходные точки"""
+    index = get_cluster_index(index_id)
+    try:
+        features = index.get_leaves(cluster_id, limit, offset) if leaves else index.get_children(cluster_id)
+        expansion_zoom = index.get_expansion_zoom(cluster_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Кластер {cluster_id} не найден")
+    return {
+        "type": "FeatureCollection",
+        "features": features,
+        "cluster_id": cluster_id,
+        "expansion_zoom": expansion_zoom,
+        "cluster_index": index_id,
+    }
@@ -0,0 +1,623 @@
+import json
+import struct
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from app.api.services.spatial_index import BBox, geometry_bbox
+
+# Формат FlatGeobuf (https://flatgeobuf.org): заголовок и объекты - буферы FlatBuffers,
+# между ними упакованное R-дерево Гильберта по экстентам объектов. Дерево позволяет
+# читать из файла только объекты, пересекающиеся с прямоугольником.
+# Поддерживаются двумерные геометрии GeoJSON (координаты Z отбрасываются)
+
+MAGIC = b"fgb\x03fgb\x00"
+INDEX_NODE_SIZE = 16
+_NODE_SIZE_BYTES = 40  # min_x, min_y, max_x, max_y (double) и смещение (uint64)
+
+# Типы геометрий и столбцов из схемы FlatGeobuf
+GEOMETRY_TYPES = {
+    "Unknown": 0, "Point": 1, "LineString": 2, "Polygon": 3, "MultiPoint": 4,
+    "MultiLineString": 5, "MultiPolygon": 6, "GeometryCollection": 7,
+}
+_GEOMETRY_NAMES = {code: name for name, code in GEOMETRY_TYPES.items()}
+
+COL_BYTE, COL_UBYTE, COL_BOOL, COL_SHORT, COL_USHORT, COL_INT, COL_UINT, COL_LONG, COL_ULONG, \
+    COL_FLOAT, COL_DOUBLE, COL_STRING, COL_JSON, COL_DATETIME, COL_BINARY = range(15)
+
+# Столбец, в котором хранится id объекта GeoJSON (в FlatGeobuf нет отдельного поля id)
+FEATURE_ID_COLUMN = "_id"
+
+_COLUMN_FORMATS = {
+    COL_BYTE: "b", COL_UBYTE: "B", COL_BOOL: "?", COL_SHORT: "h", COL_USHORT: "H", COL_INT: "i",
+    COL_UINT: "I", COL_LONG: "q", COL_ULONG: "Q", COL_FLOAT: "f", COL_DOUBLE: "d",
+}
+
+# Номера полей таблиц схемы (header.fbs, feature.fbs)
+_HEADER_NAME, _HEADER_ENVELOPE, _HEADER_GEOMETRY_TYPE, _HEADER_HAS_Z, _HEADER_COLUMNS = 0, 1, 2, 3, 7
+_HEADER_FEATURES_COUNT, _HEADER_INDEX_NODE_SIZE, _HEADER_CRS, _HEADER_METADATA = 8, 9, 10, 13
+_COLUMN_NAME, _COLUMN_TYPE = 0, 1
+_CRS_ORG, _CRS_CODE = 0, 1
+_GEOMETRY_ENDS, _GEOMETRY_XY, _GEOMETRY_TYPE, _GEOMETRY_PARTS = 0, 1, 6, 7
+_FEATURE_GEOMETRY, _FEATURE_PROPERTIES = 0, 1
+
+
+class FlatGeobufError(ValueError):
+    """Файл не является FlatGeobuf или поврежден"""
+
+
+# --- FlatBuffers: запись -----------------------------------------------------------
+#
+# Таблица описывается списком полей (номер, вид, значение). Вид - формат struct
+# для скаляра, "str" - строка, "vec:<формат>" - вектор скаляров, "table" - таблица,
+# "tables" - вектор таблиц. Буфер пишется от начала к концу: таблица, затем
+# объекты, на которые она ссылается (смещения FlatBuffers направлены вперед)
+
+class _Builder:
+    def __init__(self):
+        self.buf = bytearray()
+
+    def _align(self, alignment: int, extra: int = 0) -> None:
+        padding = -(len(self.buf) + extra) % alignment
+        self.buf.extend(b"\x00" * padding)
+
+    def _patch_offset(self, at: int, target: int) -> None:
+        struct.pack_into("<I", self.buf, at, target - at)
+
+    def table(self, fields: Sequence[Tuple[int, str, Any]]) -> int:
+        fields = [f for f in fields if f[2] is not None]
+        sizes = {slot: (4 if kind in ("str", "table", "tables") or kind.startswith("vec:") else struct.calcsize(kind))
+                 for slot, kind, _ in fields}
+        # Поля по убыванию размера, чтобы каждое было выровнено по своему размеру
+        offsets = {}
+        position = 4
+        for slot, _, _ in sorted(fields, key=lambda f: -sizes[f[0]]):
+            position += -position % sizes[slot]
+            offsets[slot] = position
+            position += sizes[slot]
+        slot_count = max((f[0] for f in fields), default=-1) + 1
+
+        self._align(2)
+        vtable = len(self.buf)
+        self.buf.extend(struct.pack(f"<HH{slot_count}H", 4 + 2 * slot_count, position,
+                                    *[offsets.get(slot, 0) for slot in range(slot_count)]))
+        self._align(8)
+        start = len(self.buf)
+        self.buf.extend(b"\x00" * position)
+        struct.pack_into("<i", self.buf, start, start - vtable)
+
+        for slot, kind, value in fields:
+            at = start + offsets[slot]
+            if kind == "str":
+                self._patch_offset(at, self.string(value))
+            elif kind == "table":
+                self._patch_offset(at, self.table(value))
+            elif kind == "tables":
+                self._patch_offset(at, self.tables(value))
+            elif kind.startswith("vec:"):
+                self._patch_offset(at, self.vector(kind[4:], value))
+            else:
+                struct.pack_into("<" + kind, self.buf, at, value)
+        return start
+
+    def string(self, value: str) -> int:
+        data = value.encode("utf-8")
+        self._align(4)
+        start = len(self.buf)
+        self.buf.extend(struct.pack("<I", len(data)) + data + b"\x00")
+        return start
+
+    def vector(self, fmt: str, values: Sequence[Any]) -> int:
+        # Элементы выравниваются по своему размеру, длина (uint32) - непосредственно перед ними
+        self._align(max(4, struct.calcsize(fmt)), extra=4)
+        start = len(self.buf)
+        if fmt == "B" and isinstance(values, (bytes, bytearray)):
+            self.buf.extend(struct.pack("<I", len(values)) + values)
+        else:
+            self.buf.extend(struct.pack(f"<I{len(values)}{fmt}", len(values), *values))
+        return start
+
+    def tables(self, tables: Sequence[Sequence[Tuple[int, str, Any]]]) -> int:
+        self._align(4)
+        start = len(self.buf)
+        self.buf.extend(struct.pack("<I", len(tables)) + b"\x00" * (4 * len(tables)))
+        for i, fields in enumerate(tables):
+            self._patch_offset(start + 4 + 4 * i, self.table(fields))
+        return start
+
+    def finish(self, root: Sequence[Tuple[int, str, Any]]) -> bytes:
+        """Буфер с корневой таблицей и префиксом размера, как в файле FlatGeobuf"""
+        self.buf.extend(b"\x00" * 4)
+        self._patch_offset(0, self.table(root))
+        return struct.pack("<I", len(self.buf)) + bytes(self.buf)
+
+
+# --- FlatBuffers: чтение -----------------------------------------------------------
+
+class _Table:
+    __slots__ = ("buf", "pos", "vtable", "vtable_size")
+
+    def __init__(self, buf, pos: int):
+        self.buf = buf
+        self.pos = pos
+        self.vtable = pos - struct.unpack_from("<i", buf, pos)[0]
+        self.vtable_size = struct.unpack_from("<H", buf, self.vtable)[0]
+
+    def _offset(self, slot: int) -> int:
+        at = 4 + 2 * slot
+        if at >= self.vtable_size:
+            return 0
+        return struct.unpack_from("<H", self.buf, self.vtable + at)[0]
+
+    def scalar(self, slot: int, fmt: str, default: Any = 0) -> Any:
+        offset = self._offset(slot)
+        return struct.unpack_from("<" + fmt, self.buf, self.pos + offset)[0] if offset else default
+
+    def _target(self, slot: int) -> Optional[int]:
+        offset = self._offset(slot)
+        if not offset:
+            return None
+        at = self.pos + offset
+        return at + struct.unpack_from("<I", self.buf, at)[0]
+
+    def string(self, slot: int) -> Optional[str]:
+        at = self._target(slot)
+        if at is None:
+            return None
+        length = struct.unpack_from("<I", self.buf, at)[0]
+        return bytes(self.buf[at + 4:at + 4 + length]).decode("utf-8")
+
+    def vector(self, slot: int, fmt: str) -> Sequence[Any]:
+        at = self._target(slot)
+        if at is None:
+            return ()
+        length = struct.unpack_from("<I", self.buf, at)[0]
+        if fmt == "B":
+            return self.buf[at + 4:at + 4 + length]
+        return struct.unpack_from(f"<{length}{fmt}", self.buf, at + 4)
+
+    def table(self, slot: int) -> Optional["_Table"]:
+        at = self._target(slot)
+        return _Table(self.buf, at) if at is not None else None
+
+    def tables(self, slot: int) -> List["_Table"]:
+        at = self._target(slot)
+        if at is None:
+            return []
+        length = struct.unpack_from("<I", self.buf, at)[0]
+        result = []
+        for i in range(length):
+            item = at + 4 + 4 * i
+            result.append(_Table(self.buf, item + struct.unpack_from("<I", self.buf, item)[0]))
+        return result
+
+
+# --- Геометрии ---------------------------------------------------------------------
+
+def _flat(points: Sequence[Sequence[float]]) -> List[float]:
+    xy = []
+    for point in points:
+        xy.append(float(point[0]))
+        xy.append(float(point[1]))
+    return xy
+
+
+def _encode_geometry(geometry: Dict[str, Any]) -> List[Tuple[int, str, Any]]:
+    geo_type = geometry.get("type")
+    coords = geometry.get("coordinates")
+    fields: List[Tuple[int, str, Any]] = [(_GEOMETRY_TYPE, "B", GEOMETRY_TYPES.get(geo_type, 0))]
+    if geo_type == "Point":
+        fields.append((_GEOMETRY_XY, "vec:d", _flat([coords])))
+    elif geo_type in ("LineString", "MultiPoint"):
+        fields.append((_GEOMETRY_XY, "vec:d", _flat(coords)))
+    elif geo_type in ("Polygon", "MultiLineString"):
+        xy, ends = [], []
+        for ring in coords:
+            xy.extend(_flat(ring))
+            ends.append(len(xy) // 2)
+        fields.append((_GEOMETRY_XY, "vec:d", xy))
+        if len(ends) > 1:
+            fields.append((_GEOMETRY_ENDS, "vec:I", ends))
+    elif geo_type == "MultiPolygon":
+        parts = [_encode_geometry({"type": "Polygon", "coordinates": polygon}) for polygon in coords]
+        fields.append((_GEOMETRY_PARTS, "tables", parts))
+    elif geo_type == "GeometryCollection":
+        parts = [_encode_geometry(g) for g in geometry.get("geometries") or []]
+        fields.append((_GEOMETRY_PARTS, "tables", parts))
+    else:
+        raise ValueError(f"Неподдерживаемый тип геометрии: {geo_type}")
+    return fields
+
+
+def _points(xy: Sequence[float], start: int = 0, end: Optional[int] = None) -> List[List[float]]:
+    end = len(xy) // 2 if end is None else end
+    return [[xy[2 * i], xy[2 * i + 1]] for i in range(start, end)]
+
+
+def _rings(geometry: _Table) -> List[List[List[float]]]:
+    xy = geometry.vector(_GEOMETRY_XY, "d")
+    ends = geometry.vector(_GEOMETRY_ENDS, "I") or (len(xy) // 2,)
+    rings, start = [], 0
+    for end in ends:
+        rings.append(_points(xy, start, end))
+        start = end
+    return rings
+
+
+def _decode_geometry(geometry: _Table, geo_type: int) -> Dict[str, Any]:
+    if geo_type == 0:
+        geo_type = geometry.scalar(_GEOMETRY_TYPE, "B")
+    name = _GEOMETRY_NAMES.get(geo_type)
+    if name == "Point":
+        xy = geometry.vector(_GEOMETRY_XY, "d")
+        return {"type": "Point", "coordinates": [xy[0], xy[1]]}
+    if name in ("LineString", "MultiPoint"):
+        return {"type": name, "coordinates": _points(geometry.vector(_GEOMETRY_XY, "d"))}
+    if name in ("Polygon", "MultiLineString"):
+        return {"type": name, "coordinates": _rings(geometry)}
+    if name == "MultiPolygon":
+        parts = geometry.tables(_GEOMETRY_PARTS)
+        if parts:
+            return {"type": name, "coordinates": [_rings(part) for part in parts]}
+        # Допускается и запись мультиполигона из одного полигона без частей
+        return {"type": name, "coordinates": [_rings(geometry)]}
+    if name == "GeometryCollection":
+        return {"type": name, "geometries": [_decode_geometry(part, 0) for part in geometry.tables(_GEOMETRY_PARTS)]}
+    raise FlatGeobufError(f"Неподдерживаемый тип геометрии FlatGeobuf: {geo_type}")
+
+
+# --- Свойства ----------------------------------------------------------------------
+
+def infer_columns(features: Sequence[Dict[str, Any]]) -> List[Tuple[str, int]]:
+    """
+    Столбцы по свойствам объектов в порядке первого появления. Тип выбирается
+    по всем значениям: целые - Long, числа - Double, строки - String,
+    смешанные и составные значения - Json
+    """
+    kinds: Dict[str, set] = {}
+    for feature in features:
+        for key, value in (feature.get("properties") or {}).items():
+            seen = kinds.setdefault(key, set())
+            if value is None:
+                continue
+            if isinstance(value, bool):
+                seen.add("bool")
+            elif isinstance(value, int):
+                seen.add("int" if -2 ** 63 <= value < 2 ** 63 else "json")
+            elif isinstance(value, float):
+                seen.add("float")
+            elif isinstance(value, str):
+                seen.add("str")
+            else:
+                seen.add("json")
+    columns = []
+    for key, seen in kinds.items():
+        if seen <= {"bool"}:
+            column_type = COL_BOOL if seen else COL_STRING
+        elif seen == {"int"}:
+            column_type = COL_LONG
+        elif seen <= {"int", "float"}:
+            column_type = COL_DOUBLE
+        elif seen == {"str"}:
+            column_type = COL_STRING
+        else:
+            column_type = COL_JSON
+        columns.append((key, column_type))
+    return columns
+
+
+def _encode_properties(properties: Dict[str, Any], columns: List[Tuple[str, int]]) -> bytes:
+    data = bytearray()
+    for index, (name, column_type) in enumerate(columns):
+        value = properties.get(name)
+        if value is None:
+            continue
+        data.extend(struct.pack("<H", index))
+        if column_type == COL_STRING:
+            encoded = str(value).encode("utf-8")
+            data.extend(struct.pack("<I", len(encoded)) + encoded)
+        elif column_type == COL_JSON:
+            encoded = json.dumps(value, ensure_ascii=False).encode("utf-8")
+            data.extend(struct.pack("<I", len(encoded)) + encoded)
+        else:
+            data.extend(struct.pack("<" + _COLUMN_FORMATS[column_type], value))
+    return bytes(data)
+
+
+def _decode_properties(data: Sequence[int], columns: List[Tuple[str, int]]) -> Dict[str, Any]:
+    properties: Dict[str, Any] = {}
+    data = bytes(data)
+    position = 0
+    while position < len(data):
+        index = struct.unpack_from("<H", data, position)[0]
+        position += 2
+        if index >= len(columns):
+            raise FlatGeobufError(f"Неизвестный столбец свойств: {index}")
+        name, column_type = columns[index]
+        if column_type in _COLUMN_FORMATS:
+            fmt = "<" + _COLUMN_FORMATS[column_type]
+            properties[name] = struct.unpack_from(fmt, data, position)[0]
+            position += struct.calcsize(fmt)
+            continue
+        length = struct.unpack_from("<I", data, position)[0]
+        raw = data[position + 4:position + 4 + length]
+        position += 4 + length
+        if column_type == COL_JSON:
+            properties[name] = json.loads(raw.decode("utf-8"))
+        elif column_type == COL_BINARY:
+            properties[name] = raw.hex()
+        else:
+            properties[name] = raw.decode("utf-8")
+    return properties
+
+
+def feature_properties(feature: Dict[str, Any]) -> Dict[str, Any]:
+    """Свойства объекта для записи в файл: id объекта сохраняется в столбце FEATURE_ID_COLUMN"""
+    properties = feature.get("properties") or {}
+    if feature.get("id") is None:
+        return properties
+    return dict(properties, **{FEATURE_ID_COLUMN: feature["id"]})
+
+
+def make_feature(geometry: Optional[Dict[str, Any]], properties: Dict[str, Any]) -> Dict[str, Any]:
+    """Объект GeoJSON из прочитанной строки; столбец FEATURE_ID_COLUMN становится id"""
+    feature: Dict[str, Any] = {"type": "Feature"}
+    if FEATURE_ID_COLUMN in properties:
+        feature["id"] = properties.pop(FEATURE_ID_COLUMN)
+    feature["geometry"] = geometry
+    feature["properties"] = properties
+    return feature
+
+
+# --- Упакованное R-дерево Гильберта -------------------------------------------------
+
+def _hilbert(x: int, y: int) -> int:
+    """Номер точки на кривой Гильберта 16x16 бит (как во flatbush)"""
+    a = x ^ y
+    b = 0xFFFF ^ a
+    c = 0xFFFF ^ (x | y)
+    d = x & (y ^ 0xFFFF)
+    A = a | (b >> 1)
+    B = (a >> 1) ^ a
+    C = ((c >> 1) ^ (b & (d >> 1))) ^ c
+    D = ((a & (c >> 1)) ^ (d >> 1)) ^ d
+
+    a, b, c, d = A, B, C, D
+    A = (a & (a >> 2)) ^ (b & (b >> 2))
+    B = (a & (b >> 2)) ^ (b & ((a ^ b) >> 2))
+    C ^= (a & (c >> 2)) ^ (b & (d >> 2))
+    D ^= (b & (c >> 2)) ^ ((a ^ b) & (d >> 2))
+
+    a, b, c, d = A, B, C, D
+    A = (a & (a >> 4)) ^ (b & (b >> 4))
+    B = (a & (b >> 4)) ^ (b & ((a ^ b) >> 4))
+    C ^= (a & (c >> 4)) ^ (b & (d >> 4))
+    D ^= (b & (c >> 4)) ^ ((a ^ b) & (d >> 4))
+
+    a, b, c, d = A, B, C, D
+    C ^= (a & (c >> 8)) ^ (b & (d >> 8))
+    D ^= (b & (c >> 8)) ^ ((a ^ b) & (d >> 8))
+
+    a = C ^ (C >> 1)
+    b = D ^ (D >> 1)
+    i0 = x ^ y
+    i1 = b | (0xFFFF ^ (i0 | a))
+
+    i0 = (i0 | (i0 << 8)) & 0x00FF00FF
+    i0 = (i0 | (i0 << 4)) & 0x0F0F0F0F
+    i0 = (i0 | (i0 << 2)) & 0x33333333
+    i0 = (i0 | (i0 << 1)) & 0x55555555
+    i1 = (i1 | (i1 << 8)) & 0x00FF00FF
+    i1 = (i1 | (i1 << 4)) & 0x0F0F0F0F
+    i1 = (i1 | (i1 << 2)) & 0x33333333
+    i1 = (i1 | (i1 << 1)) & 0x55555555
+    return (i1 << 1) | i0
+
+
+def hilbert_sort(items: List[Tuple[BBox, Any]]) -> List[Tuple[BBox, Any]]:
+    """Упорядочивает пары (экстент, объект) по кривой Гильберта через центры экстентов"""
+    if not items:
+        return []
+    min_x = min(b[0] for b, _ in items)
+    min_y = min(b[1] for b, _ in items)
+    width = (max(b[2] for b, _ in items) - min_x) or 1.0
+    height = (max(b[3] for b, _ in items) - min_y) or 1.0
+
+    def key(item):
+        box = item[0]
+        x = int(0xFFFF * ((box[0] + box[2]) / 2 - min_x) / width)
+        y = int(0xFFFF * ((box[1] + box[3]) / 2 - min_y) / height)
+        return _hilbert(x, y)
+
+    return sorted(items, key=key)
+
+
+def _level_bounds(item_count: int, node_size: int) -> List[Tuple[int, int]]:
+    """Границы уровней дерева в массиве узлов: листья - уровень 0 (в конце массива), корень - в начале"""
+    count = item_count
+    level_sizes = [count]
+    while True:
+        count = -(-count // node_size)
+        level_sizes.append(count)
+        if count == 1:
+            break
+    total = sum(level_sizes)
+    bounds = []
+    for size in level_sizes:
+        total -= size
+        bounds.append((total, total + size))
+    return bounds
+
+
+def _build_index(boxes: List[BBox], offsets: List[int], node_size: int) -> bytes:
+    bounds = _level_bounds(len(boxes), node_size)
+    nodes: List[Tuple[float, float, float, float, int]] = [(0.0, 0.0, 0.0, 0.0, 0)] * bounds[0][1]
+    leaf_start = bounds[0][0]
+    for i, (box, offset) in enumerate(zip(boxes, offsets)):
+        nodes[leaf_start + i] = (box[0], box[1], box[2], box[3], offset)
+    for level in range(len(bounds) - 1):
+        position, end = bounds[level]
+        parent = bounds[level + 1][0]
+        while position < end:
+            children = nodes[position:min(position + node_size, end)]
+            nodes[parent] = (min(n[0] for n in children), min(n[1] for n in children),
+                             max(n[2] for n in children), max(n[3] for n in children), position)
+            parent += 1
+            position += node_size
+    return b"".join(struct.pack("<ddddQ", *node) for node in nodes)
+
+
+# --- Запись и чтение файла ---------------------------------------------------------
+
+def write_flatgeobuf(features: Sequence[Dict[str, Any]], out: BinaryIO, name: str = "",
+                     metadata: Optional[str] = None) -> int:
+    """
+    Записывает объекты GeoJSON (EPSG:4326) в FlatGeobuf с индексом. Объекты упорядочиваются
+    по кривой Гильберта, чтобы соседние на карте объекты лежали в файле рядом, id объектов
+    сохраняются в столбце FEATURE_ID_COLUMN.
+    Объекты без геометрии не записываются. Возвращает число записанных объектов
+    """
+    items = []
+    for feature in features:
+        geometry = feature.get("geometry") if isinstance(feature, dict) else None
+        box = geometry_bbox(geometry)
+        if box is not None:
+            items.append((box, feature))
+    items = hilbert_sort(items)
+    properties = [feature_properties(feature) for _, feature in items]
+    columns = infer_columns([{"properties": p} for p in properties])
+    extent = (min(b[0] for b, _ in items), min(b[1] for b, _ in items),
+              max(b[2] for b, _ in items), max(b[3] for b, _ in items)) if items else None
+
+    geometry_types = {item[1]["geometry"].get("type") for item in items}
+    header_type = GEOMETRY_TYPES.get(geometry_types.pop(), 0) if len(geometry_types) == 1 else 0
+    header = _Builder().finish([
+        (_HEADER_NAME, "str", name or None),
+        (_HEADER_ENVELOPE, "vec:d", list(extent) if extent else None),
+        (_HEADER_GEOMETRY_TYPE, "B", header_type),
+        (_HEADER_COLUMNS, "tables", [[(_COLUMN_NAME, "str", column), (_COLUMN_TYPE, "B", column_type)]
+                                     for column, column_type in columns] or None),
+        (_HEADER_FEATURES_COUNT, "Q", len(items)),
+        (_HEADER_INDEX_NODE_SIZE, "H", INDEX_NODE_SIZE if items else 0),
+        (_HEADER_CRS, "table", [(_CRS_ORG, "str", "EPSG"), (_CRS_CODE, "i", 4326)]),
+        (_HEADER_METADATA, "str", metadata),
+    ])
+
+    encoded = []
+    offsets = []
+    offset = 0
+    for (_, feature), feature_props in zip(items, properties):
+        data = _Builder().finish([
+            (_FEATURE_GEOMETRY, "table", _encode_geometry(feature["geometry"])),
+            (_FEATURE_PROPERTIES, "vec:B", _encode_properties(feature_props, columns) or None),
+        ])
+        encoded.append(data)
+        offsets.append(offset)
+        offset += len(data)
+
+    out.write(MAGIC)
+    out.write(header)
+    if items:
+        out.write(_build_index([box for box, _ in items], offsets, INDEX_NODE_SIZE))
+    for data in encoded:
+        out.write(data)
+    return len(items)
+
+
+class FlatGeobufReader:
+    """
+    Потоковое чтение FlatGeobuf из файла: объекты читаются по одному.
+    С bbox по индексу выбираются только нужные объекты, остальной файл не читается
+    """
+
+    def __init__(self, fp: BinaryIO):
+        self.fp = fp
+        if fp.read(8)[:3] != MAGIC[:3]:
+            raise FlatGeobufError("Файл не является FlatGeobuf")
+        header_size = self._read_size()
+        buf = fp.read(header_size or 0)
+        if header_size is None or len(buf) < header_size:
+            raise FlatGeobufError("Файл FlatGeobuf обрезан")
+        header = _Table(buf, struct.unpack_from("<I", buf, 0)[0])
+        self.name = header.string(_HEADER_NAME)
+        self.envelope = tuple(header.vector(_HEADER_ENVELOPE, "d")) or None
+        self.geometry_type = header.scalar(_HEADER_GEOMETRY_TYPE, "B")
+        self.features_count = header.scalar(_HEADER_FEATURES_COUNT, "Q")
+        self.index_node_size = header.scalar(_HEADER_INDEX_NODE_SIZE, "H", INDEX_NODE_SIZE)
+        self.metadata = header.string(_HEADER_METADATA)
+        self.columns = [(column.string(_COLUMN_NAME), column.scalar(_COLUMN_TYPE, "B"))
+                        for column in header.tables(_HEADER_COLUMNS)]
+        crs = header.table(_HEADER_CRS)
+        self.crs_code = crs.scalar(_CRS_CODE, "i") if crs is not None else None
+        if header.scalar(_HEADER_HAS_Z, "?", False):
+            raise FlatGeobufError("Геометрии с координатой Z не поддерживаются")
+
+        self.index_offset = 8 + 4 + header_size
+        self.index_size = 0
+        if self.index_node_size > 0 and self.features_count > 0:
+            self.index_size = _level_bounds(self.features_count, self.index_node_size)[0][1] * _NODE_SIZE_BYTES
+        self.features_offset = self.index_offset + self.index_size
+
+    def _read_size(self) -> Optional[int]:
+        data = self.fp.read(4)
+        if len(data) < 4:
+            return None
+        return struct.unpack("<I", data)[0]
+
+    def _read_feature(self) -> Optional[Dict[str, Any]]:
+        size = self._read_size()
+        if size is None:
+            return None
+        buf = self.fp.read(size)
+        if len(buf) < size:
+            raise FlatGeobufError("Файл FlatGeobuf обрезан")
+        table = _Table(buf, struct.unpack_from("<I", buf, 0)[0])
+        geometry = table.table(_FEATURE_GEOMETRY)
+        return make_feature(
+            _decode_geometry(geometry, self.geometry_type) if geometry is not None else None,
+            _decode_properties(table.vector(_FEATURE_PROPERTIES, "B"), self.columns),
+        )
+
+    def _search(self, bbox: BBox) -> List[int]:
+        """Смещения объектов, экстент которых пересекается с bbox (обход дерева с чтением узлов по мере надобности)"""
+        node_size = self.index_node_size
+        bounds = _level_bounds(self.features_count, node_size)
+        leaf_start = bounds[0][0]
+        found = []
+        queue = [(0, len(bounds) - 1)]
+        while queue:
+            node_index, level = queue.pop()
+            end = min(node_index + node_size, bounds[level][1])
+            self.fp.seek(self.index_offset + node_index * _NODE_SIZE_BYTES)
+            data = self.fp.read((end - node_index) * _NODE_SIZE_BYTES)
+            for i in range(end - node_index):
+                min_x, min_y, max_x, max_y, offset = struct.unpack_from("<ddddQ", data, i * _NODE_SIZE_BYTES)
+                if min_x > bbox[2] or max_x < bbox[0] or min_y > bbox[3] or max_y < bbox[1]:
+                    continue
+                if node_index >= leaf_start:
+                    found.append(offset)
+                else:
+                    queue.append((offset, level - 1))
+        return sorted(found)
+
+    def features(self, bbox: Optional[BBox] = None) -> Iterator[Dict[str, Any]]:
+        """Объекты файла; с bbox - только пересекающиеся с прямоугольником по экстенту"""
+        if bbox is not None and self.index_size:
+            for offset in self._search(bbox):
+                self.fp.seek(self.features_offset + offset)
+                feature = self._read_feature()
+                if feature is not None:
+                    yield feature
+            return
+        self.fp.seek(self.features_offset)
+        while True:
+            feature = self._read_feature()
+            if feature is None:
+                return
+            if bbox is not None:
+                box = geometry_bbox(feature["geometry"])
+                if box is None or box[0] > bbox[2] or box[2] < bbox[0] or box[1] > bbox[3] or box[3] < bbox[1]:
+                    continue
+            yield feature
+
+
+def is_flatgeobuf(data: bytes) -> bool:
+    return data[:3] == MAGIC[:3] and data[4:7] == MAGIC[4:7]
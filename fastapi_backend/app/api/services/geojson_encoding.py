@@ -0,0 +1,284 @@
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.api.services.geometry_executor import COORDINATE_DEPTH
+
+# Квантование TopoJSON по умолчанию: число шагов сетки по каждой оси экстента слоя
+DEFAULT_QUANTIZATION = 1_000_000
+# Допустимые значения квантования: для каждого хранится своя копия слоя в кэше
+QUANTIZATION_LEVELS = (10_000, 100_000, 1_000_000)
+
+
+def _round_coords(coords: Any, depth: int, precision: int) -> Any:
+    if depth == 0:
+        return [round(c, precision) for c in coords]
+    return [_round_coords(c, depth - 1, precision) for c in coords]
+
+
+def round_geometry(geometry: Optional[Dict[str, Any]], precision: int) -> Optional[Dict[str, Any]]:
+    """Возвращает копию геометрии с координатами, округленными до precision знаков"""
+    if not isinstance(geometry, dict):
+        return geometry
+    if geometry.get("type") == "GeometryCollection":
+        rounded = dict(geometry)
+        rounded["geometries"] = [round_geometry(g, precision) for g in geometry.get("geometries", [])]
+        return rounded
+    depth = COORDINATE_DEPTH.get(geometry.get("type"))
+    if depth is None or "coordinates" not in geometry:
+        return geometry
+    rounded = dict(geometry)
+    try:
+        rounded["coordinates"] = _round_coords(geometry["coordinates"], depth, precision)
+    except (TypeError, IndexError):
+        return geometry
+    return rounded
+
+
+def parse_fields(fields: Optional[str]) -> Optional[List[str]]:
+    """Разбирает параметр fields=name,cad_number; пустое значение или * - все свойства (None)"""
+    if fields is None:
+        return None
+    names = [name.strip() for name in fields.split(",") if name.strip()]
+    if not names or "*" in names:
+        return None
+    return names
+
+
+def prepare_collection(collection: Dict[str, Any], fields: Optional[List[str]] = None,
+                       precision: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Готовит FeatureCollection (или TopoJSON) к отдаче клиенту за один проход:
+    оставляет в свойствах только поля fields и округляет координаты до precision
+    знаков после запятой (6 знаков - около 10 см, 7 - около 1 см).
+    Исходные данные не изменяются, поэтому функцию можно применять к кэшированным слоям
+    """
+    if not isinstance(collection, dict) or (fields is None and precision is None):
+        return collection
+    
+    if collection.get("type") == "Topology":
+        # Координаты TopoJSON уже квантованы, применяем только выбор свойств
+        if fields is None:
+            return collection
+        result = dict(collection)
+        result["objects"] = {
+            name: dict(obj, geometries=[_project_feature(g, fields, None) for g in obj.get("geometries", [])])
+            for name, obj in collection.get("objects", {}).items()
+        }
+        return result
+    
+    if not isinstance(collection.get("features"), list):
+        return collection
+    result = dict(collection)
+    result["features"] = [_project_feature(feature, fields, precision) for feature in collection["features"]]
+    return result
+
+
+def apply_precision(collection: Dict[str, Any], precision: Optional[int]) -> Dict[str, Any]:
+    """Округляет координаты FeatureCollection до precision знаков после запятой"""
+    return prepare_collection(collection, precision=precision)
+
+
+def _project_feature(feature: Any, fields: Optional[List[str]], precision: Optional[int]) -> Any:
+    if not isinstance(feature, dict):
+        return feature
+    feature = dict(feature)
+    if fields is not None and isinstance(feature.get("properties"), dict):
+        properties = feature["properties"]
+        feature["properties"] = {name: properties[name] for name in fields if name in properties}
+    if precision is not None and "geometry" in feature:
+        feature["geometry"] = round_geometry(feature["geometry"], precision)
+    return feature
+
+
+def _iter_positions(coords: Any, depth: int):
+    if depth == 0:
+        yield coords
+        return
+    for c in coords:
+        yield from _iter_positions(c, depth - 1)
+
+
+def _collection_bbox(features: List[Dict[str, Any]]) -> Optional[List[float]]:
+    min_x = min_y = float("inf")
+    max_x = max_y = float("-inf")
+    for feature in features:
+        geometry = feature.get("geometry") or {}
+        depth = COORDINATE_DEPTH.get(geometry.get("type"))
+        if depth is None:
+            continue
+        for p in _iter_positions(geometry.get("coordinates", []), depth):
+            x, y = p[0], p[1]
+            min_x, max_x = min(min_x, x), max(max_x, x)
+            min_y, max_y = min(min_y, y), max(max_y, y)
+    if min_x == float("inf"):
+        return None
+    return [min_x, min_y, max_x, max_y]
+
+
+class _TopologyBuilder:
+    """
+    Строит TopoJSON: линии и кольца квантуются, разрезаются в узлах (точках,
+    где у линий разные соседи) и одинаковые дуги хранятся один раз - так общие
+    границы муниципальных образований передаются только однажды
+    """
+
+    def __init__(self, bbox: List[float], quantization: int):
+        self.x0, self.y0 = bbox[0], bbox[1]
+        self.kx = (quantization - 1) / (bbox[2] - bbox[0]) if bbox[2] > bbox[0] else 1
+        self.ky = (quantization - 1) / (bbox[3] - bbox[1]) if bbox[3] > bbox[1] else 1
+        # Квантованные линии: (точки, замкнутое кольцо)
+        self.lines: List[Tuple[List[Tuple[int, int]], bool]] = []
+        self.neighbors: Dict[Tuple[int, int], Tuple] = {}
+        self.junctions: set = set()
+        self.arcs: List[List[Tuple[int, int]]] = []
+        self.arc_index: Dict[Tuple[Tuple[int, int], ...], int] = {}
+
+    def quantize(self, p: List[float]) -> Tuple[int, int]:
+        return (round((p[0] - self.x0) * self.kx), round((p[1] - self.y0) * self.ky))
+
+    def add_line(self, coords: List[List[float]], closed: bool) -> int:
+        points = []
+        for p in coords:
+            q = self.quantize(p)
+            if not points or points[-1] != q:
+                points.append(q)
+        if closed and len(points) > 1 and points[0] == points[-1]:
+            points.pop()
+        self.lines.append((points, closed))
+
+        # Запоминаем соседей каждой точки; точка с разными парами соседей - узел
+        n = len(points)
+        for i, p in enumerate(points):
+            if closed:
+                prev, nxt = points[i - 1], points[(i + 1) % n]
+            else:
+                if i == 0 or i == n - 1:
+                    self.junctions.add(p)
+                    continue
+                prev, nxt = points[i - 1], points[i + 1]
+            pair = (prev, nxt) if prev <= nxt else (nxt, prev)
+            seen = self.neighbors.get(p)
+            if seen is None:
+                self.neighbors[p] = pair
+            elif seen != pair:
+                self.junctions.add(p)
+        return len(self.lines) - 1
+
+    def _add_arc(self, points: List[Tuple[int, int]]) -> int:
+        key = tuple(points)
+        index = self.arc_index.get(key)
+        if index is not None:
+            return index
+        index = self.arc_index.get(key[::-1])
+        if index is not None:
+            return ~index
+        self.arcs.append(points)
+        self.arc_index[key] = len(self.arcs) - 1
+        return len(self.arcs) - 1
+
+    def line_arcs(self, line_id: int) -> List[int]:
+        points, closed = self.lines[line_id]
+        if not points:
+            return []
+        if closed:
+            cuts = [i for i, p in enumerate(points) if p in self.junctions]
+            if not cuts:
+                # Кольцо без узлов - одна дуга, начинаем с наименьшей точки,
+                # чтобы одинаковые кольца совпали
+                start = points.index(min(points))
+                ring = points[start:] + points[:start]
+                return [self._add_arc(ring + [ring[0]])]
+            # Поворачиваем кольцо, чтобы оно начиналось в первом узле
+            start = cuts[0]
+            n = len(points)
+            points = points[start:] + points[:start] + [points[start]]
+            cuts = [i - start for i in cuts] + [n]
+        else:
+            cuts = [i for i, p in enumerate(points) if p in self.junctions]
+            if not cuts or cuts[0] != 0:
+                cuts.insert(0, 0)
+            if cuts[-1] != len(points) - 1:
+                cuts.append(len(points) - 1)
+        arcs = []
+        for a, b in zip(cuts, cuts[1:]):
+            if b > a:
+                arcs.append(self._add_arc(points[a:b + 1]))
+        return arcs
+
+    def encoded_arcs(self) -> List[List[List[int]]]:
+        """Дуги с дельта-кодированием координат"""
+        result = []
+        for arc in self.arcs:
+            px = py = 0
+            encoded = []
+            for x, y in arc:
+                encoded.append([x - px, y - py])
+                px, py = x, y
+            result.append(encoded)
+        return result
+
+
+def to_topojson(collection: Dict[str, Any], object_name: str = "layer",
+                quantization: int = DEFAULT_QUANTIZATION) -> Dict[str, Any]:
+    """
+    Кодирует FeatureCollection в квантованный TopoJSON с дельта-кодированием дуг.
+    Общие границы соседних полигонов хранятся одной дугой
+    """
+    features = [f for f in collection.get("features", []) if isinstance(f, dict)]
+    bbox = _collection_bbox(features)
+    if bbox is None:
+        return {"type": "Topology", "objects": {object_name: {"type": "GeometryCollection", "geometries": []}}, "arcs": []}
+
+    builder = _TopologyBuilder(bbox, quantization)
+
+    # Первый проход: регистрируем все линии, чтобы найти узлы
+    registered = []
+    for feature in features:
+        geometry = feature.get("geometry") or {}
+        geo_type = geometry.get("type")
+        coords = geometry.get("coordinates")
+        if geo_type == "LineString":
+            lines = builder.add_line(coords, False)
+        elif geo_type == "MultiLineString":
+            lines = [builder.add_line(line, False) for line in coords]
+        elif geo_type == "Polygon":
+            lines = [builder.add_line(ring, True) for ring in coords]
+        elif geo_type == "MultiPolygon":
+            lines = [[builder.add_line(ring, True) for ring in polygon] for polygon in coords]
+        else:
+            lines = None
+        registered.append((feature, geo_type, lines))
+
+    # Второй проход: разрезаем линии на дуги
+    geometries = []
+    for feature, geo_type, lines in registered:
+        geometry = feature.get("geometry") or {}
+        if geo_type == "LineString":
+            topo = {"type": geo_type, "arcs": builder.line_arcs(lines)}
+        elif geo_type == "MultiLineString":
+            topo = {"type": geo_type, "arcs": [builder.line_arcs(line) for line in lines]}
+        elif geo_type == "Polygon":
+            topo = {"type": geo_type, "arcs": [builder.line_arcs(ring) for ring in lines]}
+        elif geo_type == "MultiPolygon":
+            topo = {"type": geo_type, "arcs": [[builder.line_arcs(ring) for ring in polygon] for polygon in lines]}
+        elif geo_type == "Point":
+            topo = {"type": geo_type, "coordinates": list(builder.quantize(geometry["coordinates"]))}
+        elif geo_type == "MultiPoint":
+            topo = {"type": geo_type, "coordinates": [list(builder.quantize(p)) for p in geometry["coordinates"]]}
+        else:
+            topo = {"type": None}
+        if "id" in feature:
+            topo["id"] = feature["id"]
+        if feature.get("properties"):
+            topo["properties"] = feature["properties"]
+        geometries.append(topo)
+
+    return {
+        "type": "Topology",
+        "bbox": bbox,
+        "transform": {
+            "scale": [1 / builder.kx, 1 / builder.ky],
+            "translate": [builder.x0, builder.y0],
+        },
+        "objects": {object_name: {"type": "GeometryCollection", "geometries": geometries}},
+        "arcs": builder.encoded_arcs(),
+    }
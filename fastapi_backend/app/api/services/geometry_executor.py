@@ -0,0 +1,173 @@
+import os
+import math
+import logging
+import threading
+import multiprocessing
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Начиная с какого числа вершин геометрии обрабатываются в пуле процессов
+GEOMETRY_PROCESS_THRESHOLD = int(os.getenv("GEOMETRY_PROCESS_THRESHOLD", "20000"))
+# Число процессов пула (0 - не использовать пул)
+GEOMETRY_PROCESS_WORKERS = int(os.getenv("GEOMETRY_PROCESS_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# Глубина вложенности списков координат для каждого типа геометрии
+COORDINATE_DEPTH = {
+    "Point": 0,
+    "LineString": 1,
+    "MultiPoint": 1,
+    "Polygon": 2,
+    "MultiLineString": 2,
+    "MultiPolygon": 3,
+}
+
+# Радиус Земли * π, как в nspd_service.transform_web_mercator_to_wgs84
+R_EARTH_PI = 20037508.34
+
+
+def web_mercator_to_wgs84_flat(data: bytes) -> bytes:
+    """
+    Преобразует плоский массив координат x0, y0, x1, y1, ... из EPSG:3857 в EPSG:4326.
+    Выполняется в процессе пула, поэтому принимает и возвращает байты массива double
+    """
+    coords = array("d")
+    coords.frombytes(data)
+    to_deg = 180 / math.pi
+    for i in range(0, len(coords), 2):
+        lng = (coords[i] / R_EARTH_PI) * 180
+        lat = (coords[i + 1] / R_EARTH_PI) * 180
+        lat = to_deg * (2 * math.atan(math.exp(lat * math.pi / 180)) - math.pi / 2)
+        coords[i] = max(-180, min(180, lng))
+        coords[i + 1] = max(-90, min(90, lat))
+    return coords.tobytes()
+
+
+# Операции над плоскими массивами координат, которые можно выполнять в пуле
+COORDINATE_OPERATIONS: Dict[str, Callable[[bytes], bytes]] = {
+    "web_mercator_to_wgs84": web_mercator_to_wgs84_flat,
+}
+
+
+def count_vertices(geometry: Optional[Dict[str, Any]]) -> int:
+    """Считает число вершин геометрии"""
+    if not geometry or "coordinates" not in geometry:
+        return 0
+    depth = COORDINATE_DEPTH.get(geometry.get("type"))
+    if depth is None:
+        return 0
+    coords = geometry["coordinates"]
+    if depth == 0:
+        return 1
+    if depth == 1:
+        return len(coords)
+    if depth == 2:
+        return sum(len(line) for line in coords)
+    return sum(len(line) for polygon in coords for line in polygon)
+
+
+def _flatten(coords: Any, depth: int, out: array) -> Any:
+    """Записывает координаты в плоский массив и возвращает структуру длин для восстановления"""
+    if depth == 0:
+        if len(coords) != 2:
+            raise ValueError("Поддерживаются только двумерные координаты")
+        out.append(coords[0])
+        out.append(coords[1])
+        return 1
+    if depth == 1:
+        for p in coords:
+            if len(p) != 2:
+                raise ValueError("Поддерживаются только двумерные координаты")
+            out.append(p[0])
+            out.append(p[1])
+        return len(coords)
+    return [_flatten(c, depth - 1, out) for c in coords]
+
+
+def _unflatten(structure: Any, depth: int, coords: array, pos: int):
+    """Восстанавливает вложенные списки координат из плоского массива"""
+    if depth == 0:
+        return [coords[pos], coords[pos + 1]], pos + 2
+    if depth == 1:
+        end = pos + 2 * structure
+        return [[coords[i], coords[i + 1]] for i in range(pos, end, 2)], end
+    result = []
+    for item in structure:
+        value, pos = _unflatten(item, depth - 1, coords, pos)
+        result.append(value)
+    return result, pos
+
+
+class GeometryExecutor:
+    """
+    Выполняет CPU-емкую обработку координат в пуле процессов, чтобы не держать GIL
+    в воркере приложения. Координаты передаются в пул плоскими массивами double,
+    а не вложенными списками
+    """
+
+    def __init__(self, workers: int = GEOMETRY_PROCESS_WORKERS, threshold: int = GEOMETRY_PROCESS_THRESHOLD):
+        self.workers = workers
+        self.threshold = threshold
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                # spawn безопаснее fork в многопоточном процессе сервера
+                context = multiprocessing.get_context("spawn")
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+                logger.info(f"Запущен пул процессов для геометрий: {self.workers} процессов")
+            return self._pool
+
+    def should_offload(self, vertex_count: int) -> bool:
+        return self.workers > 0 and vertex_count >= self.threshold
+
+    def map_coordinates(self, geometries: List[Dict[str, Any]], operation: str) -> List[Dict[str, Any]]:
+        """
+        Применяет операцию из COORDINATE_OPERATIONS ко всем координатам геометрий в пуле процессов.
+        Геометрии изменяются на месте; возвращается список обработанных геометрий.
+        Геометрии с неподдерживаемой структурой (например, 3D) пропускаются
+        """
+        func = COORDINATE_OPERATIONS[operation]
+        coords = array("d")
+        packed = []
+        for geometry in geometries:
+            depth = COORDINATE_DEPTH.get(geometry.get("type"))
+            if depth is None:
+                continue
+            start = len(coords)
+            try:
+                structure = _flatten(geometry["coordinates"], depth, coords)
+            except (ValueError, TypeError, IndexError, KeyError):
+                del coords[start:]
+                continue
+            packed.append((geometry, depth, structure))
+
+        if not packed:
+            return []
+
+        # Делим массив на части по числу процессов (по границам точек)
+        chunk = max(2, (len(coords) // self.workers) & ~1)
+        parts = [coords[i:i + chunk].tobytes() for i in range(0, len(coords), chunk)]
+        result = array("d")
+        for data in self._get_pool().map(func, parts):
+            result.frombytes(data)
+
+        pos = 0
+        processed = []
+        for geometry, depth, structure in packed:
+            geometry["coordinates"], pos = _unflatten(structure, depth, result, pos)
+            processed.append(geometry)
+        return processed
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+
+geometry_executor = GeometryExecutor()
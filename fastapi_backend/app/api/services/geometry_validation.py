@@ -0,0 +1,227 @@
+import math
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.api.services.metrics import GEOMETRY_VALIDATION
+
+
+class GeometryQualityStats:
+    """Статистика качества геометрий слоя или ответа НСПД"""
+
+    def __init__(self):
+        self.total = 0
+        self.valid = 0
+        self.repaired = 0
+        self.rejected = 0
+        self.issues: Counter = Counter()
+
+    def record(self, status: str, issues: List[str]) -> None:
+        self.total += 1
+        if status == "valid":
+            self.valid += 1
+        elif status == "repaired":
+            self.repaired += 1
+        else:
+            self.rejected += 1
+        self.issues.update(issues)
+
+    def merge(self, other: "GeometryQualityStats") -> None:
+        self.total += other.total
+        self.valid += other.valid
+        self.repaired += other.repaired
+        self.rejected += other.rejected
+        self.issues.update(other.issues)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "total": self.total,
+            "valid": self.valid,
+            "repaired": self.repaired,
+            "rejected": self.rejected,
+            "issues": dict(self.issues),
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "GeometryQualityStats":
+        stats = cls()
+        stats.total = data.get("total", 0)
+        stats.valid = data.get("valid", 0)
+        stats.repaired = data.get("repaired", 0)
+        stats.rejected = data.get("rejected", 0)
+        stats.issues.update(data.get("issues", {}))
+        return stats
+
+
+def _is_position(p: Any) -> bool:
+    return (
+        isinstance(p, (list, tuple)) and len(p) >= 2
+        and all(isinstance(c, (int, float)) and not isinstance(c, bool) and math.isfinite(c) for c in p[:2])
+    )
+
+
+def _dedupe(line: List[Any], issues: List[str]) -> List[Any]:
+    """Удаляет подряд идущие одинаковые вершины"""
+    result = []
+    for p in line:
+        if result and result[-1][:2] == p[:2]:
+            continue
+        result.append(p)
+    if len(result) != len(line):
+        issues.append("duplicate_vertices")
+    return result
+
+
+def _signed_area(ring: List[Any]) -> float:
+    area = 0.0
+    for i in range(len(ring) - 1):
+        area += ring[i][0] * ring[i + 1][1] - ring[i + 1][0] * ring[i][1]
+    return area / 2
+
+
+def _repair_line(line: Any, issues: List[str]) -> Optional[List[Any]]:
+    if not isinstance(line, list) or not all(_is_position(p) for p in line):
+        issues.append("invalid_coordinates")
+        return None
+    line = _dedupe(line, issues)
+    if len(line) < 2:
+        issues.append("degenerate_line")
+        return None
+    return line
+
+
+def _repair_ring(ring: Any, exterior: bool, issues: List[str]) -> Optional[List[Any]]:
+    """Замыкает кольцо, удаляет повторы вершин и приводит обход к RFC 7946 (внешнее - против часовой)"""
+    if not isinstance(ring, list) or not all(_is_position(p) for p in ring):
+        issues.append("invalid_coordinates")
+        return None
+    ring = _dedupe(ring, issues)
+    if ring and ring[0][:2] != ring[-1][:2]:
+        issues.append("unclosed_ring")
+        ring = ring + [ring[0]]
+    if len(ring) < 4:
+        issues.append("degenerate_ring")
+        return None
+    area = _signed_area(ring)
+    if area == 0:
+        issues.append("degenerate_ring")
+        return None
+    if (area > 0) != exterior:
+        issues.append("winding_order")
+        ring = ring[::-1]
+    return ring
+
+
+def _repair_polygon(rings: Any, issues: List[str]) -> Optional[List[Any]]:
+    if not isinstance(rings, list) or not rings:
+        issues.append("degenerate_polygon")
+        return None
+    exterior = _repair_ring(rings[0], True, issues)
+    if exterior is None:
+        return None
+    holes = []
+    for ring in rings[1:]:
+        hole = _repair_ring(ring, False, issues)
+        # Вырожденная дыра просто отбрасывается
+        if hole is not None:
+            holes.append(hole)
+    return [exterior] + holes
+
+
+def _repair_coordinates(geo_type: str, coords: Any, issues: List[str]) -> Optional[Any]:
+    if geo_type == "Point":
+        if not _is_position(coords):
+            issues.append("invalid_coordinates")
+            return None
+        return coords
+    if geo_type == "MultiPoint":
+        if not isinstance(coords, list):
+            issues.append("invalid_coordinates")
+            return None
+        points = [p for p in coords if _is_position(p)]
+        if len(points) != len(coords):
+            issues.append("invalid_coordinates")
+        return points or None
+    if geo_type == "LineString":
+        return _repair_line(coords, issues)
+    if geo_type == "Polygon":
+        return _repair_polygon(coords, issues)
+    if not isinstance(coords, list):
+        issues.append("invalid_coordinates")
+        return None
+    if geo_type == "MultiLineString":
+        parts = [line for line in (_repair_line(c, issues) for c in coords) if line is not None]
+    else:
+        parts = [polygon for polygon in (_repair_polygon(c, issues) for c in coords) if polygon is not None]
+    return parts or None
+
+
+def validate_geometry(geometry: Any) -> Tuple[Optional[Dict[str, Any]], List[str]]:
+    """
+    Проверяет и исправляет геометрию GeoJSON: замыкает кольца, удаляет подряд идущие
+    одинаковые вершины, исправляет направление обхода колец и отбрасывает
+    вырожденные части. Возвращает исправленную копию (None, если геометрия
+    непригодна) и список найденных проблем
+    """
+    issues: List[str] = []
+    if not isinstance(geometry, dict) or "type" not in geometry:
+        return None, ["missing_geometry"]
+    geo_type = geometry["type"]
+    if geo_type == "GeometryCollection":
+        parts = []
+        for part in geometry.get("geometries") or []:
+            repaired, part_issues = validate_geometry(part)
+            issues.extend(part_issues)
+            if repaired is not None:
+                parts.append(repaired)
+        if not parts:
+            return None, issues or ["degenerate_geometry"]
+        return dict(geometry, geometries=parts), issues
+    if geo_type not in ("Point", "MultiPoint", "LineString", "MultiLineString", "Polygon", "MultiPolygon"):
+        return None, ["unsupported_type"]
+
+    coords = _repair_coordinates(geo_type, geometry.get("coordinates"), issues)
+    if coords is None:
+        return None, issues or ["degenerate_geometry"]
+    if not issues:
+        return geometry, issues
+    return dict(geometry, coordinates=coords), issues
+
+
+# Свойство объекта, оставленного без геометрии (keep_rejected=True)
+NO_GEOMETRY_PROPERTY = "no_geometry"
+
+
+def validate_features(features: List[Any], source: str,
+                      stats: Optional[GeometryQualityStats] = None,
+                      keep_rejected: bool = False) -> Tuple[List[Dict[str, Any]], GeometryQualityStats]:
+    """
+    Проверяет геометрии объектов при загрузке данных. Возвращает объекты с
+    исправленными геометриями и статистику качества. Объекты с отсутствующей или
+    непригодной геометрией отбрасываются, а с keep_rejected остаются с geometry: null
+    и свойством NO_GEOMETRY_PROPERTY (например, участок НСПД без границ)
+    """
+    stats = stats or GeometryQualityStats()
+    result = []
+    for feature in features:
+        if not isinstance(feature, dict):
+            stats.record("rejected", ["invalid_feature"])
+            GEOMETRY_VALIDATION.labels(source=source, result="rejected").inc()
+            continue
+        geometry, issues = validate_geometry(feature.get("geometry"))
+        if geometry is None:
+            status = "rejected"
+        elif issues:
+            status = "repaired"
+            feature = dict(feature, geometry=geometry)
+        else:
+            status = "valid"
+        stats.record(status, issues)
+        GEOMETRY_VALIDATION.labels(source=source, result=status).inc()
+        if geometry is not None:
+            result.append(feature)
+        elif keep_rejected:
+            properties = feature.get("properties")
+            properties = dict(properties) if isinstance(properties, dict) else {}
+            properties[NO_GEOMETRY_PROPERTY] = True
+            result.append(dict(feature, geometry=None, properties=properties))
+    return result, stats
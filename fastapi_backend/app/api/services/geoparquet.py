@@ -0,0 +1,296 @@
+import os
+import json
+import struct
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+from app.api.services.spatial_index import BBox, geometry_bbox
+from app.api.services.flatgeobuf import (
+    COL_BOOL, COL_LONG, COL_DOUBLE, COL_STRING, COL_JSON, hilbert_sort, infer_columns,
+    feature_properties, make_feature
+)
+
+# Формат GeoParquet 1.1: геометрия в WKB, рядом столбец bbox (xmin, ymin, xmax, ymax),
+# объекты упорядочены по кривой Гильберта. Статистика столбца bbox в каждой группе строк
+# позволяет при чтении по прямоугольнику пропускать группы целиком.
+# Требует пакета pyarrow (опциональная зависимость)
+
+# Число объектов в группе строк: меньше группа - точнее отбор по bbox, больше - лучше сжатие
+GEOPARQUET_ROW_GROUP_SIZE = int(os.getenv("GEOPARQUET_ROW_GROUP_SIZE", "2000"))
+
+GEOMETRY_COLUMN = "geometry"
+BBOX_COLUMN = "bbox"
+# Ключ метаданных файла с описанием слоя (в том числе столбцы со значениями JSON)
+LAYER_METADATA_KEY = b"mgis"
+
+_WKB_TYPES = {
+    "Point": 1, "LineString": 2, "Polygon": 3, "MultiPoint": 4,
+    "MultiLineString": 5, "MultiPolygon": 6, "GeometryCollection": 7,
+}
+_WKB_NAMES = {code: name for name, code in _WKB_TYPES.items()}
+
+
+class GeoParquetUnavailable(RuntimeError):
+    """Не установлен пакет pyarrow"""
+
+
+class GeoParquetError(ValueError):
+    """Файл не является GeoParquet или содержит неподдерживаемые данные"""
+
+
+def _pyarrow():
+    try:
+        import pyarrow  # Опциональная зависимость
+        import pyarrow.parquet
+    except ImportError:
+        raise GeoParquetUnavailable("Для работы с GeoParquet установите пакет pyarrow")
+    return pyarrow
+
+
+# --- WKB ---------------------------------------------------------------------------
+
+def _wkb_points(points: Sequence[Sequence[float]], out: bytearray) -> None:
+    out.extend(struct.pack("<I", len(points)))
+    for point in points:
+        out.extend(struct.pack("<2d", point[0], point[1]))
+
+
+def to_wkb(geometry: Dict[str, Any]) -> bytes:
+    """Геометрия GeoJSON в WKB (little-endian, только X и Y)"""
+    out = bytearray()
+    _write_wkb(geometry, out)
+    return bytes(out)
+
+
+def _write_wkb(geometry: Dict[str, Any], out: bytearray) -> None:
+    geo_type = geometry.get("type")
+    if geo_type not in _WKB_TYPES:
+        raise ValueError(f"Неподдерживаемый тип геометрии: {geo_type}")
+    out.extend(struct.pack("<BI", 1, _WKB_TYPES[geo_type]))
+    coords = geometry.get("coordinates")
+    if geo_type == "Point":
+        out.extend(struct.pack("<2d", coords[0], coords[1]))
+    elif geo_type == "LineString":
+        _wkb_points(coords, out)
+    elif geo_type == "Polygon":
+        out.extend(struct.pack("<I", len(coords)))
+        for ring in coords:
+            _wkb_points(ring, out)
+    elif geo_type == "GeometryCollection":
+        parts = geometry.get("geometries") or []
+        out.extend(struct.pack("<I", len(parts)))
+        for part in parts:
+            _write_wkb(part, out)
+    else:
+        part_type = geo_type[len("Multi"):]
+        out.extend(struct.pack("<I", len(coords)))
+        for part in coords:
+            _write_wkb({"type": part_type, "coordinates": part}, out)
+
+
+def from_wkb(data: bytes) -> Dict[str, Any]:
+    """WKB (в том числе ISO и EWKB с Z/M - лишние координаты отбрасываются) в геометрию GeoJSON"""
+    geometry, _ = _read_wkb(memoryview(data), 0)
+    return geometry
+
+
+def _read_wkb(data: memoryview, position: int) -> Tuple[Dict[str, Any], int]:
+    order = "<" if data[position] == 1 else ">"
+    code = struct.unpack_from(order + "I", data, position + 1)[0]
+    position += 5
+    # Размерность: ISO (1001, 2001, 3001) или флаги EWKB
+    dims = 2
+    if code & 0x20000000:
+        position += 4  # SRID EWKB
+    if code & 0x80000000 or code & 0x40000000:
+        dims += bool(code & 0x80000000) + bool(code & 0x40000000)
+    code &= 0x0FFFFFFF
+    if code > 1000:
+        dims += {1: 1, 2: 1, 3: 2}.get(code // 1000, 0)
+        code %= 1000
+    name = _WKB_NAMES.get(code)
+    if name is None:
+        raise GeoParquetError(f"Неподдерживаемый тип геометрии WKB: {code}")
+    point_format = order + f"{dims}d"
+    point_size = 8 * dims
+
+    def read_points(at: int) -> Tuple[List[List[float]], int]:
+        count = struct.unpack_from(order + "I", data, at)[0]
+        at += 4
+        points = []
+        for _ in range(count):
+            values = struct.unpack_from(point_format, data, at)
+            points.append([values[0], values[1]])
+            at += point_size
+        return points, at
+
+    if name == "Point":
+        values = struct.unpack_from(point_format, data, position)
+        return {"type": name, "coordinates": [values[0], values[1]]}, position + point_size
+    if name == "LineString":
+        points, position = read_points(position)
+        return {"type": name, "coordinates": points}, position
+    if name == "Polygon":
+        count = struct.unpack_from(order + "I", data, position)[0]
+        position += 4
+        rings = []
+        for _ in range(count):
+            ring, position = read_points(position)
+            rings.append(ring)
+        return {"type": name, "coordinates": rings}, position
+
+    count = struct.unpack_from(order + "I", data, position)[0]
+    position += 4
+    parts = []
+    for _ in range(count):
+        part, position = _read_wkb(data, position)
+        parts.append(part)
+    if name == "GeometryCollection":
+        return {"type": name, "geometries": parts}, position
+    return {"type": name, "coordinates": [part["coordinates"] for part in parts]}, position
+
+
+# --- Запись и чтение файла ---------------------------------------------------------
+
+def write_geoparquet(features: Sequence[Dict[str, Any]], out: Union[str, BinaryIO],
+                     metadata: Optional[str] = None) -> int:
+    """
+    Записывает объекты GeoJSON (EPSG:4326) в GeoParquet группами по GEOPARQUET_ROW_GROUP_SIZE
+    объектов, упорядоченных по кривой Гильберта (id - в столбце FEATURE_ID_COLUMN).
+    Объекты без геометрии не записываются. Возвращает число записанных объектов
+    """
+    pa = _pyarrow()
+    items = []
+    for feature in features:
+        geometry = feature.get("geometry") if isinstance(feature, dict) else None
+        box = geometry_bbox(geometry)
+        if box is not None:
+            items.append((box, feature))
+    items = hilbert_sort(items)
+    properties = [feature_properties(feature) for _, feature in items]
+    columns = infer_columns([{"properties": p} for p in properties])
+
+    arrow_types = {COL_BOOL: pa.bool_(), COL_LONG: pa.int64(), COL_DOUBLE: pa.float64(),
+                   COL_STRING: pa.string(), COL_JSON: pa.string()}
+    arrays = []
+    names = []
+    for name, column_type in columns:
+        values = [p.get(name) for p in properties]
+        if column_type == COL_JSON:
+            values = [json.dumps(v, ensure_ascii=False) if v is not None else None for v in values]
+        elif column_type == COL_DOUBLE:
+            values = [float(v) if v is not None else None for v in values]
+        arrays.append(pa.array(values, type=arrow_types[column_type]))
+        names.append(name)
+    if GEOMETRY_COLUMN in names or BBOX_COLUMN in names:
+        raise GeoParquetError(f"Свойства {GEOMETRY_COLUMN} и {BBOX_COLUMN} заняты служебными столбцами")
+
+    arrays.append(pa.array([to_wkb(feature["geometry"]) for _, feature in items], type=pa.binary()))
+    names.append(GEOMETRY_COLUMN)
+    bbox_type = pa.struct([(field, pa.float64()) for field in ("xmin", "ymin", "xmax", "ymax")])
+    arrays.append(pa.array([dict(zip(("xmin", "ymin", "xmax", "ymax"), box)) for box, _ in items], type=bbox_type))
+    names.append(BBOX_COLUMN)
+
+    geometry_types = sorted({feature["geometry"]["type"] for _, feature in items})
+    extent = [min(b[0] for b, _ in items), min(b[1] for b, _ in items),
+              max(b[2] for b, _ in items), max(b[3] for b, _ in items)] if items else []
+    geo = {
+        "version": "1.1.0",
+        "primary_column": GEOMETRY_COLUMN,
+        "columns": {GEOMETRY_COLUMN: {
+            "encoding": "WKB",
+            "geometry_types": geometry_types,
+            "bbox": extent,
+            "covering": {"bbox": {key: [BBOX_COLUMN, key] for key in ("xmin", "ymin", "xmax", "ymax")}},
+        }},
+    }
+    layer = {"json_columns": [name for name, column_type in columns if column_type == COL_JSON],
+             "metadata": metadata}
+    table = pa.Table.from_arrays(arrays, names=names).replace_schema_metadata({
+        b"geo": json.dumps(geo).encode("utf-8"),
+        LAYER_METADATA_KEY: json.dumps(layer, ensure_ascii=False).encode("utf-8"),
+    })
+    pa.parquet.write_table(table, out, row_group_size=GEOPARQUET_ROW_GROUP_SIZE, compression="zstd")
+    return len(items)
+
+
+class GeoParquetReader:
+    """
+    Потоковое чтение GeoParquet: группы строк читаются по одной.
+    С bbox группы, экстент которых (по статистике столбца bbox) не пересекается
+    с прямоугольником, не читаются
+    """
+
+    def __init__(self, source: Union[str, BinaryIO]):
+        pa = _pyarrow()
+        try:
+            self.file = pa.parquet.ParquetFile(source)
+        except pa.ArrowException as e:
+            raise GeoParquetError(f"Файл не является Parquet: {str(e)}")
+        schema_metadata = self.file.schema_arrow.metadata or {}
+        try:
+            geo = json.loads(schema_metadata[b"geo"])
+        except (KeyError, ValueError):
+            raise GeoParquetError("В файле Parquet нет метаданных GeoParquet (geo)")
+        self.geometry_column = geo.get("primary_column", GEOMETRY_COLUMN)
+        column = (geo.get("columns") or {}).get(self.geometry_column) or {}
+        if column.get("encoding", "WKB").upper() != "WKB":
+            raise GeoParquetError(f"Неподдерживаемая кодировка геометрии: {column.get('encoding')}")
+        # Без crs координаты - долгота и широта (OGC:CRS84), иначе код из PROJJSON
+        crs = column.get("crs")
+        self.crs_code = ((crs.get("id") or {}).get("code") if isinstance(crs, dict) else crs) if crs is not None else None
+        covering = (column.get("covering") or {}).get("bbox") or {}
+        self.bbox_column = covering.get("xmin", [None])[0]
+        try:
+            layer = json.loads(schema_metadata.get(LAYER_METADATA_KEY, b"{}"))
+        except ValueError:
+            layer = {}
+        self.json_columns = set(layer.get("json_columns") or [])
+        self.metadata = layer.get("metadata")
+        self.features_count = self.file.metadata.num_rows
+        self.property_columns = [name for name in self.file.schema_arrow.names
+                                 if name not in (self.geometry_column, self.bbox_column)]
+
+    def _row_group_bbox(self, index: int) -> Optional[BBox]:
+        """Экстент группы строк по статистике столбцов bbox.xmin, ... (None - статистики нет)"""
+        if self.bbox_column is None:
+            return None
+        row_group = self.file.metadata.row_group(index)
+        stats = {}
+        for i in range(row_group.num_columns):
+            column = row_group.column(i)
+            path = column.path_in_schema
+            if not path.startswith(self.bbox_column + "."):
+                continue
+            if column.statistics is None or not column.statistics.has_min_max:
+                return None
+            stats[path.split(".")[-1]] = column.statistics
+        if len(stats) < 4:
+            return None
+        return (stats["xmin"].min, stats["ymin"].min, stats["xmax"].max, stats["ymax"].max)
+
+    def features(self, bbox: Optional[BBox] = None) -> Iterator[Dict[str, Any]]:
+        """Объекты файла; с bbox - только пересекающиеся с прямоугольником по экстенту"""
+        for index in range(self.file.num_row_groups):
+            if bbox is not None:
+                group_bbox = self._row_group_bbox(index)
+                if group_bbox is not None and (group_bbox[0] > bbox[2] or group_bbox[2] < bbox[0]
+                                               or group_bbox[1] > bbox[3] or group_bbox[3] < bbox[1]):
+                    continue
+            rows = self.file.read_row_group(index).to_pylist()
+            for row in rows:
+                data = row.pop(self.geometry_column)
+                row_bbox = row.pop(self.bbox_column, None) if self.bbox_column else None
+                geometry = from_wkb(data) if data is not None else None
+                if bbox is not None:
+                    box = ((row_bbox["xmin"], row_bbox["ymin"], row_bbox["xmax"], row_bbox["ymax"])
+                           if row_bbox else geometry_bbox(geometry))
+                    if box is None or box[0] > bbox[2] or box[2] < bbox[0] or box[1] > bbox[3] or box[3] < bbox[1]:
+                        continue
+                properties = {}
+                for name, value in row.items():
+                    if value is None:
+                        continue
+                    if name in self.json_columns and isinstance(value, str):
+                        value = json.loads(value)
+                    properties[name] = value
+                yield make_feature(geometry, properties)
@@ -0,0 +1,67 @@
+import os
+import json
+import hashlib
+from typing import Any, Optional
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response
+
+# Данные слоев и список слоев могут измениться в любой момент (правки объектов,
+# новые файлы), поэтому ответ сохраняется в кэше браузера и service worker, но перед
+# использованием проверяется по ETag: если данные не изменились, сервер отвечает 304 без тела
+LAYER_CACHE_CONTROL = os.getenv("LAYER_CACHE_CONTROL", "public, no-cache")
+# Ответы, которые нельзя переиспользовать (ошибки поиска, заглушки)
+NO_STORE = "no-store"
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Совпадает ли ETag с одним из значений If-None-Match. Сравнение слабое (RFC 9110):
+    прокси, сжимающий ответы, заменяет строгий ETag на слабый W/"..."
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    tag = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == tag:
+            return True
+    return False
+
+
+def not_modified(etag: str, cache_control: str = LAYER_CACHE_CONTROL) -> Response:
+    """Ответ 304 Not Modified: клиент использует сохраненную у себя копию"""
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control})
+
+
+def encode_json(content: Any) -> bytes:
+    """Кодирует ответ в JSON с теми же параметрами, что JSONResponse"""
+    return json.dumps(
+        jsonable_encoder(content), ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+    ).encode("utf-8")
+
+
+def content_etag(body: bytes) -> str:
+    """Строгий ETag по содержимому тела ответа"""
+    return f'"{hashlib.sha1(body).hexdigest()}"'
+
+
+def cached_json_response(content: Any, if_none_match: Optional[str], etag: Optional[str] = None,
+                         cache_control: str = LAYER_CACHE_CONTROL) -> Response:
+    """
+    JSON-ответ с ETag и Cache-Control или 304, если у клиента та же версия.
+    etag - заранее известный ETag версии данных; если не задан, считается по телу
+    """
+    if etag is not None and etag_matches(if_none_match, etag):
+        return not_modified(etag, cache_control)
+    body = encode_json(content)
+    if etag is None:
+        etag = content_etag(body)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag, cache_control)
+    return Response(content=body, media_type="application/json",
+                    headers={"ETag": etag, "Cache-Control": cache_control})
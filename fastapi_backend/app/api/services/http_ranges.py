@@ -0,0 +1,85 @@
+import os
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from fastapi import HTTPException
+from fastapi.responses import FileResponse, Response
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Разбирает заголовок Range: bytes=start-end, bytes=start- или bytes=-suffix.
+    Возвращает (start, end) включительно или None, если диапазон не задан или
+    запрошено несколько диапазонов (тогда отдается весь ответ, как разрешает RFC 9110).
+    Недостижимый диапазон - HTTPException 416
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    start_text, sep, end_text = spec.strip().partition("-")
+    if not sep:
+        return None
+    try:
+        if start_text:
+            start = int(start_text)
+            end = int(end_text) if end_text else size - 1
+        else:
+            suffix = int(end_text)
+            if suffix <= 0:
+                raise ValueError
+            start, end = max(0, size - suffix), size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        raise HTTPException(
+            status_code=416,
+            detail="Запрошенный диапазон за пределами данных",
+            headers={"Content-Range": f"bytes */{size}"}
+        )
+    if end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+def range_response(body: bytes, etag: str, range_header: Optional[str], if_range: Optional[str],
+                   media_type: str = "application/json",
+                   headers: Optional[Dict[str, str]] = None) -> Response:
+    """
+    Отдает тело целиком или запрошенный диапазон байтов (206 Partial Content).
+    If-Range с другим ETag означает, что данные изменились с начала загрузки, -
+    тогда отдается весь ответ, и клиент начинает загрузку заново
+    """
+    headers = dict(headers or {}, ETag=etag)
+    headers["Accept-Ranges"] = "bytes"
+    byte_range = None
+    if if_range is None or if_range.strip() == etag:
+        byte_range = parse_range(range_header, len(body))
+    if byte_range is None:
+        return Response(content=body, media_type=media_type, headers=headers)
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{len(body)}"
+    return Response(content=body[start:end + 1], status_code=206, media_type=media_type, headers=headers)
+
+
+def file_range_response(path: Path, etag: str, range_header: Optional[str], if_range: Optional[str],
+                        media_type: str, headers: Optional[Dict[str, str]] = None) -> Response:
+    """
+    То же, что range_response, для файла на диске: с диска читается только запрошенный
+    диапазон. Так клиенты FlatGeobuf читают заголовок и индекс файла, а затем только нужные объекты
+    """
+    headers = dict(headers or {}, ETag=etag)
+    headers["Accept-Ranges"] = "bytes"
+    size = os.path.getsize(path)
+    byte_range = None
+    if if_range is None or if_range.strip() == etag:
+        byte_range = parse_range(range_header, size)
+    if byte_range is None:
+        return FileResponse(path, media_type=media_type, headers=headers)
+    start, end = byte_range
+    with open(path, "rb") as f:
+        f.seek(start)
+        body = f.read(end - start + 1)
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return Response(content=body, status_code=206, media_type=media_type, headers=headers)
@@ -0,0 +1,252 @@
+import os
+import json
+import math
+import heapq
+import logging
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from app.api.services.spatial_index import geometry_polygons, representative_point
+
+logger = logging.getLogger(__name__)
+
+# Точность поиска точки метки: доля большей стороны экстента полигона
+LABEL_POINT_PRECISION = float(os.getenv("LABEL_POINT_PRECISION", "0.02"))
+# Кольца с большим числом вершин прореживаются перед поиском: положение метки
+# от этого почти не меняется, а время поиска пропорционально числу вершин
+LABEL_POINT_MAX_VERTICES = int(os.getenv("LABEL_POINT_MAX_VERTICES", "200"))
+# Центроид принимается без поиска, если он удален от границы не меньше чем на эту
+# долю радиуса круга той же площади (выпуклые и близкие к ним полигоны)
+LABEL_CENTROID_DEPTH = float(os.getenv("LABEL_CENTROID_DEPTH", "0.5"))
+
+Ring = List[Sequence[float]]
+_SQRT2 = math.sqrt(2)
+
+
+def _thin(ring: Ring) -> Ring:
+    if len(ring) <= LABEL_POINT_MAX_VERTICES:
+        return ring
+    step = math.ceil(len(ring) / LABEL_POINT_MAX_VERTICES)
+    return ring[::step] + [ring[-1]]
+
+
+def _segments(rings: List[Ring]) -> List[Tuple[float, float, float, float, float]]:
+    """Ребра колец: начало, приращение и квадрат длины (считаются один раз для всех проверок)"""
+    segments = []
+    for ring in rings:
+        for i in range(len(ring)):
+            ax, ay = ring[i - 1][0], ring[i - 1][1]
+            dx, dy = ring[i][0] - ax, ring[i][1] - ay
+            segments.append((ax, ay, dx, dy, dx * dx + dy * dy))
+    return segments
+
+
+def _point_distance(x: float, y: float, segments: List[Tuple[float, float, float, float, float]]) -> float:
+    """Расстояние от точки до границы полигона: положительное внутри, отрицательное снаружи"""
+    inside = False
+    min_sq = math.inf
+    for ax, ay, dx, dy, length_sq in segments:
+        if (ay > y) != (ay + dy > y) and x < dx * (y - ay) / dy + ax:
+            inside = not inside
+        px, py = x - ax, y - ay
+        if length_sq:
+            t = (px * dx + py * dy) / length_sq
+            if t > 1:
+                px, py = px - dx, py - dy
+            elif t > 0:
+                px, py = px - dx * t, py - dy * t
+        sq = px * px + py * py
+        if sq < min_sq:
+            min_sq = sq
+    return math.sqrt(min_sq) if inside else -math.sqrt(min_sq)
+
+
+def _ring_area(ring: Ring) -> float:
+    return sum(p1[0] * p2[1] - p2[0] * p1[1] for p1, p2 in zip(ring, ring[1:] + ring[:1])) / 2
+
+
+def _centroid(ring: Ring, area: float) -> Tuple[float, float]:
+    cx = cy = 0.0
+    for p1, p2 in zip(ring, ring[1:] + ring[:1]):
+        cross = p1[0] * p2[1] - p2[0] * p1[1]
+        cx += (p1[0] + p2[0]) * cross
+        cy += (p1[1] + p2[1]) * cross
+    return (cx / (6 * area), cy / (6 * area))
+
+
+def polylabel(rings: List[Ring], precision: Optional[float] = None) -> Tuple[float, float]:
+    """
+    Полюс недоступности полигона - внутренняя точка, наиболее удаленная от границы
+    (алгоритм polylabel: перебор квадратных ячеек с отсечением по верхней оценке
+    расстояния). В отличие от центроида всегда лежит внутри полигона, в том числе
+    вогнутого, и подходит для размещения подписи. Для полигонов, центроид которых
+    лежит глубоко внутри, возвращается центроид
+    """
+    outer = rings[0]
+    min_x = min(p[0] for p in outer)
+    min_y = min(p[1] for p in outer)
+    max_x = max(p[0] for p in outer)
+    max_y = max(p[1] for p in outer)
+    width, height = max_x - min_x, max_y - min_y
+    cell_size = min(width, height)
+    if cell_size == 0:
+        return (min_x, min_y)
+    if precision is None:
+        precision = max(width, height) * LABEL_POINT_PRECISION
+    segments = _segments([_thin(ring) for ring in rings])
+
+    def cell(x: float, y: float, h: float) -> Tuple[float, float, float, float, float]:
+        d = _point_distance(x, y, segments)
+        # Верхняя оценка расстояния для точек ячейки; для кучи - со знаком минус
+        return (-(d + h * _SQRT2), d, x, y, h)
+
+    # Начальное приближение - центроид внешнего кольца. Если он достаточно далеко
+    # от границы, подпись в нем выглядит так же, и перебор ячеек не нужен
+    area = _ring_area(outer)
+    centroid = _centroid(outer, area) if area else None
+    if centroid is not None:
+        best = cell(centroid[0], centroid[1], 0)
+        if best[1] >= LABEL_CENTROID_DEPTH * math.sqrt(abs(area) / math.pi):
+            return centroid
+    else:
+        best = cell(min_x + width / 2, min_y + height / 2, 0)
+    box_center = cell(min_x + width / 2, min_y + height / 2, 0)
+    if box_center[1] > best[1]:
+        best = box_center
+
+    queue = []
+    h = cell_size / 2
+    x = min_x
+    while x < max_x:
+        y = min_y
+        while y < max_y:
+            heapq.heappush(queue, cell(x + h, y + h, h))
+            y += cell_size
+        x += cell_size
+
+    while queue:
+        current = heapq.heappop(queue)
+        if current[1] > best[1]:
+            best = current
+        # Ячейка не может дать точку заметно лучше найденной
+        if -current[0] - best[1] <= precision:
+            continue
+        h = current[4] / 2
+        for dx in (-h, h):
+            for dy in (-h, h):
+                heapq.heappush(queue, cell(current[2] + dx, current[3] + dy, h))
+    return (best[2], best[3])
+
+
+def _line_midpoint(line: Sequence[Sequence[float]]) -> Optional[Tuple[float, float]]:
+    """Точка на середине длины линии"""
+    if not line:
+        return None
+    lengths = [math.hypot(b[0] - a[0], b[1] - a[1]) for a, b in zip(line, line[1:])]
+    half = sum(lengths) / 2
+    for (a, b), length in zip(zip(line, line[1:]), lengths):
+        if half <= length and length:
+            t = half / length
+            return (a[0] + (b[0] - a[0]) * t, a[1] + (b[1] - a[1]) * t)
+        half -= length
+    return (line[0][0], line[0][1])
+
+
+def label_point(geometry: Optional[Dict[str, Any]]) -> Optional[Tuple[float, float]]:
+    """
+    Точка подписи объекта: для полигонов - полюс недоступности самого большого
+    полигона, для линий - середина самой длинной линии, для точек - сама точка
+    """
+    if not isinstance(geometry, dict):
+        return None
+    geo_type = geometry.get("type")
+    coords = geometry.get("coordinates")
+    try:
+        if geo_type in ("Polygon", "MultiPolygon"):
+            polygons = [rings for rings in geometry_polygons(geometry) if rings and len(rings[0]) >= 3]
+            if polygons:
+                return polylabel(max(polygons, key=lambda rings: abs(_ring_area(rings[0]))))
+        elif geo_type == "LineString":
+            return _line_midpoint(coords)
+        elif geo_type == "MultiLineString" and coords:
+            longest = max(coords, key=lambda line: sum(
+                math.hypot(b[0] - a[0], b[1] - a[1]) for a, b in zip(line, line[1:])))
+            return _line_midpoint(longest)
+        elif geo_type == "GeometryCollection":
+            for part in geometry.get("geometries") or []:
+                point = label_point(part)
+                if point is not None:
+                    return point
+            return None
+    except (TypeError, IndexError, ZeroDivisionError):
+        pass
+    return representative_point(geometry)
+
+
+def label_feature(feature: Dict[str, Any], fields: Optional[List[str]]) -> Optional[Dict[str, Any]]:
+    """Точка подписи объекта с его id и свойствами fields (None - всеми)"""
+    if not isinstance(feature, dict):
+        return None
+    point = label_point(feature.get("geometry"))
+    if point is None:
+        return None
+    properties = feature.get("properties") or {}
+    if fields is not None:
+        properties = {key: properties[key] for key in fields if key in properties}
+    label = {"type": "Feature", "geometry": {"type": "Point", "coordinates": [point[0], point[1]]},
+             "properties": properties}
+    if feature.get("id") is not None:
+        label["id"] = feature["id"]
+    return label
+
+
+def compute_label_points(collection: Dict[str, Any], fields: Optional[List[str]],
+                         reuse: Optional[Dict[Any, Dict[str, Any]]] = None) -> Dict[str, Any]:
+    """
+    Облегченное представление слоя: по точке подписи на объект и минимальный
+    набор свойств. reuse - уже посчитанные точки по id объекта (для неизмененных объектов)
+    """
+    features = []
+    for feature in collection.get("features") or []:
+        label = None
+        if reuse and isinstance(feature, dict) and feature.get("id") is not None:
+            label = reuse.get(feature["id"])
+        if label is None:
+            label = label_feature(feature, fields)
+        if label is not None:
+            features.append(label)
+    return {
+        "type": "FeatureCollection",
+        "features": features,
+        "feature_count": len(features),
+        "version": collection.get("version", 0),
+    }
+
+
+def labels_path(file_path: Path) -> Path:
+    """Точки подписей хранятся рядом с файлом слоя: layer.geojson.labels.json"""
+    return file_path.with_name(file_path.name + ".labels.json")
+
+
+def read_labels_file(file_path: Path, cache_key: str) -> Optional[Dict[str, Any]]:
+    """Читает сохраненные точки подписей, если они посчитаны для этой же версии файла"""
+    try:
+        with open(labels_path(file_path), "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+    if not isinstance(data, dict) or data.get("key") != cache_key:
+        return None
+    return data.get("labels")
+
+
+def write_labels_file(file_path: Path, cache_key: str, labels: Dict[str, Any]) -> None:
+    """Сохраняет точки подписей, чтобы после перезапуска их не нужно было считать заново"""
+    path = labels_path(file_path)
+    tmp_path = path.with_name(path.name + ".tmp")
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"key": cache_key, "labels": labels}, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"Не удалось сохранить точки подписей слоя {file_path}: {str(e)}")
@@ -0,0 +1,198 @@
+import os
+import json
+import uuid
+import logging
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.api.services.geometry_validation import GeometryQualityStats, validate_geometry
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировка между процессами недоступна
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# После скольких записей журнал сливается с файлом слоя
+LAYER_JOURNAL_MAX_ENTRIES = int(os.getenv("LAYER_JOURNAL_MAX_ENTRIES", "1000"))
+
+
+def journal_path(file_path: Path) -> Path:
+    """Журнал изменений слоя хранится рядом с файлом: layer.geojson.journal"""
+    return file_path.with_name(file_path.name + ".journal")
+
+
+def get_feature_id(feature: Dict[str, Any]) -> Any:
+    """Идентификатор объекта: член id или свойство id"""
+    if "id" in feature:
+        return feature["id"]
+    properties = feature.get("properties")
+    if isinstance(properties, dict):
+        return properties.get("id")
+    return None
+
+
+def feature_key(feature_id: Any) -> Optional[str]:
+    """
+    Ключ для сравнения идентификаторов: в GeoJSON id бывает числом или строкой,
+    а в запросах изменений и журнале приходит в любом из видов ("2" и 2 - один объект)
+    """
+    return None if feature_id is None else str(feature_id)
+
+
+@contextmanager
+def journal_lock(file_path: Path):
+    """Блокирует журнал слоя, чтобы воркеры не выдали одну версию двум изменениям"""
+    lock_path = file_path.with_name(file_path.name + ".lock")
+    with open(lock_path, "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def read_journal(file_path: Path) -> List[Dict[str, Any]]:
+    """Читает записи журнала (по одной JSON-записи на строку); недописанная строка пропускается"""
+    path = journal_path(file_path)
+    if not path.exists():
+        return []
+    entries = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                logger.warning(f"Пропущена поврежденная запись журнала {path}")
+    return entries
+
+
+def append_journal(file_path: Path, entries: List[Dict[str, Any]]) -> None:
+    """Дописывает записи в конец журнала одним вызовом write"""
+    data = "".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries)
+    with open(journal_path(file_path), "a", encoding="utf-8") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def remove_journal(file_path: Path) -> None:
+    """Удаляет журнал (после слияния или перезаписи файла слоя)"""
+    try:
+        journal_path(file_path).unlink()
+    except FileNotFoundError:
+        pass
+
+
+def _checked_feature(feature: Dict[str, Any], quality: Optional[GeometryQualityStats]) -> Dict[str, Any]:
+    """Проверяет и исправляет геометрию нового объекта; непригодная геометрия - ValueError"""
+    geometry, issues = validate_geometry(feature.get("geometry"))
+    if geometry is None:
+        raise ValueError(f"Непригодная геометрия объекта {get_feature_id(feature)}: {', '.join(issues)}")
+    if quality is not None:
+        quality.record("repaired" if issues else "valid", issues)
+    return dict(feature, type="Feature", geometry=geometry)
+
+
+def build_entries(features: List[Dict[str, Any]], version: int, add: List[Dict[str, Any]],
+                  replace: List[Dict[str, Any]], delete: List[Any],
+                  quality: Optional[GeometryQualityStats] = None) -> List[Dict[str, Any]]:
+    """
+    Проверяет изменения относительно текущих объектов слоя и превращает их в записи журнала.
+    Геометрии новых объектов проверяются и исправляются, статистика пишется в quality.
+    Ошибки возвращаются исключением ValueError (неверный запрос) или KeyError (нет объекта)
+    """
+    existing = {feature_key(get_feature_id(f)) for f in features if isinstance(f, dict)}
+    existing.discard(None)
+    entries = []
+    for feature in add:
+        feature = _checked_feature(feature, quality)
+        feature_id = get_feature_id(feature)
+        if feature_id is None:
+            feature_id = feature["id"] = uuid.uuid4().hex
+        if feature_key(feature_id) in existing:
+            raise ValueError(f"Объект с id {feature_id} уже есть в слое")
+        existing.add(feature_key(feature_id))
+        entries.append({"version": version, "op": "upsert", "id": feature_id, "feature": feature})
+    for feature in replace:
+        feature = _checked_feature(feature, quality)
+        feature_id = get_feature_id(feature)
+        if feature_id is None:
+            raise ValueError("Для замены объекта нужен id")
+        if feature_key(feature_id) not in existing:
+            raise KeyError(feature_id)
+        entries.append({"version": version, "op": "upsert", "id": feature_id, "feature": feature})
+    for feature_id in delete:
+        if feature_key(feature_id) not in existing:
+            raise KeyError(feature_id)
+        existing.discard(feature_key(feature_id))
+        entries.append({"version": version, "op": "delete", "id": feature_id})
+    return entries
+
+
+def apply_entries(features: List[Dict[str, Any]], entries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Применяет записи журнала к списку объектов и возвращает новый список.
+    Исходный список не изменяется: его может в этот момент отдавать другой запрос
+    """
+    result = list(features)
+    positions = {}
+    for i, feature in enumerate(result):
+        if isinstance(feature, dict):
+            key = feature_key(get_feature_id(feature))
+            if key is not None:
+                positions[key] = i
+    deleted = False
+    for entry in entries:
+        key = feature_key(entry["id"])
+        position = positions.get(key)
+        if entry["op"] == "delete":
+            if position is not None:
+                result[position] = None
+                del positions[key]
+                deleted = True
+        elif position is not None:
+            result[position] = entry["feature"]
+        else:
+            positions[key] = len(result)
+            result.append(entry["feature"])
+    if deleted:
+        result = [f for f in result if f is not None]
+    return result
+
+
+def diff_since(entries: List[Dict[str, Any]], since: int) -> Dict[str, Any]:
+    """
+    Сворачивает записи журнала новее версии since: последняя версия каждого
+    измененного объекта и идентификаторы удаленных объектов
+    """
+    # Ключ объекта -> (id из последней записи, объект или None для удаленного)
+    changed: Dict[str, Tuple[Any, Optional[Dict[str, Any]]]] = {}
+    for entry in entries:
+        if entry["version"] <= since:
+            continue
+        key = feature_key(entry["id"])
+        # Перемещаем объект в конец, чтобы порядок соответствовал последнему изменению
+        changed.pop(key, None)
+        changed[key] = (entry["id"], entry.get("feature") if entry["op"] == "upsert" else None)
+    return {
+        "upserted": {"type": "FeatureCollection", "features": [f for _, f in changed.values() if f is not None]},
+        "deleted": [feature_id for feature_id, f in changed.values() if f is None],
+    }
+
+
+def write_layer(file_path: Path, data: Dict[str, Any]) -> None:
+    """Атомарно перезаписывает файл слоя (через временный файл и rename)"""
+    tmp_path = file_path.with_name(file_path.name + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, file_path)
@@ -0,0 +1,124 @@
+import os
+import json
+import logging
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from app.api.services.geometry_executor import count_vertices
+from app.api.services.spatial_index import geometry_bbox
+
+logger = logging.getLogger(__name__)
+
+# Имена типов JSON для схемы свойств
+_JSON_TYPES = (
+    (bool, "boolean"),
+    (int, "integer"),
+    (float, "number"),
+    (str, "string"),
+    (list, "array"),
+    (dict, "object"),
+)
+
+
+def _json_type(value: Any) -> str:
+    if value is None:
+        return "null"
+    for python_type, name in _JSON_TYPES:
+        if isinstance(value, python_type):
+            return name
+    return type(value).__name__
+
+
+def compute_layer_summary(collection: Dict[str, Any], byte_size: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Сводка по слою без передачи данных клиенту: экстент, число объектов,
+    типы геометрий, число вершин, схема свойств (типы значений и число
+    объектов, в которых свойство задано) и размер данных в байтах
+    """
+    features: List[Any] = collection.get("features") or []
+    geometry_types: Counter = Counter()
+    properties: Dict[str, Dict[str, Any]] = {}
+    vertex_count = 0
+    min_x = min_y = float("inf")
+    max_x = max_y = float("-inf")
+
+    for feature in features:
+        if not isinstance(feature, dict):
+            continue
+        geometry = feature.get("geometry")
+        geometry_types[geometry.get("type") if isinstance(geometry, dict) else None] += 1
+        if isinstance(geometry, dict):
+            if geometry.get("type") == "GeometryCollection":
+                vertex_count += sum(count_vertices(g) for g in geometry.get("geometries") or [])
+            else:
+                vertex_count += count_vertices(geometry)
+            bbox = geometry_bbox(geometry)
+            if bbox is not None:
+                min_x, min_y = min(min_x, bbox[0]), min(min_y, bbox[1])
+                max_x, max_y = max(max_x, bbox[2]), max(max_y, bbox[3])
+        for key, value in (feature.get("properties") or {}).items():
+            entry = properties.setdefault(key, {"types": set(), "count": 0})
+            entry["types"].add(_json_type(value))
+            entry["count"] += 1
+
+    return {
+        "feature_count": len(features),
+        "bbox": [min_x, min_y, max_x, max_y] if min_x != float("inf") else None,
+        "geometry_types": {str(name): count for name, count in geometry_types.items()},
+        "vertex_count": vertex_count,
+        "properties": {
+            key: {"types": sorted(entry["types"]), "count": entry["count"]}
+            for key, entry in properties.items()
+        },
+        "byte_size": byte_size,
+        "version": collection.get("version", 0),
+    }
+
+
+def summary_path(file_path: Path) -> Path:
+    """Сводка хранится рядом с файлом слоя: layer.geojson.summary.json"""
+    return file_path.with_name(file_path.name + ".summary.json")
+
+
+def _read_summary_data(file_path: Path, cache_key: str) -> Optional[Dict[str, Any]]:
+    """Содержимое файла сводки, если он записан для этой же версии файла слоя"""
+    try:
+        with open(summary_path(file_path), "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+    if not isinstance(data, dict) or data.get("key") != cache_key:
+        return None
+    return data
+
+
+def read_summary_file(file_path: Path, cache_key: str) -> Optional[Dict[str, Any]]:
+    """
+    Читает сохраненную сводку, если она посчитана для этой же версии файла
+    (ключ кэша включает время изменения и размер файла и журнала)
+    """
+    data = _read_summary_data(file_path, cache_key)
+    return data.get("summary") if data else None
+
+
+def read_summary_quality(file_path: Path, cache_key: str) -> Optional[Dict[str, Any]]:
+    """Статистика качества геометрий, сохраненная вместе со сводкой этой версии файла"""
+    data = _read_summary_data(file_path, cache_key)
+    return data.get("quality") if data else None
+
+
+def write_summary_file(file_path: Path, cache_key: str, summary: Dict[str, Any],
+                       quality: Optional[Dict[str, Any]] = None) -> None:
+    """
+    Сохраняет сводку (и статистику качества геометрий), чтобы после перезапуска
+    список слоев и сводка не требовали разбора файла
+    """
+    path = summary_path(file_path)
+    tmp_path = path.with_name(path.name + ".tmp")
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"key": cache_key, "summary": summary, "quality": quality}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"Не удалось сохранить сводку слоя {file_path}: {str(e)}")
@@ -1,7 +1,96 @@
-from typing import List, Dict, Any, Optional
+import os
+import json
+import struct
+import hashlib
+import threading
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple
+from pathlib import Path
+from fastapi import HTTPException
 from sqlalchemy.orm import Session
-from app.api.models.map_models import MapLayer, MapView, SearchableObject
+from app.api.models.map_models import MapLayer, MapView, SearchableObject, LayerFeature
 from app.api.schemas.map_schemas import MapLayerCreate, MapLayerUpdate, MapViewCreate, MapViewUpdate
+from app.api.services.cache_backend import InMemoryCacheBackend, get_cache_backend
+from app.api.services.metrics import LAYER_LOAD_BYTES, LAYER_PARSE_DURATION, LAYER_CACHE_REQUESTS
+from app.api.services.geojson_encoding import to_topojson, prepare_collection
+from app.api.services.spatial_index import PolygonLayerIndex, representative_point, geometry_bbox
+from app.api.services.tiles import Tile, tile_bbox
+from app.api.services.geometry_validation import GeometryQualityStats, validate_features
+from app.api.services.suggest_index import suggest_index, index_layer_features
+from app.api.services.layer_summary import (
+    compute_layer_summary, read_summary_file, read_summary_quality, write_summary_file
+)
+from app.api.services.clustering import CLUSTER_INDEX_TTL, cluster_index_id, cluster_collection
+from app.api.services.label_points import compute_label_points, read_labels_file, write_labels_file
+from app.api.services.flatgeobuf import FlatGeobufReader, write_flatgeobuf
+from app.api.services.geoparquet import GeoParquetReader, write_geoparquet
+from app.api.services.layer_journal import (
+    LAYER_JOURNAL_MAX_ENTRIES, journal_path, journal_lock, read_journal, append_journal,
+    remove_journal, build_entries, apply_entries, diff_since, write_layer, get_feature_id, feature_key
+)
+
+# Кэш разобранных статических слоев. Ключ включает время изменения и размер файла,
+# поэтому после перезаписи файла все воркеры перестают использовать старую версию.
+# Всегда в памяти процесса: из SQLite или Redis слой пришлось бы заново разбирать
+# из JSON при каждом обращении, а каждая версия файла оставалась бы в общем кэше
+layer_cache = get_cache_backend("layers", backend="memory")
+
+# Подготовленные пространственные индексы слоев. Индекс ссылается на объекты
+# закэшированного слоя и не сериализуется, поэтому всегда хранится в памяти процесса
+spatial_index_cache = get_cache_backend("spatial_index", backend="memory")
+
+# Закодированные в JSON ответы со статическими слоями (байты для выдачи по диапазонам).
+# Байты не сериализуются в SQLite и Redis, поэтому кэш всегда в памяти процесса.
+# Каждый ответ - полная копия слоя, поэтому кэш ограничен суммарным размером тел
+ENCODED_LAYER_CACHE_MAX_BYTES = int(os.getenv("ENCODED_LAYER_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+encoded_layer_cache = InMemoryCacheBackend(max_bytes=ENCODED_LAYER_CACHE_MAX_BYTES,
+                                           sizeof=lambda encoded: len(encoded[0]))
+
+# Метаданные копий статических слоев в других форматах (см. STATIC_EXPORT_FORMATS),
+# чтобы не читать заголовок файла копии при каждом запросе
+layer_export_cache = get_cache_backend("layer_exports", backend="memory")
+
+# Копии статических слоев в других форматах рядом с файлом GeoJSON (layer.geojson.fgb,
+# layer.geojson.parquet): расширение и тип содержимого. Копия действительна для версии
+# слоя, ключ кэша которой записан в ее метаданных. Копия FlatGeobuf используется
+# для чтения по bbox без загрузки слоя целиком
+STATIC_EXPORT_FORMATS = {
+    "fgb": (".fgb", "application/flatgeobuf"),
+    "geoparquet": (".parquet", "application/vnd.apache.parquet"),
+}
+# Копии создаются по одной, чтобы параллельные запросы не писали один файл несколько раз
+_export_lock = threading.Lock()
+
+# Точки подписей считаются в фоне после загрузки слоя, чтобы не задерживать ответ
+# с полными данными. По одной задаче на версию слоя
+_labels_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="layer-labels")
+_label_jobs: Dict[str, Future] = {}
+_label_jobs_lock = threading.Lock()
+
+# Индексация названий слоев каталога для подсказок: не больше одной задачи за раз.
+# Версии файлов, которые не удалось загрузить, запоминаются и не загружаются повторно
+_index_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="layer-index")
+_index_job: Optional[Future] = None
+_index_job_lock = threading.Lock()
+_index_failures: Dict[str, str] = {}
+
+# Число объектов в одной части слоя для загрузки по частям
+LAYER_PART_FEATURES = int(os.getenv("LAYER_PART_FEATURES", "2000"))
+
+# Каталог статических слоев, которые показываются в списке доступных слоев.
+# default_fields - свойства объектов, которые отдаются по умолчанию
+# (остальные можно запросить через fields=..., все - через fields=*)
+STATIC_LAYER_CATALOG = {
+    "static_layer_category_39892": {
+        "filename": "layer_category_39892.geojson",
+        "name": "Муниципальные образования РФ",
+        "description": "Муниципальные образования Российской Федерации",
+        "default_fields": ["name"],
+    },
+}
+
+STATIC_LAYER_STYLE = {"fillColor": "#0080ff", "fillOpacity": 0.5, "outlineColor": "#000"}
 
 def get_map_layers(db: Session) -> List[MapLayer]:
     """Получает все слои карты из базы данных"""
@@ -50,6 +139,80 @@ def delete_map_layer(db: Session, layer_id: int) -> bool:
     db.commit()
     return True
 
+def create_db_layer(db: Session, name: str, description: Optional[str], style: Dict[str, Any],
+                    features: List[Dict[str, Any]]) -> MapLayer:
+    """
+    Создает слой, объекты которого хранятся в БД (source_type="db_geojson"):
+    по строке на объект с экстентом геометрии для выборки по прямоугольнику
+    """
+    db_layer = MapLayer(
+        name=name,
+        description=description,
+        source_type="db_geojson",
+        source_url="",
+        style=style
+    )
+    db.add(db_layer)
+    db.flush()
+    db_layer.source_url = f"/api/maps/layer-data/{db_layer.id}"
+    
+    # Объекты с непригодной геометрией не сохраняются
+    features, quality = validate_features(features, "db_layer")
+    if quality.rejected:
+        print(f"Слой {name}: отброшено объектов с непригодной геометрией: {quality.rejected}")
+    
+    rows = []
+    for feature in features:
+        if not isinstance(feature, dict):
+            continue
+        geometry = feature.get("geometry")
+        bbox = geometry_bbox(geometry)
+        feature_id = feature.get("id")
+        rows.append({
+            "layer_id": db_layer.id,
+            "feature_id": str(feature_id) if feature_id is not None else None,
+            "geometry": geometry,
+            "properties": feature.get("properties") or {},
+            "min_x": bbox[0] if bbox else None,
+            "min_y": bbox[1] if bbox else None,
+            "max_x": bbox[2] if bbox else None,
+            "max_y": bbox[3] if bbox else None,
+        })
+    if rows:
+        db.bulk_insert_mappings(LayerFeature, rows)
+    
+    db.commit()
+    db.refresh(db_layer)
+    return db_layer
+
+def get_db_layer_features(db: Session, layer_id: int, bbox: Optional[List[float]] = None) -> Dict[str, Any]:
+    """
+    Возвращает объекты слоя из БД в виде FeatureCollection.
+    bbox=[min_x, min_y, max_x, max_y] - только объекты, экстент которых пересекается с прямоугольником
+    """
+    query = db.query(LayerFeature).filter(LayerFeature.layer_id == layer_id)
+    if bbox is not None:
+        query = query.filter(
+            LayerFeature.min_x <= bbox[2],
+            LayerFeature.max_x >= bbox[0],
+            LayerFeature.min_y <= bbox[3],
+            LayerFeature.max_y >= bbox[1],
+        )
+    
+    features = []
+    for row in query.order_by(LayerFeature.id):
+        feature = {"type": "Feature", "geometry": row.geometry, "properties": row.properties or {}}
+        feature["id"] = row.feature_id if row.feature_id is not None else row.id
+        features.append(feature)
+    return {"type": "FeatureCollection", "features": features}
+
+def get_db_layer_summary(db: Session, layer_id: int) -> Optional[Dict[str, Any]]:
+    """Сводка по слою из БД; None, если слой не найден или не хранит объекты в БД"""
+    db_layer = get_map_layer(db, layer_id)
+    if db_layer is None or db_layer.source_type != "db_geojson":
+        return None
+    return compute_layer_summary(get_db_layer_features(db, layer_id))
+
 def get_map_views(db: Session) -> List[MapView]:
     """Получает все представления карты из базы данных"""
     return db.query(MapView).all()
@@ -137,33 +300,801 @@ def get_all_available_layers(db: Session) -> List[MapLayer]:
         print("Не найдена директория со статичными слоями.")
     
     if static_dir and static_dir.exists():
-        # Ищем только файл layer_category_39892.geojson
-        target_filename = "layer_category_39892.geojson"
-        target_path = static_dir / target_filename
-        
-        if target_path.exists():
-            layer_id = "static_layer_category_39892"
-            # Переименовываем слой
-            layer_name = "Муниципальные образования РФ"
+        # Ищем только файлы слоев из каталога
+        for layer_id, entry in STATIC_LAYER_CATALOG.items():
+            target_filename = entry["filename"]
+            target_path = static_dir / target_filename
+            if not target_path.exists():
+                continue
             
             # Создаем слой без сохранения в БД
             static_layer = MapLayer(
                 id=layer_id,
-                name=layer_name,
-                description="Муниципальные образования Российской Федерации",
+                name=entry["name"],
+                description=entry["description"],
                 source_type="static",
                 source_url=f"/static/layers/{target_filename}",
-                style={"fillColor": "#0080ff", "fillOpacity": 0.5, "outlineColor": "#000"}
+                style=dict(STATIC_LAYER_STYLE)
             )
+            static_layer.default_fields = entry.get("default_fields")
+            # Сводка отдается, только если уже посчитана: список слоев не должен разбирать файлы
+            static_layer.summary = get_static_layer_summary(layer_id, compute=False)
             static_layers.append(static_layer)
             print(f"Добавлен статический слой: {layer_id} из файла {target_path}")
     
     return static_layers
 
-def get_layer_by_id(db: Session, layer_id: str) -> Optional[Dict[str, Any]]:
+def get_layer_default_fields(layer_id: str) -> Optional[List[str]]:
+    """Свойства объектов слоя, отдаваемые по умолчанию (None - все свойства)"""
+    entry = STATIC_LAYER_CATALOG.get(layer_id)
+    return entry.get("default_fields") if entry else None
+
+def find_static_layer_path(layer_id: str) -> Optional[Path]:
+    """Находит файл статического слоя по его ID (с префиксом static_)"""
+    filename = f"{layer_id[7:]}.geojson"  # Убираем префикс "static_"
+    
+    # Проверяем путь в контейнере и вне его
+    paths_to_check = [
+        Path(f"/app/fastapi_backend/static/layers/{filename}"),
+        Path(f"/app/static/layers/{filename}"),
+        Path(f"static/layers/{filename}"),
+        Path(f"fastapi_backend/static/layers/{filename}")
+    ]
+    
+    for file_path in paths_to_check:
+        if file_path.exists():
+            return file_path
+    return None
+
+def static_layer_cache_key(file_path: Path) -> Optional[str]:
+    """Ключ кэша для файла слоя: путь, время изменения и размер файла и его журнала изменений"""
+    try:
+        stat = file_path.stat()
+    except OSError as e:
+        print(f"Ошибка чтения файла {file_path}: {str(e)}")
+        return None
+    key = f"{file_path.resolve()}:{stat.st_mtime_ns}:{stat.st_size}"
+    try:
+        journal_stat = journal_path(file_path).stat()
+    except OSError:
+        return key
+    return f"{key}:{journal_stat.st_mtime_ns}:{journal_stat.st_size}"
+
+def load_static_layer(layer_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Загружает GeoJSON статического слоя с использованием кэша слоев.
+    Возвращает None, если файл не найден или не читается
+    """
+    import json
+    
+    file_path = find_static_layer_path(layer_id)
+    if file_path is None:
+        return None
+    
+    cache_key = static_layer_cache_key(file_path)
+    if cache_key is None:
+        return None
+    cached = layer_cache.get(cache_key)
+    if cached is not None:
+        LAYER_CACHE_REQUESTS.labels(result="hit").inc()
+        return cached
+    LAYER_CACHE_REQUESTS.labels(result="miss").inc()
+    
+    try:
+        with LAYER_PARSE_DURATION.labels(layer=layer_id).time():
+            with open(file_path, 'r', encoding='utf-8') as f:
+                geojson_data = json.load(f)
+    except (json.JSONDecodeError, IOError) as e:
+        print(f"Ошибка чтения файла {file_path}: {str(e)}")
+        return None
+    LAYER_LOAD_BYTES.labels(layer=layer_id).inc(file_path.stat().st_size)
+    
+    # Проверяем и исправляем геометрии один раз при загрузке версии файла
+    geojson_data["features"], quality = validate_features(geojson_data.get("features", []), "static_layer")
+    if quality.repaired or quality.rejected:
+        print(f"Геометрии слоя {layer_id}: исправлено {quality.repaired}, отброшено {quality.rejected}")
+    
+    # Применяем изменения из журнала, накопленные после последнего слияния
+    geojson_data.setdefault("version", 0)
+    entries = read_journal(file_path)
+    if entries:
+        geojson_data["features"] = apply_entries(geojson_data.get("features", []), entries)
+        geojson_data["version"] = max(geojson_data["version"], entries[-1]["version"])
+    
+    print(f"Успешно загружен файл: {file_path}")
+    layer_cache.set(cache_key, geojson_data)
+    layer_cache.set(f"{cache_key}:quality", quality.as_dict())
+    store_static_layer_summary(file_path, cache_key, geojson_data)
+    schedule_static_layer_labels(layer_id, file_path, cache_key, geojson_data)
+    index_static_layer_names(layer_id, geojson_data)
+    return geojson_data
+
+def index_static_layer_names(layer_id: str, geojson_data: Dict[str, Any]) -> None:
+    """Обновляет подсказки поиска названиями объектов слоя из каталога"""
+    if layer_id in STATIC_LAYER_CATALOG:
+        index_layer_features(layer_id, geojson_data.get("features", []))
+
+def ensure_static_layers_indexed() -> None:
+    """
+    Загружает слои каталога, названия объектов которых еще не попали в подсказки.
+    Версия файла, которую не удалось загрузить, пропускается до изменения файла
+    """
+    for layer_id in STATIC_LAYER_CATALOG:
+        if suggest_index.has_source(layer_id):
+            continue
+        file_path = find_static_layer_path(layer_id)
+        cache_key = static_layer_cache_key(file_path) if file_path is not None else None
+        if cache_key is None or _index_failures.get(layer_id) == cache_key:
+            continue
+        geojson_data = load_static_layer(layer_id)
+        if geojson_data is None:
+            _index_failures[layer_id] = cache_key
+            continue
+        # Слой мог быть загружен из общего кэша (SQLite, Redis) без индексации
+        if not suggest_index.has_source(layer_id):
+            index_static_layer_names(layer_id, geojson_data)
+
+def schedule_static_layers_indexing() -> Future:
+    """Запускает ensure_static_layers_indexed в фоне, если индексация еще не идет"""
+    global _index_job
+    with _index_job_lock:
+        if _index_job is None or _index_job.done():
+            _index_job = _index_executor.submit(ensure_static_layers_indexed)
+        return _index_job
+
+def static_layer_byte_size(file_path: Path) -> int:
+    """Размер данных слоя на диске: файл и журнал изменений"""
+    size = file_path.stat().st_size
+    try:
+        size += journal_path(file_path).stat().st_size
+    except OSError:
+        pass
+    return size
+
+def store_static_layer_summary(file_path: Path, cache_key: str, geojson_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Считает сводку по загруженной версии слоя и сохраняет ее в кэш и рядом с файлом
+    вместе со статистикой качества геометрий этой версии
+    """
+    summary = compute_layer_summary(geojson_data, byte_size=static_layer_byte_size(file_path))
+    layer_cache.set(f"{cache_key}:summary", summary)
+    write_summary_file(file_path, cache_key, summary, layer_cache.get(f"{cache_key}:quality"))
+    return summary
+
+def get_static_layer_summary(layer_id: str, compute: bool = True) -> Optional[Dict[str, Any]]:
+    """
+    Сводка по статическому слою: экстент, число объектов, типы геометрий, число
+    вершин, схема свойств и размер. Считается один раз для версии файла при загрузке.
+    При compute=False слой не загружается: возвращается None, если сводки еще нет
+    """
+    file_path = find_static_layer_path(layer_id)
+    if file_path is None:
+        return None
+    cache_key = static_layer_cache_key(file_path)
+    if cache_key is None:
+        return None
+    summary = layer_cache.get(f"{cache_key}:summary")
+    if summary is not None:
+        return summary
+    summary = read_summary_file(file_path, cache_key)
+    if summary is not None:
+        layer_cache.set(f"{cache_key}:summary", summary)
+        return summary
+    if not compute:
+        return None
+    
+    geojson_data = load_static_layer(layer_id)
+    if geojson_data is None:
+        return None
+    # После изменения слоя через PATCH сводка считается по обновленной копии из кэша
+    return layer_cache.get(f"{cache_key}:summary") or store_static_layer_summary(file_path, cache_key, geojson_data)
+
+def store_static_layer_labels(layer_id: str, file_path: Path, cache_key: str, geojson_data: Dict[str, Any],
+                              reuse: Optional[Dict[Any, Dict[str, Any]]] = None) -> Dict[str, Any]:
+    """
+    Точки подписей версии слоя: из файла рядом со слоем, если они уже посчитаны
+    для этой версии, иначе считаются (со свойствами по умолчанию из каталога)
+    и сохраняются в кэш и рядом с файлом
+    """
+    labels = read_labels_file(file_path, cache_key)
+    if labels is None:
+        labels = compute_label_points(geojson_data, get_layer_default_fields(layer_id), reuse=reuse)
+        write_labels_file(file_path, cache_key, labels)
+        print(f"Посчитаны точки подписей слоя {layer_id}: {labels['feature_count']}")
+    layer_cache.set(f"{cache_key}:labels", labels)
+    return labels
+
+def schedule_static_layer_labels(layer_id: str, file_path: Path, cache_key: str, geojson_data: Dict[str, Any],
+                                 reuse: Optional[Dict[Any, Dict[str, Any]]] = None) -> Future:
+    """Запускает расчет точек подписей версии слоя в фоне (если он еще не запущен)"""
+    with _label_jobs_lock:
+        job = _label_jobs.get(cache_key)
+        if job is None:
+            job = _labels_executor.submit(store_static_layer_labels, layer_id, file_path, cache_key, geojson_data, reuse)
+            _label_jobs[cache_key] = job
+            job.add_done_callback(lambda _: _label_jobs.pop(cache_key, None))
+    return job
+
+def get_static_layer_points(layer_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Облегченное представление статического слоя: точка подписи и свойства по умолчанию
+    для каждого объекта. Если точки уже посчитаны для версии слоя, слой не загружается
+    """
+    file_path = find_static_layer_path(layer_id)
+    if file_path is None:
+        return None
+    cache_key = static_layer_cache_key(file_path)
+    if cache_key is None:
+        return None
+    labels = layer_cache.get(f"{cache_key}:labels")
+    if labels is not None:
+        return labels
+    labels = read_labels_file(file_path, cache_key)
+    if labels is not None:
+        layer_cache.set(f"{cache_key}:labels", labels)
+        return labels
+    
+    geojson_data = load_static_layer(layer_id)
+    if geojson_data is None:
+        return None
+    # Слой из общего кэша (SQLite, Redis) загружается без расчета точек
+    return schedule_static_layer_labels(layer_id, file_path, cache_key, geojson_data).result()
+
+def get_layer_points(db: Session, layer_id: str, bbox: Optional[List[float]] = None) -> Optional[Dict[str, Any]]:
+    """
+    Точки подписей объектов слоя. Для статических слоев посчитаны заранее,
+    для слоев из БД и НСПД считаются по данным ответа (в пределах bbox)
+    """
+    if layer_id.startswith("static_"):
+        labels = get_static_layer_points(layer_id)
+        if labels is None or bbox is None:
+            return labels
+        features = [f for f in labels["features"]
+                    if bbox[0] <= f["geometry"]["coordinates"][0] <= bbox[2]
+                    and bbox[1] <= f["geometry"]["coordinates"][1] <= bbox[3]]
+        return dict(labels, features=features, feature_count=len(features))
+    layer_data = get_layer_by_id(db, layer_id, bbox)
+    if layer_data is None or not isinstance(layer_data.get("features"), list):
+        return layer_data
+    labels = compute_label_points(layer_data, None)
+    for key, value in layer_data.items():
+        labels.setdefault(key, value)
+    return labels
+
+def get_static_layer_quality(layer_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Статистика качества геометрий статического слоя, собранная при загрузке и изменениях.
+    Берется из кэша или файла сводки; слой загружается, только если их нет для текущей версии
+    """
+    file_path = find_static_layer_path(layer_id)
+    if file_path is None:
+        return None
+    cache_key = static_layer_cache_key(file_path)
+    if cache_key is None:
+        return None
+    quality = layer_cache.get(f"{cache_key}:quality")
+    if quality is not None:
+        return quality
+    quality = read_summary_quality(file_path, cache_key)
+    if quality is not None:
+        layer_cache.set(f"{cache_key}:quality", quality)
+        return quality
+    if load_static_layer(layer_id) is None:
+        return None
+    return layer_cache.get(f"{cache_key}:quality")
+
+def patch_static_layer(layer_id: str, add: List[Dict[str, Any]], replace: List[Dict[str, Any]],
+                       delete: List[Any]) -> Optional[Dict[str, Any]]:
+    """
+    Добавляет, заменяет и удаляет объекты статического слоя по id без перезагрузки файла.
+    Изменения дописываются в журнал рядом с файлом и получают новую версию слоя,
+    закэшированная копия слоя обновляется в памяти. Когда журнал становится длиннее
+    LAYER_JOURNAL_MAX_ENTRIES записей, он сливается с файлом слоя.
+    
+    Возвращает None, если слой не найден
+    """
+    file_path = find_static_layer_path(layer_id)
+    if file_path is None:
+        return None
+    
+    with journal_lock(file_path):
+        old_key = static_layer_cache_key(file_path)
+        geojson_data = load_static_layer(layer_id)
+        if geojson_data is None:
+            return None
+        features = geojson_data.get("features", [])
+        current_version = geojson_data.get("version", 0)
+        version = current_version + 1
+        quality = GeometryQualityStats.from_dict(layer_cache.get(f"{old_key}:quality") or {})
+        try:
+            entries = build_entries(features, version, add, replace, delete, quality)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except KeyError as e:
+            raise HTTPException(status_code=404, detail=f"Объект с id {e.args[0]} не найден в слое {layer_id}")
+        if not entries:
+            return {"layer_id": layer_id, "version": current_version, "added": 0, "replaced": 0, "deleted": 0}
+        
+        append_journal(file_path, entries)
+        updated = dict(geojson_data, features=apply_entries(features, entries), version=version)
+        layer_cache.delete(old_key)
+        if len(read_journal(file_path)) > LAYER_JOURNAL_MAX_ENTRIES:
+            write_layer(file_path, updated)
+            remove_journal(file_path)
+            print(f"Журнал изменений слоя {layer_id} слит с файлом, версия {version}")
+        new_key = static_layer_cache_key(file_path)
+        if new_key is not None:
+            layer_cache.set(new_key, updated)
+            layer_cache.set(f"{new_key}:quality", quality.as_dict())
+            # Точки подписей неизмененных объектов берутся из прежней версии
+            old_labels = layer_cache.get(f"{old_key}:labels")
+            changed = {feature_key(get_feature_id(f)) for f in add + replace if isinstance(f, dict)}
+            changed |= {feature_key(feature_id) for feature_id in delete}
+            reuse = {f["id"]: f for f in old_labels["features"]
+                     if f.get("id") is not None and feature_key(f["id"]) not in changed} if old_labels else None
+            schedule_static_layer_labels(layer_id, file_path, new_key, updated, reuse)
+        index_static_layer_names(layer_id, updated)
+    
+    return {"layer_id": layer_id, "version": version, "added": len(add), "replaced": len(replace), "deleted": len(delete)}
+
+def stored_static_layer_version(file_path: Path) -> int:
+    """
+    Версия слоя, сохраненного в файле: по журналу, закэшированной копии или сводке,
+    и только если их нет - по самому файлу
+    """
+    entries = read_journal(file_path)
+    if entries:
+        return entries[-1]["version"]
+    cache_key = static_layer_cache_key(file_path)
+    if cache_key is not None:
+        known = layer_cache.get(cache_key) or layer_cache.get(f"{cache_key}:summary") \
+            or read_summary_file(file_path, cache_key)
+        if known is not None:
+            return known.get("version", 0)
+    try:
+        with open(file_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return 0
+    return data.get("version", 0) if isinstance(data, dict) else 0
+
+def save_static_layer_file(file_path: Path, geojson_data: Dict[str, Any], content: bytes) -> int:
+    """
+    Сохраняет загруженный слой в файл и удаляет журнал прежней версии файла.
+    Если слой уже был, его версия продолжается (на единицу больше прежней), чтобы
+    клиенты с since=<прежняя версия> получили full=True, а не пустой список изменений.
+    Возвращает версию сохраненного слоя
+    """
+    with journal_lock(file_path):
+        version = stored_static_layer_version(file_path) + 1 if file_path.exists() else 0
+        if version:
+            write_layer(file_path, dict(geojson_data, version=version))
+        else:
+            with open(file_path, "wb") as f:
+                f.write(content)
+        remove_journal(file_path)
+    return version
+
+def get_static_layer_changes(layer_id: str, since: int) -> Optional[Dict[str, Any]]:
+    """
+    Изменения статического слоя после версии since: новые и измененные объекты
+    и id удаленных. Если журнал с тех пор был слит с файлом или since новее версии
+    слоя, возвращает full=True - клиенту нужно загрузить слой целиком
+    """
+    file_path = find_static_layer_path(layer_id)
+    if file_path is None:
+        return None
+    geojson_data = load_static_layer(layer_id)
+    if geojson_data is None:
+        return None
+    version = geojson_data.get("version", 0)
+    entries = read_journal(file_path)
+    base_version = entries[0]["version"] - 1 if entries else version
+    
+    # since новее текущей версии - клиент видел другой файл слоя (например, до повторной загрузки)
+    full = since < base_version or since > version
+    result = {"layer_id": layer_id, "version": version, "since": since, "full": full}
+    if result["full"]:
+        return result
+    result.update(diff_since(entries, since))
+    return result
+
+def get_static_layer_topojson(layer_id: str, quantization: int) -> Optional[Dict[str, Any]]:
+    """
+    Возвращает статический слой в квантованном TopoJSON (общие границы хранятся один раз).
+    Кодирование выполняется один раз для версии файла и кэшируется
+    """
+    file_path = find_static_layer_path(layer_id)
+    if file_path is None:
+        return None
+    base_key = static_layer_cache_key(file_path)
+    if base_key is None:
+        return None
+    
+    cache_key = f"{base_key}:topojson:{quantization}"
+    cached = layer_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    
+    geojson_data = load_static_layer(layer_id)
+    if geojson_data is None:
+        return None
+    topology = to_topojson(geojson_data, object_name=layer_id, quantization=quantization)
+    layer_cache.set(cache_key, topology)
+    return topology
+
+def get_layer_spatial_index(layer_id: str) -> Optional[PolygonLayerIndex]:
+    """
+    Возвращает R-дерево по полигонам статического слоя.
+    Индекс строится один раз для версии файла и переиспользуется всеми запросами
+    """
+    file_path = find_static_layer_path(layer_id)
+    if file_path is None:
+        return None
+    cache_key = static_layer_cache_key(file_path)
+    if cache_key is None:
+        return None
+    
+    index = spatial_index_cache.get(cache_key)
+    if index is not None:
+        return index
+    
+    geojson_data = load_static_layer(layer_id)
+    if geojson_data is None:
+        return None
+    index = PolygonLayerIndex(geojson_data.get("features", []))
+    print(f"Построен пространственный индекс слоя {layer_id}: {len(index)} полигонов")
+    spatial_index_cache.set(cache_key, index)
+    return index
+
+def get_static_layer_tile(layer_id: str, z: int, x: int, y: int) -> Optional[Dict[str, Any]]:
+    """
+    Объекты статического слоя, пересекающиеся с тайлом z/x/y (геометрии не обрезаются).
+    Выборка выполняется по R-дереву слоя и кэшируется для версии файла
+    """
+    file_path = find_static_layer_path(layer_id)
+    if file_path is None:
+        return None
+    base_key = static_layer_cache_key(file_path)
+    if base_key is None:
+        return None
+    
+    cache_key = f"{base_key}:tile:{z}/{x}/{y}"
+    cached = layer_cache.get(cache_key)
+    if cached is not None:
+        LAYER_CACHE_REQUESTS.labels(result="tile_hit").inc()
+        return cached
+    LAYER_CACHE_REQUESTS.labels(result="tile_miss").inc()
+    
+    index = get_layer_spatial_index(layer_id)
+    if index is None:
+        return None
+    geojson_data = load_static_layer(layer_id) or {}
+    features = [index.features[i] for i in sorted(index.query_bbox(tile_bbox(z, x, y)))]
+    tile = {"type": "FeatureCollection", "features": features, "version": geojson_data.get("version", 0)}
+    layer_cache.set(cache_key, tile)
+    return tile
+
+def prefetch_static_layer(layer_id: str, tiles: List[Tile]) -> None:
+    """Прогревает кэш тайлов статического слоя (выполняется в фоне после ответа клиенту)"""
+    for z, x, y in tiles:
+        get_static_layer_tile(layer_id, z, x, y)
+
+def static_layer_etag(*key_parts: Any) -> str:
+    """
+    Строгий ETag ответа со статическим слоем. Строится из ключа кэша версии файла
+    и параметров ответа, поэтому одинаков во всех воркерах
+    """
+    digest = hashlib.sha1(":".join(str(part) for part in key_parts).encode("utf-8")).hexdigest()
+    return f'"{digest}"'
+
+def fields_cache_key(fields: Optional[List[str]]) -> str:
+    """Набор свойств ответа в ключе кэша и ETag (* - все свойства)"""
+    return ",".join(fields) if fields is not None else "*"
+
+def get_static_layer_response_etag(layer_id: str, *params: Any) -> Optional[str]:
+    """
+    ETag ответа со статическим слоем по ключу версии файла и параметрам ответа.
+    Слой не загружается, поэтому на If-None-Match можно ответить 304, не строя тело.
+    None - файла слоя нет
+    """
+    file_path = find_static_layer_path(layer_id)
+    if file_path is None:
+        return None
+    base_key = static_layer_cache_key(file_path)
+    if base_key is None:
+        return None
+    return static_layer_etag(base_key, *params)
+
+def known_static_layer_fields(layer_id: str, fields: Optional[List[str]]) -> Optional[List[str]]:
+    """
+    Оставляет в fields только свойства из схемы статического слоя (без повторов).
+    Имена, которых нет в слое, не меняют ответ, и без этого каждый новый набор
+    таких имен занимал бы в кэше отдельную копию слоя
+    """
+    if fields is None:
+        return None
+    summary = get_static_layer_summary(layer_id)
+    if summary is None:
+        return fields
+    known = summary.get("properties") or {}
+    return [name for name in dict.fromkeys(fields) if name in known]
+
+def get_static_layer_encoded(layer_id: str, fields: Optional[List[str]],
+                             precision: Optional[int]) -> Optional[Tuple[bytes, str]]:
+    """
+    Статический слой, закодированный в JSON, и его ETag. Кодирование выполняется один раз
+    для версии файла и набора параметров: тело ответа должно совпадать байт в байт
+    между запросами, иначе загрузку по диапазонам нельзя продолжить.
+    fields должны быть предварительно отфильтрованы known_static_layer_fields
+    """
+    file_path = find_static_layer_path(layer_id)
+    if file_path is None:
+        return None
+    base_key = static_layer_cache_key(file_path)
+    if base_key is None:
+        return None
+    
+    # ETag совпадает с get_static_layer_response_etag(layer_id, "encoded", fields_cache_key(fields), precision)
+    cache_key = f"{base_key}:encoded:{fields_cache_key(fields)}:{precision}"
+    cached = encoded_layer_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    
+    geojson_data = load_static_layer(layer_id)
+    if geojson_data is None:
+        return None
+    # Те же параметры кодирования, что у JSONResponse
+    body = json.dumps(
+        prepare_collection(geojson_data, fields=fields, precision=precision),
+        ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+    ).encode("utf-8")
+    encoded = (body, static_layer_etag(cache_key))
+    encoded_layer_cache.set(cache_key, encoded)
+    return encoded
+
+def get_static_layer_parts(layer_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Описание загрузки статического слоя по частям: каждая часть содержит до
+    LAYER_PART_FEATURES целых объектов, части можно загружать параллельно
+    """
+    file_path = find_static_layer_path(layer_id)
+    geojson_data = load_static_layer(layer_id) if file_path is not None else None
+    if geojson_data is None:
+        return None
+    return _static_layer_parts(layer_id, file_path, geojson_data)
+
+def _static_layer_parts(layer_id: str, file_path: Path, geojson_data: Dict[str, Any]) -> Dict[str, Any]:
+    feature_count = len(geojson_data.get("features", []))
+    part_count = max(1, -(-feature_count // LAYER_PART_FEATURES))
+    return {
+        "layer_id": layer_id,
+        "version": geojson_data.get("version", 0),
+        "etag": static_layer_etag(static_layer_cache_key(file_path)),
+        "feature_count": feature_count,
+        "part_size": LAYER_PART_FEATURES,
+        "part_count": part_count,
+        "parts": [f"/api/maps/layer-data/{layer_id}/parts/{n}" for n in range(part_count)],
+    }
+
+def get_static_layer_part(layer_id: str, part: int) -> Optional[Dict[str, Any]]:
+    """
+    Часть статического слоя с номером part. Поле etag одинаково для всех частей
+    одной версии слоя: если оно изменилось, уже загруженные части устарели
+    """
+    file_path = find_static_layer_path(layer_id)
+    geojson_data = load_static_layer(layer_id) if file_path is not None else None
+    if geojson_data is None:
+        return None
+    parts = _static_layer_parts(layer_id, file_path, geojson_data)
+    if not 0 <= part < parts["part_count"]:
+        raise HTTPException(status_code=404, detail=f"Часть {part} слоя {layer_id} не найдена (всего частей: {parts['part_count']})")
+    features = geojson_data.get("features", [])
+    start = part * LAYER_PART_FEATURES
+    return {
+        "type": "FeatureCollection",
+        "features": features[start:start + LAYER_PART_FEATURES],
+        "version": parts["version"],
+        "etag": parts["etag"],
+        "part": part,
+        "part_count": parts["part_count"],
+    }
+
+def static_layer_export_path(file_path: Path, output_format: str) -> Path:
+    return file_path.with_name(file_path.name + STATIC_EXPORT_FORMATS[output_format][0])
+
+def read_static_layer_export_meta(export_path: Path, output_format: str) -> Optional[Dict[str, Any]]:
+    """Метаданные копии слоя (ключ версии слоя source и версия version); None - копии нет или она повреждена"""
+    try:
+        if output_format == "fgb":
+            with open(export_path, "rb") as f:
+                metadata = FlatGeobufReader(f).metadata
+        else:
+            metadata = GeoParquetReader(str(export_path)).metadata
+        return json.loads(metadata) if metadata else None
+    except (OSError, ValueError):
+        return None
+
+def find_static_layer_export(layer_id: str, output_format: str) -> Optional[Tuple[Path, Dict[str, Any]]]:
+    """Путь и метаданные копии слоя в формате output_format, если она соответствует текущей версии слоя"""
+    file_path = find_static_layer_path(layer_id)
+    if file_path is None:
+        return None
+    base_key = static_layer_cache_key(file_path)
+    if base_key is None:
+        return None
+    export_path = static_layer_export_path(file_path, output_format)
+    cache_key = f"{base_key}:export:{output_format}"
+    meta = layer_export_cache.get(cache_key)
+    if meta is None:
+        meta = read_static_layer_export_meta(export_path, output_format)
+        if meta is None or meta.get("source") != base_key:
+            return None
+        layer_export_cache.set(cache_key, meta)
+    elif not export_path.exists():
+        return None
+    return export_path, meta
+
+def write_static_layer_export(layer_id: str, output_format: str) -> Optional[Tuple[Path, Dict[str, Any]]]:
+    """
+    Записывает копию статического слоя в формате output_format рядом с файлом.
+    Копия пишется во временный файл и подменяет прежнюю целиком, поэтому читатели
+    никогда не видят недописанный файл
+    """
+    with _export_lock:
+        found = find_static_layer_export(layer_id, output_format)
+        if found is not None:
+            return found
+        file_path = find_static_layer_path(layer_id)
+        base_key = static_layer_cache_key(file_path) if file_path is not None else None
+        geojson_data = load_static_layer(layer_id) if base_key is not None else None
+        if geojson_data is None:
+            return None
+        meta = {"source": base_key, "version": geojson_data.get("version", 0)}
+        features = geojson_data.get("features", [])
+        export_path = static_layer_export_path(file_path, output_format)
+        temp_path = export_path.with_name(f"{export_path.name}.{uuid.uuid4().hex}.tmp")
+        try:
+            if output_format == "fgb":
+                with open(temp_path, "wb") as f:
+                    count = write_flatgeobuf(features, f, name=layer_id, metadata=json.dumps(meta))
+            else:
+                count = write_geoparquet(features, str(temp_path), metadata=json.dumps(meta))
+            os.replace(temp_path, export_path)
+        finally:
+            if temp_path.exists():
+                temp_path.unlink()
+        print(f"Создана копия слоя {layer_id} в формате {output_format}: {count} объектов")
+        layer_export_cache.set(f"{base_key}:export:{output_format}", meta)
+        return export_path, meta
+
+def get_static_layer_export(layer_id: str, output_format: str) -> Optional[Tuple[Path, str]]:
+    """
+    Файл статического слоя в формате FlatGeobuf или GeoParquet и его ETag.
+    Копия создается один раз для версии слоя и переиспользуется всеми воркерами
+    """
+    found = find_static_layer_export(layer_id, output_format) or write_static_layer_export(layer_id, output_format)
+    if found is None:
+        return None
+    export_path, meta = found
+    return export_path, static_layer_etag(meta["source"], output_format)
+
+def get_static_layer_bbox(layer_id: str, bbox: List[float]) -> Optional[Dict[str, Any]]:
+    """
+    Объекты статического слоя, экстент которых пересекается с bbox. При действительной
+    копии FlatGeobuf объекты читаются по ее R-дереву без загрузки слоя целиком,
+    иначе выбираются из загруженного слоя
+    """
+    found = find_static_layer_export(layer_id, "fgb")
+    if found is not None:
+        export_path, meta = found
+        with open(export_path, "rb") as f:
+            features = list(FlatGeobufReader(f).features(tuple(bbox)))
+        return {"type": "FeatureCollection", "features": features, "version": meta.get("version", 0)}
+    
+    geojson_data = load_static_layer(layer_id)
+    if geojson_data is None:
+        return None
+    features = []
+    for feature in geojson_data.get("features", []):
+        box = geometry_bbox(feature.get("geometry"))
+        if box is not None and box[0] <= bbox[2] and box[2] >= bbox[0] and box[1] <= bbox[3] and box[3] >= bbox[1]:
+            features.append(feature)
+    return {"type": "FeatureCollection", "features": features, "version": geojson_data.get("version", 0)}
+
+def import_layer_file(fp: Any, input_format: str) -> Dict[str, Any]:
+    """
+    Читает загруженный файл FlatGeobuf или GeoParquet (EPSG:4326) в FeatureCollection.
+    Объекты читаются из файла по одному, файл целиком в память не загружается
+    """
+    try:
+        if input_format == "fgb":
+            reader = FlatGeobufReader(fp)
+        else:
+            reader = GeoParquetReader(fp)
+        if reader.crs_code not in (None, 4326, "4326", "CRS84"):
+            raise ValueError(f"Поддерживается только система координат EPSG:4326, в файле: {reader.crs_code}")
+        features = list(reader.features())
+    except (ValueError, struct.error) as e:
+        raise HTTPException(status_code=400, detail=f"Ошибка при обработке файла: {str(e)}")
+    return {"type": "FeatureCollection", "features": features}
+
+def get_layer_clusters(db: Session, layer_id: str, zoom: float, bbox: Optional[List[float]],
+                       fields: Optional[List[str]], precision: Optional[int]) -> Optional[Dict[str, Any]]:
+    """
+    Данные слоя, в которых точки объединены в кластеры уровня zoom (в пределах bbox).
+    Индекс кластеров статического слоя строится один раз для версии файла,
+    слоя из БД - на CLUSTER_INDEX_TTL секунд, слоя НСПД - для каждой области bbox
+    """
+    fields_key = fields_cache_key(fields)
+
+    def load(bbox_filter=None):
+        layer_data = get_layer_by_id(db, layer_id, bbox_filter)
+        if layer_data is None or not isinstance(layer_data.get("features"), list):
+            return None
+        return prepare_collection(layer_data, fields=fields, precision=precision)
+
+    if layer_id.startswith("static_"):
+        file_path = find_static_layer_path(layer_id)
+        base_key = static_layer_cache_key(file_path) if file_path is not None else None
+        if base_key is None:
+            return None
+        index_id = cluster_index_id(base_key, fields_key, precision)
+        return cluster_collection(index_id, zoom, load, bbox=bbox)
+    if layer_id.startswith("nspd_"):
+        index_id = cluster_index_id(layer_id, bbox, fields_key, precision)
+        return cluster_collection(index_id, zoom, lambda: load(bbox), ttl=CLUSTER_INDEX_TTL)
+    index_id = cluster_index_id("db", layer_id, fields_key, precision)
+    return cluster_collection(index_id, zoom, load, bbox=bbox, ttl=CLUSTER_INDEX_TTL)
+
+def spatial_join(layer_id: str, points: List[List[float]], bboxes: List[List[float]],
+                 features: List[Dict[str, Any]], fields: Optional[List[str]] = None,
+                 include_geometry: bool = True) -> Optional[Dict[str, Any]]:
+    """
+    Находит полигоны статического слоя, в которые попадают точки, пересекающиеся
+    с прямоугольниками [min_lng, min_lat, max_lng, max_lat] или содержащие объекты
+    (например, результаты поиска НСПД; объект привязывается по представительной точке).
+    
+    Возвращает None, если слой не найден
+    """
+    index = get_layer_spatial_index(layer_id)
+    if index is None:
+        return None
+    
+    results = []
+    for i, point in enumerate(points):
+        results.append({"input": i, "type": "point", "matches": index.query_point(point[0], point[1])})
+    for i, bbox in enumerate(bboxes):
+        results.append({"input": i, "type": "bbox", "matches": index.query_bbox(tuple(bbox))})
+    for i, feature in enumerate(features):
+        point = representative_point(feature.get("geometry") if isinstance(feature, dict) else None)
+        matches = index.query_point(point[0], point[1]) if point else []
+        result = {"input": i, "type": "feature", "matches": matches}
+        if isinstance(feature, dict) and "id" in feature:
+            result["feature_id"] = feature["id"]
+        results.append(result)
+    
+    # Совпадения возвращаются как идентификаторы объектов слоя, сами объекты - один раз
+    matched = sorted({m for result in results for m in result["matches"]})
+    layer_features = []
+    for m in matched:
+        feature = index.features[m]
+        if not include_geometry:
+            feature = {key: value for key, value in feature.items() if key != "geometry"}
+        layer_features.append(dict(feature, id=feature.get("id", m)))
+    for result in results:
+        result["matches"] = [index.features[m].get("id", m) for m in result["matches"]]
+    
+    return {
+        "layer_id": layer_id,
+        "results": results,
+        "features": prepare_collection({"type": "FeatureCollection", "features": layer_features}, fields=fields),
+    }
+
+def get_layer_by_id(db: Session, layer_id: str, bbox: Optional[List[float]] = None) -> Optional[Dict[str, Any]]:
     """
     Получает данные слоя по его ID. Работает с разными типами слоев:
-    - Слои из БД
+    - Слои из БД (для db_geojson можно ограничить выборку прямоугольником bbox)
     - Статические слои из файлов
     - Слои НСПД
     
@@ -181,7 +1112,7 @@ def get_layer_by_id(db: Session, layer_id: str) -> Optional[Dict[str, Any]]:
                 # Если это слой из БД, проверяем его тип
                 if db_layer.source_type == "db_geojson":
                     # Если данные хранятся прямо в БД
-                    return db_layer.properties
+                    return get_db_layer_features(db, db_layer.id, bbox)
                 else:
                     # Возвращаем метаданные слоя для фронтенда
                     return {
@@ -199,26 +1130,9 @@ def get_layer_by_id(db: Session, layer_id: str) -> Optional[Dict[str, Any]]:
     if layer_id.startswith("static_"):
         filename = f"{layer_id[7:]}.geojson"  # Убираем префикс "static_"
         
-        # Проверяем путь в контейнере и вне его
-        paths_to_check = [
-            Path(f"/app/fastapi_backend/static/layers/{filename}"),
-            Path(f"/app/static/layers/{filename}"),
-            Path(f"static/layers/{filename}"),
-            Path(f"fastapi_backend/static/layers/{filename}")
-        ]
-        
-        for file_path in paths_to_check:
-            # Добавим логирование для отладки
-            print(f"Проверяем путь к файлу: {file_path}, существует: {file_path.exists()}")
-            if file_path.exists():
-                try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        geojson_data = json.load(f)
-                    print(f"Успешно загружен файл: {file_path}")
-                    return geojson_data
-                except (json.JSONDecodeError, IOError) as e:
-                    print(f"Ошибка чтения файла {file_path}: {str(e)}")
-                    continue
+        geojson_data = load_static_layer(layer_id)
+        if geojson_data is not None:
+            return geojson_data
         
         # Если не нашли файл напрямую, возвращаем информацию о слое
         # для прямой загрузки через URL фронтендом
@@ -234,18 +1148,21 @@ def get_layer_by_id(db: Session, layer_id: str) -> Optional[Dict[str, Any]]:
     
     # Проверяем, это слой НСПД?
     if layer_id.startswith("nspd_"):
-        from app.api.services.nspd_service import thematic_search, get_fallback_response
+        from app.api.services.nspd_service import THEMATIC_SEARCH_MAPPING, get_nspd_layer, get_fallback_response
         
         # Извлекаем тип тематического поиска из ID
         thematic_type = layer_id[5:]  # Убираем префикс "nspd_"
         
-        # Проверяем, валидный ли тип
-        valid_types = ["cad_del", "admin_del", "zouit", "ter_zone"]
-        if thematic_type in valid_types:
+        if thematic_type in THEMATIC_SEARCH_MAPPING:
+            if bbox is None:
+                # Данные НСПД загружаются только для видимой области карты
+                return {
+                    "type": "FeatureCollection",
+                    "features": [],
+                    "message": "Для слоя НСПД укажите область карты в параметре bbox"
+                }
             try:
-                # Выполняем пустой запрос для получения данных
-                result = thematic_search("", thematic_type)
-                return result
+                return get_nspd_layer(thematic_type, bbox)
             except Exception as e:
                 print(f"Ошибка получения данных из НСПД: {str(e)}")
                 # Возвращаем заглушку в случае ошибки
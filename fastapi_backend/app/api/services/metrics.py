@@ -0,0 +1,276 @@
+import time
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Границы корзин гистограмм по умолчанию (секунды)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Все зарегистрированные метрики в порядке создания
+_registry: List["_Metric"] = []
+_registry_lock = threading.Lock()
+
+
+def _escape_label_value(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames: Sequence[str], values: Tuple[str, ...], extra: Optional[Dict[str, str]] = None) -> str:
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.extend(extra.items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label_value(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric(ABC):
+    """Базовый класс метрики с метками"""
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    @abstractmethod
+    def _new_child(self):
+        """Создает дочернюю метрику для нового набора значений меток"""
+
+    def labels(self, **labels: str):
+        """Возвращает дочернюю метрику для набора значений меток"""
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            child = self._children.get(key)
+            if child is None:
+                child = self._new_child()
+                self._children[key] = child
+            return child
+
+    @abstractmethod
+    def _samples(self) -> List[str]:
+        """Строки значений метрики в текстовом формате Prometheus"""
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class _CounterChild:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self.value += amount
+
+
+class Counter(_Metric):
+    """Монотонно возрастающий счетчик"""
+    type_name = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1) -> None:
+        self.labels().inc(amount)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._children.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(child.value)}"
+                for key, child in items]
+
+
+class _HistogramChild:
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        with self._lock:
+            self.sum += value
+            self.count += 1
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+
+    @contextmanager
+    def time(self):
+        """Замеряет время выполнения блока в секундах"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+
+class Histogram(_Metric):
+    """Гистограмма с фиксированными корзинами"""
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._children.items())
+        lines = []
+        for key, child in items:
+            with child._lock:
+                counts, total_sum, total_count = list(child.counts), child.sum, child.count
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, {"le": _format_value(bound)})
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total_sum)}")
+            lines.append(f"{self.name}_count{labels} {total_count}")
+        return lines
+
+
+class _GaugeChild:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        with self._lock:
+            self.value -= amount
+
+    @contextmanager
+    def track_inprogress(self):
+        """Увеличивает значение на время выполнения блока"""
+        self.inc()
+        try:
+            yield
+        finally:
+            self.dec()
+
+
+class Gauge(_Metric):
+    """Значение, которое может расти и уменьшаться (например, число выполняемых операций)"""
+    type_name = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def inc(self, amount: float = 1) -> None:
+        self.labels().inc(amount)
+
+    def dec(self, amount: float = 1) -> None:
+        self.labels().dec(amount)
+
+    def track_inprogress(self):
+        return self.labels().track_inprogress()
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._children.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(child.value)}"
+                for key, child in items]
+
+
+def render_metrics() -> str:
+    """Возвращает все метрики в текстовом формате Prometheus"""
+    with _registry_lock:
+        metrics = list(_registry)
+    return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+# Метрики HTTP-запросов (заполняются middleware в main.py)
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Длительность обработки HTTP-запросов",
+    ["method", "route", "status"]
+)
+
+# Метрики запросов к НСПД
+NSPD_ATTEMPTS = Counter(
+    "nspd_upstream_attempts_total", "Попытки запросов к API НСПД по результату", ["outcome"]
+)
+NSPD_RESPONSES = Counter(
+    "nspd_upstream_responses_total", "Ответы API НСПД по HTTP-статусу", ["status"]
+)
+NSPD_UPSTREAM_DURATION = Histogram(
+    "nspd_upstream_duration_seconds", "Длительность одной попытки запроса к API НСПД"
+)
+NSPD_UPSTREAM_IN_FLIGHT = Gauge(
+    "nspd_upstream_in_flight", "Попытки запросов к API НСПД, которые сейчас занимают поток пула"
+)
+NSPD_HEDGED_REQUESTS = Counter(
+    "nspd_hedged_requests_total", "Хеджирующие запросы к API НСПД, отправленные из-за медленного ответа"
+)
+NSPD_CACHE_REQUESTS = Counter(
+    "nspd_cache_requests_total", "Обращения к кэшу НСПД", ["result"]
+)
+
+NSPD_RATE_LIMIT_WAIT = Histogram(
+    "nspd_rate_limit_wait_seconds", "Ожидание токена ограничителя частоты запросов к API НСПД"
+)
+
+NSPD_CANCELLED = Counter(
+    "nspd_cancelled_total", "Поиски в НСПД, прекращенные после отключения клиента, по этапу", ["stage"]
+)
+
+# Метрики контроля допуска запросов
+ADMISSION_DECISIONS = Counter(
+    "admission_decisions_total", "Решения контроля допуска запросов", ["endpoint", "outcome"]
+)
+ADMISSION_QUEUE_WAIT = Histogram(
+    "admission_queue_wait_seconds", "Время ожидания запроса в очереди допуска", ["endpoint"]
+)
+
+# Метрики обработки геометрий
+GEOMETRY_VERTICES_TRANSFORMED = Counter(
+    "geometry_vertices_transformed_total", "Число вершин, преобразованных из EPSG:3857 в EPSG:4326"
+)
+
+GEOMETRY_VALIDATION = Counter(
+    "geometry_validation_total", "Проверенные при загрузке геометрии по источнику и результату", ["source", "result"]
+)
+
+# Метрики загрузки статических слоев
+LAYER_LOAD_BYTES = Counter(
+    "static_layer_load_bytes_total", "Объем прочитанных с диска статических слоев", ["layer"]
+)
+LAYER_PARSE_DURATION = Histogram(
+    "static_layer_parse_seconds", "Время чтения и разбора файла статического слоя", ["layer"]
+)
+LAYER_CACHE_REQUESTS = Counter(
+    "static_layer_cache_requests_total", "Обращения к кэшу статических слоев", ["result"]
+)
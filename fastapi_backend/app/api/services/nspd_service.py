@@ -5,8 +5,27 @@ import time
 import hashlib
 import json
 import math
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
 from typing import Dict, Any, Optional, List, Tuple
 from fastapi import HTTPException
+from app.api.services.cache_backend import get_cache_backend
+from app.api.services.metrics import (
+    NSPD_ATTEMPTS, NSPD_RESPONSES, NSPD_UPSTREAM_DURATION, NSPD_CACHE_REQUESTS,
+    NSPD_HEDGED_REQUESTS, NSPD_RATE_LIMIT_WAIT, NSPD_CANCELLED, GEOMETRY_VERTICES_TRANSFORMED,
+    NSPD_UPSTREAM_IN_FLIGHT
+)
+from app.api.services.abortable_http import AbortableAttempt, abortable_get
+from app.api.services.geometry_executor import geometry_executor, count_vertices
+from app.api.services.retry_policy import RetryPolicy, Deadline, CircuitBreaker, parse_retry_after
+from app.api.services.rate_limit import TokenBucket, AdmissionController
+from app.api.services.cancellation import CancelToken, RequestCancelled, check_cancelled
+from app.api.services.geometry_validation import NO_GEOMETRY_PROPERTY, validate_features
+from app.api.services.cadastral import analyze_query
+from app.api.services.suggest_index import index_nspd_features
+from app.api.services.spatial_index import geometry_bbox
+from app.api.services.tiles import Tile, tile_bbox, tile_bbox_mercator, tiles_for_bbox, count_tiles_for_bbox
 
 # Отключаем предупреждения о небезопасном SSL
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
@@ -25,6 +44,42 @@ NSPD_HEADERS = {
     'Connection': 'keep-alive'
 }
 
+# Адрес API поиска НСПД (можно переопределить, например, для стенда нагрузочного тестирования)
+NSPD_SEARCH_URL = os.getenv("NSPD_SEARCH_URL", "https://nspd.gov.ru/api/geoportal/v2/search/geoportal")
+
+# Политика повторных запросов к НСПД: NSPD_DEADLINE, NSPD_ATTEMPT_TIMEOUT, NSPD_MAX_ATTEMPTS,
+# NSPD_BACKOFF_BASE, NSPD_BACKOFF_MAX, NSPD_HEDGE_DELAY (0 - без хеджирования)
+NSPD_RETRY_POLICY = RetryPolicy.from_env("NSPD")
+
+# Circuit breaker для НСПД: после серии отказов запросы временно не отправляются
+nspd_circuit_breaker = CircuitBreaker(
+    failure_threshold=int(os.getenv("NSPD_BREAKER_THRESHOLD", "5")),
+    recovery_timeout=float(os.getenv("NSPD_BREAKER_RECOVERY", "30"))
+)
+
+# Ограничение частоты запросов к НСПД с одного воркера: NSPD_RATE_LIMIT запросов в секунду
+# (0 - без ограничения), до NSPD_RATE_BURST подряд. Все попытки, включая повторные
+# и хеджирующие, расходуют токены
+nspd_rate_limiter = TokenBucket(
+    rate=float(os.getenv("NSPD_RATE_LIMIT", "5")),
+    burst=int(os.getenv("NSPD_RATE_BURST", "10"))
+)
+
+# Контроль допуска запросов тематического поиска: NSPD_MAX_CONCURRENT одновременно,
+# до NSPD_MAX_QUEUE в очереди не дольше NSPD_QUEUE_TIMEOUT секунд,
+# до NSPD_CLIENT_MAX_CONCURRENT запросов от одного клиента (0 - без ограничения)
+nspd_admission = AdmissionController(
+    "nspd_thematic_search",
+    max_concurrent=int(os.getenv("NSPD_MAX_CONCURRENT", "8")),
+    max_queue=int(os.getenv("NSPD_MAX_QUEUE", "32")),
+    per_client=int(os.getenv("NSPD_CLIENT_MAX_CONCURRENT", "2")),
+    queue_timeout=float(os.getenv("NSPD_QUEUE_TIMEOUT", "5"))
+)
+
+# Потоки для хеджирующих запросов
+_hedge_executor = ThreadPoolExecutor(max_workers=int(os.getenv("NSPD_HEDGE_POOL_SIZE", "16")),
+                                     thread_name_prefix="nspd-hedge")
+
 # Словарь соответствий для тематического поиска
 THEMATIC_SEARCH_MAPPING = {
     "objects": 1,
@@ -34,8 +89,19 @@ THEMATIC_SEARCH_MAPPING = {
     "ter_zone": 7
 }
 
-# Простой in-memory кэш
-cache = {}
+# Кэш ответов НСПД (бэкенд выбирается через CACHE_BACKEND: memory, sqlite, redis)
+cache = get_cache_backend("nspd")
+
+# Время жизни записей кэша НСПД в секундах
+NSPD_CACHE_TTL = int(os.getenv("NSPD_CACHE_TTL", "3600"))
+
+# Время жизни результатов поиска по кадастровому номеру: в отличие от текстового поиска
+# ответ на такой запрос однозначен, поэтому его можно кэшировать (0 - не кэшировать)
+NSPD_CADASTRAL_CACHE_TTL = int(os.getenv("NSPD_CADASTRAL_CACHE_TTL", "600"))
+# Сколько секунд клиент может использовать сохраненный результат такого поиска без
+# обращения к серверу (Cache-Control: max-age). Запись в кэше сервера к моменту ответа
+# может быть уже не новой, поэтому значение не больше NSPD_CADASTRAL_CACHE_TTL
+NSPD_SEARCH_MAX_AGE = min(int(os.getenv("NSPD_SEARCH_MAX_AGE", "300")), NSPD_CADASTRAL_CACHE_TTL)
 
 def transform_web_mercator_to_wgs84(x: float, y: float) -> Tuple[float, float]:
     """
@@ -64,15 +130,11 @@ def transform_web_mercator_to_wgs84(x: float, y: float) -> Tuple[float, float]:
     
     return (lng, lat)
 
-def transform_geometry_coordinates(geometry: Dict[str, Any]) -> Dict[str, Any]:
+def is_web_mercator_geometry(geometry: Dict[str, Any]) -> Tuple[bool, bool]:
     """
-    Преобразует координаты геометрии из EPSG:3857 в EPSG:4326
-    Поддерживает типы Point, LineString, Polygon, MultiPoint, MultiLineString, MultiPolygon
+    Определяет, заданы ли координаты геометрии в EPSG:3857.
+    Возвращает пару (явно указано в CRS, определено по диапазону координат)
     """
-    if not geometry or "type" not in geometry or "coordinates" not in geometry:
-        logger.warning(f"Невозможно преобразовать геометрию - некорректная структура: {geometry}")
-        return geometry
-    
     # Признаки того, что координаты в EPSG:3857:
     # 1. Явное указание в crs
     explicit_3857 = geometry.get("crs", {}).get("properties", {}).get("name") == "EPSG:3857"
@@ -95,7 +157,32 @@ def transform_geometry_coordinates(geometry: Dict[str, Any]) -> Dict[str, Any]:
     if sample_coords:
         x, y = sample_coords[:2]
         implicit_3857 = abs(x) > 180 or abs(y) > 90
-        
+    
+    return explicit_3857, implicit_3857
+
+def set_wgs84_crs(geometry: Dict[str, Any]) -> None:
+    """Записывает в геометрию CRS EPSG:4326"""
+    if "crs" in geometry:
+        geometry["crs"]["properties"]["name"] = "EPSG:4326"
+    else:
+        # Добавляем CRS, если его не было
+        geometry["crs"] = {
+            "type": "name",
+            "properties": {
+                "name": "EPSG:4326"
+            }
+        }
+
+def transform_geometry_coordinates(geometry: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Преобразует координаты геометрии из EPSG:3857 в EPSG:4326
+    Поддерживает типы Point, LineString, Polygon, MultiPoint, MultiLineString, MultiPolygon
+    """
+    if not geometry or "type" not in geometry or "coordinates" not in geometry:
+        logger.warning(f"Невозможно преобразовать геометрию - некорректная структура: {geometry}")
+        return geometry
+    
+    explicit_3857, implicit_3857 = is_web_mercator_geometry(geometry)
     needs_transform = explicit_3857 or implicit_3857
     
     if not needs_transform:
@@ -114,6 +201,7 @@ def transform_geometry_coordinates(geometry: Dict[str, Any]) -> Dict[str, Any]:
                 x, y = coords[:2]
                 lng, lat = transform_web_mercator_to_wgs84(x, y)
                 geometry["coordinates"] = [lng, lat] + coords[2:]
+                GEOMETRY_VERTICES_TRANSFORMED.inc()
                 logger.debug(f"Преобразована точка: [{x}, {y}] -> [{lng}, {lat}]")
         
         elif geo_type == "LineString" or geo_type == "MultiPoint":
@@ -127,6 +215,7 @@ def transform_geometry_coordinates(geometry: Dict[str, Any]) -> Dict[str, Any]:
                 else:
                     new_coords.append(p)
             geometry["coordinates"] = new_coords
+            GEOMETRY_VERTICES_TRANSFORMED.inc(len(new_coords))
             logger.debug(f"Преобразован {geo_type} ({len(new_coords)} точек)")
         
         elif geo_type == "Polygon" or geo_type == "MultiLineString":
@@ -143,6 +232,7 @@ def transform_geometry_coordinates(geometry: Dict[str, Any]) -> Dict[str, Any]:
                         new_line.append(p)
                 new_coords.append(new_line)
             geometry["coordinates"] = new_coords
+            GEOMETRY_VERTICES_TRANSFORMED.inc(sum(len(line) for line in new_coords))
             logger.debug(f"Преобразован {geo_type} ({len(new_coords)} линий)")
         
         elif geo_type == "MultiPolygon":
@@ -162,58 +252,200 @@ def transform_geometry_coordinates(geometry: Dict[str, Any]) -> Dict[str, Any]:
                     new_polygon.append(new_line)
                 new_coords.append(new_polygon)
             geometry["coordinates"] = new_coords
+            GEOMETRY_VERTICES_TRANSFORMED.inc(sum(len(line) for polygon in new_coords for line in polygon))
             logger.debug(f"Преобразован {geo_type} ({len(new_coords)} полигонов)")
             
         # Обновляем CRS на WGS84
-        if "crs" in geometry:
-            geometry["crs"]["properties"]["name"] = "EPSG:4326"
-        else:
-            # Добавляем CRS, если его не было
-            geometry["crs"] = {
-                "type": "name",
-                "properties": {
-                    "name": "EPSG:4326"
-                }
-            }
+        set_wgs84_crs(geometry)
         
         return geometry
     except Exception as e:
         logger.exception(f"Ошибка при преобразовании координат: {str(e)}")
         return geometry  # В случае ошибки возвращаем исходную геометрию
 
+def transform_features_to_wgs84(features: List[Dict[str, Any]], cancel: Optional[CancelToken] = None) -> None:
+    """
+    Преобразует геометрии объектов из EPSG:3857 в EPSG:4326 на месте.
+    Большие наборы (по числу вершин) обрабатываются в пуле процессов.
+    При отмене запроса cancel преобразование прекращается (RequestCancelled)
+    """
+    geometries = [
+        feature["geometry"] for feature in features
+        if isinstance(feature, dict) and isinstance(feature.get("geometry"), dict)
+        and "type" in feature["geometry"] and "coordinates" in feature["geometry"]
+    ]
+    
+    offloaded = set()
+    try:
+        to_transform = [g for g in geometries if any(is_web_mercator_geometry(g))]
+        vertex_count = sum(count_vertices(g) for g in to_transform)
+        check_cancelled(cancel, "geometry")
+        if geometry_executor.should_offload(vertex_count):
+            logger.debug(f"Преобразование {vertex_count} вершин в пуле процессов")
+            for geometry in geometry_executor.map_coordinates(to_transform, "web_mercator_to_wgs84"):
+                set_wgs84_crs(geometry)
+                offloaded.add(id(geometry))
+                GEOMETRY_VERTICES_TRANSFORMED.inc(count_vertices(geometry))
+    except Exception as e:
+        # Например, пул процессов недоступен - обрабатываем в текущем процессе
+        logger.exception(f"Ошибка при преобразовании координат в пуле процессов: {str(e)}")
+    
+    check_cancelled(cancel, "geometry")
+    for feature in features:
+        check_cancelled(cancel, "geometry")
+        if isinstance(feature, dict) and feature.get("geometry") and id(feature["geometry"]) not in offloaded:
+            feature["geometry"] = transform_geometry_coordinates(feature["geometry"])
+
 def get_cache_key(base_url: str, params: Dict[str, Any]) -> str:
     """Создает ключ кэша на основе URL и параметров запроса"""
     param_str = json.dumps(params, sort_keys=True)
     return f"nspd_api:{hashlib.md5(f'{base_url}:{param_str}'.encode()).hexdigest()}"
 
-def make_nspd_request(base_url: str, params: Dict[str, Any], max_retries: int = 3, delay: int = 2) -> Dict[str, Any]:
+def _send_nspd_request(base_url: str, params: Dict[str, Any], timeout: float,
+                       attempt: Optional[AbortableAttempt] = None) -> requests.Response:
+    """Одна попытка запроса к НСПД API; с attempt ее соединение можно закрыть из другого потока"""
+    with NSPD_UPSTREAM_DURATION.time():
+        if attempt is None:
+            response = requests.get(base_url, params=params, headers=NSPD_HEADERS, verify=False, timeout=timeout)
+        else:
+            with NSPD_UPSTREAM_IN_FLIGHT.track_inprogress():
+                response = abortable_get(attempt, base_url, params=params, headers=NSPD_HEADERS,
+                                         verify=False, timeout=timeout)
+    NSPD_RESPONSES.labels(status=response.status_code).inc()
+    return response
+
+def _wait_first(futures, timeout: float, cancel: Optional[CancelToken]) -> set:
+    """
+    Ждет первый завершенный из futures не дольше timeout секунд.
+    При отмене запроса ожидание прерывается сразу (RequestCancelled)
+    """
+    waitables = set(futures)
+    if cancel is not None:
+        waitables.add(cancel.future)
+    done, _ = wait(waitables, timeout=timeout, return_when=FIRST_COMPLETED)
+    if cancel is not None and cancel.cancelled:
+        raise RequestCancelled("upstream")
+    return done
+
+def _send_hedged_nspd_request(base_url: str, params: Dict[str, Any], timeout: float,
+                              hedge_delay: float, cancel: Optional[CancelToken] = None) -> requests.Response:
     """
-    Выполняет запрос к НСПД API с поддержкой повторных попыток и кэширования
+    Попытка запроса с хеджированием: если ответ не пришел за hedge_delay секунд,
+    параллельно отправляется второй запрос и используется первый успешный ответ
+    (ответы 5xx и 429 успешными не считаются).
+    С cancel попытка выполняется в пуле потоков, чтобы ожидание ответа можно было прервать.
+    Запросы, ответ которых больше не нужен (отмена, таймаут, проигравший хеджирующий запрос),
+    снимаются с очереди, а их соединения закрываются, чтобы сразу освободить потоки пула
     """
+    hedging = 0 < hedge_delay < timeout
+    if not hedging and cancel is None:
+        return _send_nspd_request(base_url, params, timeout)
+    
+    started = time.monotonic()
+    attempts: Dict[Future, AbortableAttempt] = {}
+    
+    def submit(attempt_timeout: float) -> None:
+        attempt = AbortableAttempt()
+        attempts[_hedge_executor.submit(_send_nspd_request, base_url, params, attempt_timeout, attempt)] = attempt
+    
+    try:
+        submit(timeout)
+        # Хеджирующий запрос отправляем, только если он не превышает лимит частоты запросов
+        if hedging and not _wait_first(attempts, hedge_delay, cancel) and nspd_rate_limiter.try_acquire():
+            logger.debug(f"НСПД не ответил за {hedge_delay} с, отправляем хеджирующий запрос")
+            NSPD_HEDGED_REQUESTS.inc()
+            submit(timeout - hedge_delay)
+        
+        pending = set(attempts)
+        last_error: Optional[Exception] = None
+        # Ответ 5xx или 429 - неудачная попытка: ждем остальные и отдаем его, только если других нет
+        error_response: Optional[requests.Response] = None
+        while pending:
+            remaining = timeout - (time.monotonic() - started)
+            done = _wait_first(pending, max(0.0, remaining), cancel)
+            if not done:
+                break
+            pending -= done
+            for future in done:
+                try:
+                    response = future.result()
+                except requests.exceptions.RequestException as e:
+                    last_error = e
+                    continue
+                if response.status_code >= 500 or response.status_code == 429:
+                    error_response = response
+                    continue
+                return response
+        if error_response is not None:
+            return error_response
+        raise last_error or requests.exceptions.Timeout(f"НСПД не ответил за {timeout:.1f} с")
+    finally:
+        # У завершившихся попыток сокеты уже закрыты, для них abort ничего не делает
+        for future, attempt in attempts.items():
+            future.cancel()
+            attempt.abort()
+
+def make_nspd_request(base_url: str, params: Dict[str, Any], policy: Optional[RetryPolicy] = None,
+                      cache_ttl: Optional[float] = None, cancel: Optional[CancelToken] = None) -> Dict[str, Any]:
+    """
+    Выполняет запрос к НСПД API с поддержкой повторных попыток и кэширования.
+    Поисковые запросы кэшируются, только если задан cache_ttl.
+    После отмены cancel (клиент отключился) ожидание ответа, паузы между попытками
+    и обработка геометрий прерываются исключением RequestCancelled
+    
+    Общее время ограничено бюджетом политики (NSPD_DEADLINE), между попытками -
+    экспоненциальная задержка со случайным разбросом или время из Retry-After.
+    При серии отказов НСПД circuit breaker сразу возвращает 503 без запроса
+    """
+    policy = policy or NSPD_RETRY_POLICY
+    
     # Для запросов поиска не используем кэш на бэкенде
     # Это позволит фронтенду всегда получать свежие данные
     is_search_request = "thematicSearchId" in params
+    use_cache = not is_search_request or bool(cache_ttl)
     
-    # Проверяем кэш перед запросом (только для неполисковых запросов)
+    # Проверяем кэш перед запросом (только для неполисковых запросов или с cache_ttl)
     cache_key = get_cache_key(base_url, params)
-    if not is_search_request and cache_key in cache:
-        logger.debug(f"Возвращаем кэшированный результат для запроса: {base_url}")
-        return cache[cache_key]
+    if use_cache:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            NSPD_CACHE_REQUESTS.labels(result="hit").inc()
+            logger.debug(f"Возвращаем кэшированный результат для запроса: {base_url}")
+            return cached
+        NSPD_CACHE_REQUESTS.labels(result="miss").inc()
     
+    if not nspd_circuit_breaker.allow_request():
+        NSPD_ATTEMPTS.labels(outcome="circuit_open").inc()
+        logger.warning("Circuit breaker разомкнут, запрос к NSPD API не отправляется")
+        raise HTTPException(status_code=503, detail="NSPD API временно недоступен")
+    
+    deadline = Deadline(policy.deadline)
     last_error = None
-    for attempt in range(max_retries):
+    for attempt in range(policy.max_attempts):
+        check_cancelled(cancel, "upstream")
+        timeout = min(policy.attempt_timeout, deadline.remaining())
+        if timeout < policy.min_attempt_timeout:
+            logger.warning("Бюджет времени на запрос к NSPD API исчерпан")
+            break
+        
+        # Ждем токен ограничителя, только если после ожидания останется время на попытку
+        wait_started = time.monotonic()
+        if not nspd_rate_limiter.acquire(max_wait=deadline.remaining() - policy.min_attempt_timeout, cancel=cancel):
+            NSPD_ATTEMPTS.labels(outcome="rate_limited").inc()
+            logger.warning("Лимит частоты запросов к NSPD API не позволяет выполнить запрос в пределах бюджета времени")
+            raise HTTPException(status_code=503, detail="Превышен лимит запросов к NSPD API, попробуйте позже")
+        NSPD_RATE_LIMIT_WAIT.observe(time.monotonic() - wait_started)
+        timeout = min(policy.attempt_timeout, deadline.remaining())
+        
+        retry_after = None
         try:
-            logger.debug(f"Попытка {attempt + 1} из {max_retries}")
-            response = requests.get(
-                base_url,
-                params=params,
-                headers=NSPD_HEADERS,
-                verify=False,
-                timeout=20  # Таймаут 20 секунд
-            )
+            logger.debug(f"Попытка {attempt + 1} из {policy.max_attempts}, таймаут {timeout:.1f} с")
+            response = _send_hedged_nspd_request(base_url, params, timeout, policy.hedge_delay, cancel)
             
             # Если получен ответ 400 Bad Request, вернуть пустую коллекцию вместо ошибки
             if response.status_code == 400:
+                NSPD_ATTEMPTS.labels(outcome="bad_request").inc()
+                nspd_circuit_breaker.record_success()
                 logger.warning(f"Получен статус 400 Bad Request от API НСПД. Возможно, неверные параметры запроса: {params}")
                 return {
                     "type": "FeatureCollection",
@@ -221,7 +453,12 @@ def make_nspd_request(base_url: str, params: Dict[str, Any], max_retries: int =
                     "message": "Некорректный запрос к НСПД. Пожалуйста, уточните параметры поиска."
                 }
             
+            if response.status_code in (429, 503):
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            
             response.raise_for_status()
+            NSPD_ATTEMPTS.labels(outcome="success").inc()
+            nspd_circuit_breaker.record_success()
             
             # Парсим JSON-ответ
             json_response = response.json()
@@ -250,32 +487,52 @@ def make_nspd_request(base_url: str, params: Dict[str, Any], max_retries: int =
                     # Преобразуем ID в строки
                     if "id" in feature and not isinstance(feature["id"], str):
                         feature["id"] = str(feature["id"])
-                    
-                    # Преобразуем координаты геометрии
-                    if "geometry" in feature and feature["geometry"]:
-                        feature["geometry"] = transform_geometry_coordinates(feature["geometry"])
+                
+                # Преобразуем координаты геометрий
+                transform_features_to_wgs84(result["features"], cancel)
+                check_cancelled(cancel, "geometry")
+                
+                # Проверяем и исправляем геометрии один раз при получении, а не в каждом запросе.
+                # Объекты без пригодной геометрии (участок без границ) остаются в ответе:
+                # НСПД их нашел, и поиск по кадастровому номеру должен их вернуть
+                result["features"], quality = validate_features(result["features"], "nspd", keep_rejected=True)
+                if quality.rejected:
+                    logger.warning(f"Объектов НСПД без пригодной геометрии: {quality.rejected}")
             
-            # Кэшируем результат только для неполисковых запросов
-            if not is_search_request:
-                cache[cache_key] = result
+            # Кэшируем результат только для неполисковых запросов или с cache_ttl
+            if use_cache:
+                cache.set(cache_key, result, ttl=cache_ttl or NSPD_CACHE_TTL)
             
             return result
         except requests.exceptions.HTTPError as e:
             last_error = e
+            NSPD_ATTEMPTS.labels(outcome="http_error").inc()
             logger.warning(f"Ошибка HTTP при попытке {attempt + 1}: {str(e)}")
             
-            # Проверка на 404 и 403 ошибки - не имеет смысла повторять
+            # Проверка на 404 и 403 ошибки - не имеет смысла повторять,
+            # при этом сам НСПД доступен
             if e.response.status_code in [403, 404]:
+                nspd_circuit_breaker.record_success()
                 break
-                
-            if attempt < max_retries - 1:
-                time.sleep(delay)
+            # Отказом самого НСПД считаем только 5xx и 429
+            if e.response.status_code >= 500 or e.response.status_code == 429:
+                nspd_circuit_breaker.record_failure()
         except (requests.exceptions.RequestException, requests.exceptions.ConnectionError) as e:
             last_error = e
-            if attempt < max_retries - 1:
-                logger.warning(f"Ошибка при попытке {attempt + 1}: {str(e)}")
+            NSPD_ATTEMPTS.labels(outcome="connection_error").inc()
+            nspd_circuit_breaker.record_failure()
+            logger.warning(f"Ошибка при попытке {attempt + 1}: {str(e)}")
+        
+        if attempt < policy.max_attempts - 1:
+            delay = retry_after if retry_after is not None else policy.backoff(attempt)
+            # Не ждем, если после паузы на попытку не останется времени
+            if delay + policy.min_attempt_timeout > deadline.remaining():
+                logger.warning(f"Повтор через {delay:.1f} с не укладывается в бюджет времени запроса")
+                break
+            if cancel is not None:
+                cancel.sleep(delay, "backoff")
+            else:
                 time.sleep(delay)
-                continue
     
     logger.error(f"Все попытки запроса к NSPD API завершились неудачей: {str(last_error)}")
     
@@ -289,11 +546,73 @@ def make_nspd_request(base_url: str, params: Dict[str, Any], max_retries: int =
         
     raise HTTPException(status_code=503, detail=f"NSPD API недоступен: {str(last_error)}")
 
+def convert_nspd_feature(feature: Dict[str, Any], wanted_fields: Optional[set] = None) -> Dict[str, Any]:
+    """
+    Приводит объект из ответа НСПД к виду для карты: свойства из options переносятся
+    на верхний уровень, добавляется name. wanted_fields - нужные свойства (None - все)
+    """
+    # Создаем новый объект
+    new_feature = {
+        "type": "Feature",
+        "properties": {}
+    }
+
+    # Копируем ID
+    if "id" in feature:
+        if not isinstance(feature["id"], str):
+            new_feature["id"] = str(feature["id"])
+        else:
+            new_feature["id"] = feature["id"]
+
+    # Копируем свойства, если есть
+    if "properties" in feature and isinstance(feature["properties"], dict):
+        # Добавляем нужные свойства для отображения
+        if "options" in feature["properties"]:
+            # Копируем важные свойства из options
+            options = feature["properties"]["options"]
+            if isinstance(options, dict):
+                # Добавим важные свойства для отображения на карте
+                if wanted_fields is None or "name" in wanted_fields:
+                    if "name" in options:
+                        new_feature["properties"]["name"] = options["name"]
+                    elif "cad_number" in options:
+                        new_feature["properties"]["name"] = options["cad_number"]
+                    elif "build_record_purpose" in options:
+                        new_feature["properties"]["name"] = options["build_record_purpose"]
+                    else:
+                        # Если нет имени, используем категорию или другие данные
+                        category = feature["properties"].get("categoryName", "Объект")
+                        new_feature["properties"]["name"] = f"{category} #{new_feature.get('id', '')}"
+
+                # Копируем все остальные свойства (только запрошенные)
+                for key, value in options.items():
+                    if wanted_fields is None or key in wanted_fields:
+                        new_feature["properties"][key] = value
+
+        # Добавляем остальные свойства из верхнего уровня properties
+        for key, value in feature["properties"].items():
+            if key != "options" and (wanted_fields is None or key in wanted_fields):
+                new_feature["properties"][key] = value
+
+    # Геометрия уже преобразована в EPSG:4326 и проверена в make_nspd_request
+    new_feature["geometry"] = feature.get("geometry")
+    if new_feature["geometry"] is None:
+        # Признак объекта без геометрии сохраняется при любом наборе свойств
+        new_feature["properties"][NO_GEOMETRY_PROPERTY] = True
+
+    return new_feature
+
 def thematic_search(query: str, thematic_search: str, north: Optional[float] = None,
                     east: Optional[float] = None, south: Optional[float] = None,
-                    west: Optional[float] = None) -> Dict[str, Any]:
+                    west: Optional[float] = None, fields: Optional[List[str]] = None,
+                    cancel: Optional[CancelToken] = None) -> Dict[str, Any]:
     """
     Выполняет тематический поиск в НСПД
+    
+    fields - список свойств, которые нужно перенести в объекты результата (None - все)
+    cancel - признак отмены запроса: после отключения клиента поиск прекращается
+    с исключением RequestCancelled (в отличие от остальных ошибок оно не перехватывается).
+    При ошибке НСПД или сервера возвращается пустая коллекция с сообщением и error=True
     """
     try:
         logger.debug(f"Запрос тематического поиска: '{query}', тип: '{thematic_search}', границы: N={north}, E={east}, S={south}, W={west}")
@@ -317,12 +636,21 @@ def thematic_search(query: str, thematic_search: str, north: Optional[float] = N
                 "message": "Пустой поисковый запрос. Пожалуйста, введите текст для поиска."
             }
         
+        # Кадастровый номер ищется только в одном типе поиска: запрос в другой тип
+        # ничего не найдет и только потратит обращение к НСПД
+        analysis = analyze_query(query)
+        if analysis.is_cadastral and analysis.thematic_search != thematic_search:
+            logger.info(f"Запрос '{analysis.query}' распознан как {analysis.kind}, "
+                        f"поиск по типу {analysis.thematic_search} вместо {thematic_search}")
+            thematic_search = analysis.thematic_search
+            thematic_search_id = THEMATIC_SEARCH_MAPPING[thematic_search]
+        
         logger.debug(f"Преобразован thematicSearch в ID: {thematic_search_id}")
         
         # Формируем URL для запроса к NSPD - используем только необходимые параметры
-        base_url = "https://nspd.gov.ru/api/geoportal/v2/search/geoportal"
+        base_url = NSPD_SEARCH_URL
         params = {
-            "query": query,
+            "query": analysis.query,  # Канонический вид запроса, он же входит в ключ кэша
             "limit": 200,  # Увеличиваем лимит до 200
             "thematicSearchId": thematic_search_id,
         }
@@ -332,13 +660,17 @@ def thematic_search(query: str, thematic_search: str, north: Optional[float] = N
         
         try:
             # Попытка получить данные из НСПД API
-            result = make_nspd_request(base_url, params)
+            cache_ttl = NSPD_CADASTRAL_CACHE_TTL if analysis.is_cadastral else None
+            result = make_nspd_request(base_url, params, cache_ttl=cache_ttl, cancel=cancel)
             logger.debug(f"Получен результат от НСПД API: {type(result)}")
             
             # Проверяем и логируем структуру результатов
             if not isinstance(result, dict):
                 logger.error(f"НСПД API вернул результат неверного типа: {type(result)}")
                 result = {"type": "FeatureCollection", "features": []}
+            # Результат может быть из кэша, поэтому изменяем только его копию
+            result = dict(result)
+            result["thematic_search"] = thematic_search
             
             # Упрощенная обработка результатов для лучшей совместимости с фронтендом
             if "features" in result and isinstance(result["features"], list):
@@ -348,112 +680,12 @@ def thematic_search(query: str, thematic_search: str, north: Optional[float] = N
                 
                 # Конвертируем все объекты в простые точки, если необходимо
                 valid_features = []
+                wanted_fields = set(fields) if fields is not None else None
                 
                 for feature in result["features"]:
+                    check_cancelled(cancel, "convert")
                     try:
-                        # Создаем новый объект для каждого элемента
-                        new_feature = {
-                            "type": "Feature",
-                            "properties": {}
-                        }
-                        
-                        # Копируем ID
-                        if "id" in feature:
-                            if not isinstance(feature["id"], str):
-                                new_feature["id"] = str(feature["id"])
-                            else:
-                                new_feature["id"] = feature["id"]
-                        
-                        # Копируем свойства, если есть
-                        if "properties" in feature and isinstance(feature["properties"], dict):
-                            # Добавляем нужные свойства для отображения
-                            if "options" in feature["properties"]:
-                                # Копируем важные свойства из options
-                                options = feature["properties"]["options"]
-                                if isinstance(options, dict):
-                                    # Добавим важные свойства для отображения на карте
-                                    if "name" in options:
-                                        new_feature["properties"]["name"] = options["name"]
-                                    elif "cad_number" in options:
-                                        new_feature["properties"]["name"] = options["cad_number"]
-                                    elif "build_record_purpose" in options:
-                                        new_feature["properties"]["name"] = options["build_record_purpose"]
-                                    else:
-                                        # Если нет имени, используем категорию или другие данные
-                                        category = feature["properties"].get("categoryName", "Объект")
-                                        new_feature["properties"]["name"] = f"{category} #{new_feature.get('id', '')}"
-                                    
-                                    # Копируем все остальные свойства
-                                    for key, value in options.items():
-                                        new_feature["properties"][key] = value
-                        
-                            # Добавляем остальные свойства из верхнего уровня properties
-                            for key, value in feature["properties"].items():
-                                if key != "options":
-                                    new_feature["properties"][key] = value
-                        
-                        # Обрабатываем геометрию
-                        if "geometry" in feature and feature["geometry"]:
-                            geom = feature["geometry"]
-                            
-                            if "type" in geom and "coordinates" in geom:
-                                geo_type = geom["type"]
-                                coords = geom["coordinates"]
-                                
-                                # Создаем новую геометрию, гарантированно в EPSG:4326
-                                new_geometry = {"type": geo_type, "coordinates": []}
-                                
-                                # Для точечных объектов
-                                if geo_type == "Point":
-                                    if len(coords) >= 2:
-                                        x, y = coords[:2]
-                                        # Проверяем на координаты EPSG:3857 по диапазону значений
-                                        # и явному указанию CRS
-                                        needs_transform = (abs(x) > 180 or abs(y) > 90) or (
-                                            "crs" in geom and 
-                                            geom["crs"].get("properties", {}).get("name") == "EPSG:3857"
-                                        )
-                                        
-                                        if needs_transform:
-                                            logger.debug(f"Преобразование точечных координат из EPSG:3857 в WGS84: [{x}, {y}]")
-                                            lng, lat = transform_web_mercator_to_wgs84(x, y)
-                                            logger.debug(f"Результат преобразования: [{lng}, {lat}]")
-                                        else:
-                                            lng, lat = x, y
-                                            logger.debug(f"Координаты уже в WGS84: [{lng}, {lat}]")
-                                        
-                                        # Ограничиваем в допустимом диапазоне
-                                        lng = max(-180, min(180, lng))
-                                        lat = max(-90, min(90, lat))
-                                        
-                                        new_geometry["coordinates"] = [lng, lat]
-                                else:
-                                    # Для нетривиальных геометрий выполняем полное преобразование
-                                    logger.debug(f"Преобразование сложной геометрии типа {geo_type}")
-                                    new_geometry = transform_geometry_coordinates(geom)
-                                    logger.debug(f"Геометрия преобразована: {new_geometry['type']}")
-                                    
-                                # Устанавливаем новую геометрию
-                                new_feature["geometry"] = new_geometry
-                            else:
-                                # Если геометрия некорректна, создаем пустую точку в центре Москвы
-                                logger.warning(f"Объект без корректной геометрии: {geom}")
-                                new_feature["geometry"] = {
-                                    "type": "Point",
-                                    "coordinates": [37.6173, 55.7558]
-                                }
-                                new_feature["properties"]["invalid_geometry"] = True
-                        else:
-                            # Если нет геометрии, создаем пустую точку в центре Москвы
-                            logger.warning("Объект без геометрии, создаем пустую точку")
-                            new_feature["geometry"] = {
-                                "type": "Point",
-                                "coordinates": [37.6173, 55.7558]
-                            }
-                            new_feature["properties"]["no_geometry"] = True
-                        
-                        # Добавляем обработанный объект в результаты
-                        valid_features.append(new_feature)
+                        valid_features.append(convert_nspd_feature(feature, wanted_fields))
                     except Exception as feature_error:
                         logger.exception(f"Ошибка при обработке объекта: {str(feature_error)}")
                         # Пропускаем проблемный объект, но продолжаем обработку остальных
@@ -462,12 +694,17 @@ def thematic_search(query: str, thematic_search: str, north: Optional[float] = N
                 # Заменяем список объектов на обработанный
                 result["features"] = valid_features
                 feature_count = len(valid_features)
+                # Названия найденных объектов пополняют индекс подсказок
+                index_nspd_features(valid_features, thematic_search)
                 logger.debug(f"После обработки: {feature_count} объектов")
                 
                 # Добавляем поле message если его нет
                 if "message" not in result:
                     if feature_count > 0:
                         result["message"] = f"Найдено объектов: {feature_count}"
+                        without_geometry = sum(1 for f in valid_features if f["geometry"] is None)
+                        if without_geometry:
+                            result["message"] += f", из них без геометрии (не показаны на карте): {without_geometry}"
                     else:
                         result["message"] = "По вашему запросу ничего не найдено"
             else:
@@ -483,13 +720,16 @@ def thematic_search(query: str, thematic_search: str, north: Optional[float] = N
                 result["features"] = []
             
             return result
+        except RequestCancelled:
+            raise
         except HTTPException as e:
             # Если возникла ошибка, логируем и возвращаем пустой набор результатов
             logger.error(f"HTTPException при выполнении тематического поиска: {str(e)}")
             return {
                 "type": "FeatureCollection",
                 "features": [],
-                "message": f"Ошибка API НСПД: {str(e)}"
+                "message": f"Ошибка API НСПД: {str(e)}",
+                "error": True
             }
         except Exception as e:
             logger.exception(f"Непредвиденная ошибка при выполнении тематического поиска: {str(e)}")
@@ -497,17 +737,124 @@ def thematic_search(query: str, thematic_search: str, north: Optional[float] = N
             return {
                 "type": "FeatureCollection",
                 "features": [],
-                "message": f"Непредвиденная ошибка: {str(e)}"
+                "message": f"Непредвиденная ошибка: {str(e)}",
+                "error": True
             }
+    except RequestCancelled as e:
+        NSPD_CANCELLED.labels(stage=e.stage).inc()
+        logger.info(f"Поиск '{query}' ({thematic_search}) прекращен: клиент отключился ({e.stage})")
+        raise
     except Exception as e:
         # Глобальная обработка ошибок
         logger.exception(f"Критическая ошибка в функции thematic_search: {str(e)}")
         return {
             "type": "FeatureCollection",
             "features": [],
-            "message": "Произошла внутренняя ошибка сервера. Пожалуйста, попробуйте позже."
+            "message": "Произошла внутренняя ошибка сервера. Пожалуйста, попробуйте позже.",
+            "error": True
         }
 
+def parse_thematic_types(value: str) -> Optional[List[str]]:
+    """
+    Разбирает тип тематического поиска: один тип, несколько через запятую или all -
+    все типы. Возвращает None, если среди них есть неизвестный тип
+    """
+    if value.strip() == "all":
+        return list(THEMATIC_SEARCH_MAPPING)
+    types = []
+    for name in value.split(","):
+        name = name.strip()
+        if name not in THEMATIC_SEARCH_MAPPING:
+            return None
+        if name not in types:
+            types.append(name)
+    return types or None
+
+# Потоки для параллельного поиска по нескольким типам
+_search_executor = ThreadPoolExecutor(max_workers=len(THEMATIC_SEARCH_MAPPING) * 2,
+                                      thread_name_prefix="nspd-search")
+
+def multi_thematic_search(query: str, thematic_search_types: str, north: Optional[float] = None,
+                          east: Optional[float] = None, south: Optional[float] = None,
+                          west: Optional[float] = None, fields: Optional[List[str]] = None,
+                          cancel: Optional[CancelToken] = None) -> Dict[str, Any]:
+    """
+    Тематический поиск по одному или нескольким типам (через запятую или all).
+    Запросы по типам выполняются параллельно, поэтому время ответа близко к одному
+    запросу к НСПД. Результаты объединяются без повторов (по id), у каждого объекта
+    в свойстве thematic_search указан тип, по которому он найден
+    """
+    types = parse_thematic_types(thematic_search_types)
+    if types is None:
+        return {
+            "type": "FeatureCollection",
+            "features": [],
+            "message": f"Неизвестный тип тематического поиска: {thematic_search_types}"
+        }
+    # Кадастровый номер ищется только в своем типе (даже если он не запрошен:
+    # thematic_search все равно перенаправит туда каждый запрос), остальные запросы были бы лишними
+    analysis = analyze_query(query)
+    if analysis.is_cadastral:
+        types = [analysis.thematic_search]
+    if len(types) == 1:
+        return thematic_search(query, types[0], north, east, south, west, fields, cancel)
+    
+    futures = [
+        _search_executor.submit(thematic_search, query, thematic_type, north, east, south, west, fields, cancel)
+        for thematic_type in types
+    ]
+    features = []
+    seen = set()
+    categories = {}
+    failed = []
+    for thematic_type, future in zip(types, futures):
+        try:
+            result = future.result()
+        except RequestCancelled:
+            # Поиски по остальным типам тоже отменены; еще не начатые снимаем с очереди
+            for other in futures:
+                other.cancel()
+            raise
+        # Тип, по которому поиск действительно выполнен (thematic_search может его заменить)
+        found_type = result.get("thematic_search", thematic_type)
+        type_features = result.get("features") or []
+        categories[found_type] = categories.get(found_type, 0) + len(type_features)
+        # thematic_search не выбрасывает исключений, ошибку НСПД или сервера отмечает полем error
+        if result.get("error"):
+            failed.append(thematic_type)
+        for feature in type_features:
+            feature_id = feature.get("id")
+            if feature_id is not None:
+                if feature_id in seen:
+                    continue
+                seen.add(feature_id)
+            feature["properties"]["thematic_search"] = found_type
+            features.append(feature)
+    
+    if features:
+        message = f"Найдено объектов: {len(features)}"
+    else:
+        message = "По вашему запросу ничего не найдено"
+    result = {"type": "FeatureCollection", "features": features, "categories": categories, "message": message}
+    if failed:
+        result["message"] += f". Не удалось выполнить поиск по типам: {', '.join(failed)}"
+        # Поиск не выполнен ни по одному типу - ошибка, как у thematic_search; по части типов - неполный результат
+        result["error" if len(failed) == len(types) else "partial"] = True
+    return result
+
+def search_cache_control(query: str, result: Dict[str, Any]) -> Optional[str]:
+    """
+    Cache-Control для результата тематического поиска. Успешный поиск по кадастровому
+    номеру кэшируется и на сервере, клиент может переиспользовать его NSPD_SEARCH_MAX_AGE
+    секунд. Для остальных результатов (текстовый поиск, ошибки) - None: они не кэшируются
+    """
+    if NSPD_SEARCH_MAX_AGE <= 0 or not analyze_query(query).is_cadastral:
+        return None
+    # Поле thematic_search есть только в успешном ответе thematic_search
+    if not isinstance(result, dict) or "thematic_search" not in result or result.get("fallback"):
+        return None
+    return f"public, max-age={NSPD_SEARCH_MAX_AGE}"
+
 def get_fallback_response() -> Dict[str, Any]:
     """
     Возвращает заглушку с пустыми данными в формате FeatureCollection,
@@ -519,4 +866,141 @@ def get_fallback_response() -> Dict[str, Any]:
         "features": [],
         "fallback": True,
         "message": "Данные НСПД в настоящее время недоступны. Пожалуйста, попробуйте позже."
-    } 
\ No newline at end of file
+    } 
+# Слои nspd_{тип}: данные НСПД для экрана собираются из тайлов фиксированной сетки
+# уровня NSPD_TILE_ZOOM. Каждый тайл кэшируется отдельно на NSPD_TILE_TTL секунд,
+# поэтому при перемещении карты запрашиваются только новые тайлы.
+# NSPD_TILE_URL - адрес API выборки объектов по прямоугольнику (bbox в EPSG:3857)
+NSPD_TILE_URL = os.getenv("NSPD_TILE_URL", NSPD_SEARCH_URL)
+NSPD_TILE_ZOOM = int(os.getenv("NSPD_TILE_ZOOM", "14"))
+NSPD_TILE_TTL = int(os.getenv("NSPD_TILE_TTL", str(NSPD_CACHE_TTL)))
+NSPD_LAYER_MAX_TILES = int(os.getenv("NSPD_LAYER_MAX_TILES", "16"))
+# Сколько объектов запрашивается на тайл; ответ ровно такого размера считается обрезанным
+NSPD_TILE_LIMIT = int(os.getenv("NSPD_TILE_LIMIT", "200"))
+
+# Кэш тайлов слоев НСПД (бэкенд выбирается через CACHE_BACKEND_NSPD_TILES или CACHE_BACKEND)
+nspd_tile_cache = get_cache_backend("nspd_tiles")
+
+# Потоки для параллельной загрузки тайлов; общий лимит частоты запросов сохраняется
+_tile_executor = ThreadPoolExecutor(max_workers=int(os.getenv("NSPD_TILE_POOL_SIZE", "4")),
+                                    thread_name_prefix="nspd-tile")
+# Загружаемые сейчас тайлы: одновременные запросы одного тайла ждут одну загрузку
+_tile_inflight: Dict[str, Future] = {}
+_tile_inflight_lock = threading.Lock()
+
+
+def _fetch_nspd_tile(thematic_type: str, tile: Tile) -> Dict[str, Any]:
+    """
+    Загружает объекты НСПД в тайле и кладет их в кэш тайлов. Признак truncated
+    означает, что НСПД вернул NSPD_TILE_LIMIT объектов и в тайле могут быть еще
+    """
+    min_x, min_y, max_x, max_y = tile_bbox_mercator(*tile)
+    params = {
+        "thematicSearchId": THEMATIC_SEARCH_MAPPING[thematic_type],
+        "bbox": f"{min_x},{min_y},{max_x},{max_y}",
+        "limit": NSPD_TILE_LIMIT,
+    }
+    result = make_nspd_request(NSPD_TILE_URL, params)
+    # Ответ с сообщением об ошибке запроса - не пустой тайл, а неудачная загрузка
+    if "message" in result and not result.get("features"):
+        raise ValueError(result["message"])
+    raw_features = result.get("features") or []
+    truncated = len(raw_features) >= NSPD_TILE_LIMIT
+    # В тайл попадают только объекты, пересекающиеся с ним: так результат не зависит
+    # от того, насколько точно API НСПД учитывает bbox
+    bbox = tile_bbox(*tile)
+    features = []
+    for feature in raw_features:
+        feature_bbox = geometry_bbox(feature.get("geometry"))
+        if feature_bbox is None:
+            continue
+        if feature_bbox[0] > bbox[2] or feature_bbox[2] < bbox[0] or feature_bbox[1] > bbox[3] or feature_bbox[3] < bbox[1]:
+            continue
+        features.append(convert_nspd_feature(feature))
+    loaded = {"features": features, "truncated": truncated}
+    z, x, y = tile
+    nspd_tile_cache.set(f"{thematic_type}:{z}/{x}/{y}", loaded, ttl=NSPD_TILE_TTL)
+    return loaded
+
+
+def _load_nspd_tile(thematic_type: str, tile: Tile) -> Future:
+    """Запускает загрузку тайла или возвращает уже идущую загрузку того же тайла"""
+    key = f"{thematic_type}:{tile[0]}/{tile[1]}/{tile[2]}"
+    with _tile_inflight_lock:
+        future = _tile_inflight.get(key)
+        if future is None:
+            future = _tile_executor.submit(_fetch_nspd_tile, thematic_type, tile)
+            _tile_inflight[key] = future
+            future.add_done_callback(lambda _: _tile_inflight.pop(key, None))
+    return future
+
+
+def get_nspd_layer(thematic_type: str, bbox: List[float]) -> Dict[str, Any]:
+    """
+    Объекты слоя НСПД в прямоугольнике bbox = [min_lng, min_lat, max_lng, max_lat].
+    Прямоугольник разбивается на тайлы уровня NSPD_TILE_ZOOM, тайлы из кэша
+    используются сразу, недостающие загружаются параллельно. Если часть тайлов
+    загрузить не удалось, отдаются остальные с признаком partial
+    """
+    if thematic_type not in THEMATIC_SEARCH_MAPPING:
+        return {
+            "type": "FeatureCollection",
+            "features": [],
+            "message": f"Неизвестный тип тематического поиска: {thematic_type}"
+        }
+    # Размер области проверяется по угловым тайлам до построения списка тайлов
+    if count_tiles_for_bbox(bbox, NSPD_TILE_ZOOM) > NSPD_LAYER_MAX_TILES:
+        return {
+            "type": "FeatureCollection",
+            "features": [],
+            "message": "Слишком большая область для загрузки данных НСПД. Приблизьте карту."
+        }
+    tiles = tiles_for_bbox(bbox, NSPD_TILE_ZOOM)
+    
+    tile_features: Dict[Tile, List[Dict[str, Any]]] = {}
+    pending: Dict[Tile, Future] = {}
+    truncated = 0
+    for tile in tiles:
+        cached = nspd_tile_cache.get(f"{thematic_type}:{tile[0]}/{tile[1]}/{tile[2]}")
+        if cached is not None:
+            NSPD_CACHE_REQUESTS.labels(result="tile_hit").inc()
+            tile_features[tile] = cached["features"]
+            if cached.get("truncated"):
+                truncated += 1
+        else:
+            NSPD_CACHE_REQUESTS.labels(result="tile_miss").inc()
+            pending[tile] = _load_nspd_tile(thematic_type, tile)
+    
+    failed = 0
+    for tile, future in pending.items():
+        try:
+            loaded = future.result()
+            tile_features[tile] = loaded["features"]
+            if loaded["truncated"]:
+                truncated += 1
+        except Exception as e:
+            failed += 1
+            logger.warning(f"Не удалось загрузить тайл {tile} слоя НСПД {thematic_type}: {str(e)}")
+    
+    # Объект на границе тайлов попадает в несколько тайлов - оставляем один экземпляр
+    features = []
+    seen = set()
+    for tile in tiles:
+        for feature in tile_features.get(tile, []):
+            feature_id = feature.get("id")
+            if feature_id is not None:
+                if feature_id in seen:
+                    continue
+                seen.add(feature_id)
+            features.append(feature)
+    
+    result = {"type": "FeatureCollection", "features": features}
+    problems = []
+    if failed:
+        problems.append(f"не получено тайлов {failed} из {len(tiles)}")
+    if truncated:
+        problems.append(f"в тайлах {truncated} из {len(tiles)} получено по {NSPD_TILE_LIMIT} объектов (лимит), приблизьте карту")
+    if problems:
+        result["partial"] = True
+        result["message"] = f"Данные НСПД загружены не полностью: {'; '.join(problems)}"
+    return result
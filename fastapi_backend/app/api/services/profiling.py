@@ -0,0 +1,262 @@
+import os
+import sys
+import hmac
+import json
+import time
+import uuid
+import logging
+import tempfile
+import threading
+import tracemalloc
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Профилирование отдельных запросов для администраторов. Без токена выключено
+# полностью (middleware не подключается). Запрос профилируется, если в заголовке
+# PROFILE_HEADER передан этот токен. Параметр строки запроса не поддерживается:
+# строка запроса попадает в журналы доступа nginx, а с ней и токен
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_HEADER = "X-Profile"
+# Интервал сэмплирования стеков, с
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))
+# Глубина стека, сохраняемая tracemalloc для каждого выделения памяти
+PROFILE_TRACEMALLOC_FRAMES = int(os.getenv("PROFILE_TRACEMALLOC_FRAMES", "1"))
+# Сколько строк выводить в отчете (функции, стеки, места выделения памяти)
+PROFILE_TOP = int(os.getenv("PROFILE_TOP", "30"))
+# Отчеты сохраняются в файлы, чтобы их мог отдать любой воркер; хранятся последние PROFILE_MAX_REPORTS
+PROFILE_DIR = Path(os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "mgis_profiles")))
+PROFILE_MAX_REPORTS = int(os.getenv("PROFILE_MAX_REPORTS", "50"))
+
+# Код приложения: в отчет попадают только стеки потоков, выполняющих его
+# (поиск в НСПД, загрузка слоев и т.д.), простаивающие потоки отбрасываются
+APP_DIR = str(Path(__file__).resolve().parents[2])
+BACKEND_DIR = os.path.dirname(APP_DIR)
+
+# tracemalloc и сэмплер общие для процесса, поэтому профилируется один запрос за раз
+_profile_lock = threading.Lock()
+_current: Optional["RequestProfiler"] = None
+# Запросы в обработке (считаются, только если профилирование включено)
+_in_flight = 0
+
+
+def track_request_start() -> None:
+    """Учитывает начало запроса: одновременные запросы попадают в профиль и отмечаются в отчете"""
+    global _in_flight
+    _in_flight += 1
+    if _current is not None:
+        _current.concurrent_requests += 1
+
+
+def track_request_end() -> None:
+    global _in_flight
+    _in_flight -= 1
+
+
+def profile_requested(header: Optional[str]) -> bool:
+    """Запрошено ли профилирование: токен из заголовка совпадает с PROFILE_TOKEN"""
+    if not PROFILE_TOKEN:
+        return False
+    return header is not None and hmac.compare_digest(header.encode("utf-8"), PROFILE_TOKEN.encode("utf-8"))
+
+
+def _frame_label(code) -> str:
+    filename = code.co_filename
+    if filename.startswith(BACKEND_DIR):
+        filename = os.path.relpath(filename, BACKEND_DIR)
+    else:
+        filename = os.path.basename(filename)
+    return f"{filename}:{code.co_name}"
+
+
+class _StackSampler:
+    """Сэмплирующий профайлер: раз в interval снимает стеки всех потоков процесса"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.samples = 0
+        self.stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            self.samples += 1
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                in_app = False
+                while frame is not None:
+                    code = frame.f_code
+                    in_app = in_app or code.co_filename.startswith(APP_DIR)
+                    stack.append(code)
+                    frame = frame.f_back
+                if in_app:
+                    self.stacks[tuple(reversed(stack))] += 1
+
+    def report(self) -> Dict[str, Any]:
+        """Функции по времени (включая вызванные и собственное) и самые частые стеки"""
+        total: Counter = Counter()
+        own: Counter = Counter()
+        collapsed: Counter = Counter()
+        for stack, count in self.stacks.items():
+            labels = [_frame_label(code) for code in stack]
+            for label in set(labels):
+                total[label] += count
+            own[labels[-1]] += count
+            collapsed[";".join(labels)] += count
+        return {
+            "samples": self.samples,
+            "interval": self.interval,
+            "functions": [
+                {"function": label, "total": count, "self": own[label]}
+                for label, count in total.most_common(PROFILE_TOP)
+            ],
+            # Все стеки в формате collapsed stacks (flamegraph.pl, speedscope)
+            "stacks": [{"stack": stack, "count": count} for stack, count in collapsed.most_common()],
+        }
+
+
+class RequestProfiler:
+    """
+    Профиль одного запроса: сэмплы стеков потоков, выполняющих код приложения
+    (в том числе пулы потоков НСПД), и выделения памяти по данным tracemalloc.
+    Стеки собираются со всего процесса: запросы, выполнявшиеся одновременно
+    с профилируемым, тоже попадают в отчет (их число указано в concurrent_requests)
+    """
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex[:16]
+        self._sampler = _StackSampler(PROFILE_SAMPLE_INTERVAL)
+        self._started_tracemalloc = False
+        self._snapshot: Optional[tracemalloc.Snapshot] = None
+        self._started_at = 0.0
+        self._start = 0.0
+        self.concurrent_requests = 0
+
+    @classmethod
+    def acquire(cls) -> Optional["RequestProfiler"]:
+        """Новый профайлер или None, если уже профилируется другой запрос"""
+        if not _profile_lock.acquire(blocking=False):
+            return None
+        return cls()
+
+    def start(self) -> None:
+        global _current
+        # Сам профилируемый запрос уже учтен в _in_flight
+        self.concurrent_requests = max(0, _in_flight - 1)
+        try:
+            self._started_tracemalloc = not tracemalloc.is_tracing()
+            if self._started_tracemalloc:
+                tracemalloc.start(PROFILE_TRACEMALLOC_FRAMES)
+            tracemalloc.reset_peak()
+            self._snapshot = tracemalloc.take_snapshot()
+        except Exception:
+            _profile_lock.release()
+            raise
+        _current = self
+        self._started_at = time.time()
+        self._start = time.perf_counter()
+        self._sampler.start()
+
+    def _memory_report(self) -> Dict[str, Any]:
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        filters = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen importlib._bootstrap>")]
+        diff = snapshot.filter_traces(filters).compare_to(self._snapshot.filter_traces(filters), "lineno")
+        top: List[Dict[str, Any]] = []
+        for stat in diff[:PROFILE_TOP]:
+            frame = stat.traceback[0]
+            filename = os.path.relpath(frame.filename, BACKEND_DIR) if frame.filename.startswith(BACKEND_DIR) else frame.filename
+            top.append({
+                "location": f"{filename}:{frame.lineno}",
+                "size_diff": stat.size_diff,
+                "count_diff": stat.count_diff,
+                "size": stat.size,
+            })
+        return {
+            "peak_bytes": peak,
+            "current_bytes": current,
+            # Память, выделенная за время запроса и еще не освобожденная к его концу
+            "retained_bytes": sum(stat.size_diff for stat in diff if stat.size_diff > 0),
+            # tracemalloc был включен до запроса: peak включает ранее выделенную память
+            "tracing_before_request": not self._started_tracemalloc,
+            "top": top,
+        }
+
+    def finish(self, method: str, path: str, query: str, status_code: int) -> Dict[str, Any]:
+        """Останавливает профилирование, сохраняет отчет и возвращает его"""
+        global _current
+        duration = time.perf_counter() - self._start
+        _current = None
+        try:
+            self._sampler.stop()
+            memory = self._memory_report()
+        finally:
+            if self._started_tracemalloc:
+                tracemalloc.stop()
+            _profile_lock.release()
+        report = {
+            "id": self.id,
+            "method": method,
+            "path": path,
+            "query": query,
+            "status": status_code,
+            "started_at": self._started_at,
+            "duration": duration,
+            "concurrent_requests": self.concurrent_requests,
+            "cpu": self._sampler.report(),
+            "memory": memory,
+        }
+        save_report(report)
+        return report
+
+
+def _report_path(report_id: str) -> Optional[Path]:
+    # id - шестнадцатеричная строка: не даем выйти за пределы каталога отчетов
+    if not report_id or not all(c in "0123456789abcdef" for c in report_id):
+        return None
+    return PROFILE_DIR / f"{report_id}.json"
+
+
+def save_report(report: Dict[str, Any]) -> None:
+    """Сохраняет отчет и удаляет самые старые, если их больше PROFILE_MAX_REPORTS"""
+    try:
+        PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+        path = _report_path(report["id"])
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        reports = sorted(PROFILE_DIR.glob("*.json"), key=lambda p: p.stat().st_mtime)
+        for old in reports[:-PROFILE_MAX_REPORTS]:
+            old.unlink()
+    except OSError as e:
+        logger.warning(f"Не удалось сохранить отчет профилирования {report['id']}: {str(e)}")
+
+
+def load_report(report_id: str) -> Optional[Dict[str, Any]]:
+    path = _report_path(report_id)
+    if path is None:
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+def collapsed_stacks(report: Dict[str, Any]) -> str:
+    """Стеки отчета в текстовом формате collapsed stacks: "a;b;c число_сэмплов" на строку"""
+    return "".join(f"{item['stack']} {item['count']}\n" for item in report["cpu"]["stacks"])
@@ -0,0 +1,217 @@
+import os
+import time
+import asyncio
+import logging
+import ipaddress
+import threading
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, Optional
+
+from fastapi import HTTPException
+
+from app.api.services.metrics import ADMISSION_DECISIONS, ADMISSION_QUEUE_WAIT
+from app.api.services.cancellation import CancelToken
+
+logger = logging.getLogger(__name__)
+
+# Адреса и сети прокси (nginx), которым доверяется заголовок X-Real-IP, через запятую.
+# От остальных адресов заголовок игнорируется: иначе клиент мог бы подставлять
+# в него произвольный адрес и обходить ограничение числа запросов на клиента
+TRUSTED_PROXIES = [
+    ipaddress.ip_network(value.strip(), strict=False)
+    for value in os.getenv("TRUSTED_PROXIES", "127.0.0.1,::1").split(",") if value.strip()
+]
+
+
+def is_trusted_proxy(address: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in TRUSTED_PROXIES)
+
+
+class TokenBucket:
+    """
+    Ограничитель частоты запросов "token bucket": rate запросов в секунду
+    в среднем и до burst запросов подряд.
+
+    Ожидающие резервируют токены в порядке очереди, поэтому время ожидания
+    известно заранее и запрос, который не успеет в свой бюджет, отклоняется сразу
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def reserve(self, max_wait: float) -> Optional[float]:
+        """
+        Резервирует токен и возвращает, сколько секунд нужно подождать до запроса.
+        Если ждать пришлось бы дольше max_wait, токен не резервируется и возвращается None
+        """
+        if not self.enabled:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+            if wait > max_wait:
+                return None
+            self.tokens -= 1
+            return wait
+
+    def acquire(self, max_wait: float, cancel: Optional[CancelToken] = None) -> bool:
+        """
+        Блокирующее получение токена; False, если токен не получить за max_wait секунд.
+        Ожидание прерывается отменой запроса cancel (RequestCancelled)
+        """
+        wait = self.reserve(max_wait)
+        if wait is None:
+            return False
+        if wait > 0:
+            if cancel is not None:
+                cancel.sleep(wait, "rate_limit")
+            else:
+                time.sleep(wait)
+        return True
+
+    def try_acquire(self) -> bool:
+        """Получает токен, только если он доступен сразу"""
+        return self.reserve(0.0) is not None
+
+
+class AdmissionController:
+    """
+    Контроль допуска запросов к эндпоинту, обращающемуся к внешнему API.
+
+    Одновременно выполняется не больше max_concurrent запросов, остальные ждут
+    в очереди (FIFO) длиной до max_queue. Один клиент может занимать не больше
+    per_client запросов (выполняемых и ожидающих). Запрос отклоняется сразу,
+    если очередь заполнена или ожидаемое время ожидания (по средней
+    длительности запроса) превышает queue_timeout
+    """
+
+    def __init__(self, name: str, max_concurrent: int, max_queue: int, per_client: int,
+                 queue_timeout: float):
+        self.name = name
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max_queue
+        self.per_client = per_client
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.clients: Dict[str, int] = {}
+        # Скользящее среднее длительности запроса для оценки времени ожидания
+        self.avg_duration = 1.0
+        # Ожидающие запросы; future может принадлежать любому циклу событий
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._lock = threading.Lock()
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def estimated_wait(self) -> float:
+        """Оценка времени ожидания для нового запроса в очереди"""
+        if self.active < self.max_concurrent:
+            return 0.0
+        return (self.waiting + 1) / self.max_concurrent * self.avg_duration
+
+    def _reject(self, outcome: str, status_code: int, detail: str, retry_after: float) -> None:
+        ADMISSION_DECISIONS.labels(endpoint=self.name, outcome=outcome).inc()
+        logger.warning(f"Запрос к {self.name} отклонен ({outcome}): {detail}")
+        raise HTTPException(
+            status_code=status_code,
+            detail=detail,
+            headers={"Retry-After": str(max(1, round(retry_after)))}
+        )
+
+    def _enter(self, client_id: str) -> Optional[asyncio.Future]:
+        """Занимает слот сразу или ставит запрос в очередь (возвращает future ожидания)"""
+        with self._lock:
+            if self.per_client > 0 and self.clients.get(client_id, 0) >= self.per_client:
+                self._reject("client_limit", 429,
+                             "Слишком много одновременных запросов. Дождитесь завершения предыдущих.",
+                             self.avg_duration)
+            waiter = None
+            if self.active < self.max_concurrent and not self._waiters:
+                self.active += 1
+            else:
+                if self.waiting >= self.max_queue:
+                    self._reject("queue_full", 503, "Сервис перегружен, попробуйте позже", self.estimated_wait())
+                if self.estimated_wait() > self.queue_timeout:
+                    self._reject("deadline", 503, "Сервис перегружен, попробуйте позже", self.estimated_wait())
+                waiter = asyncio.get_running_loop().create_future()
+                self._waiters.append(waiter)
+            self.clients[client_id] = self.clients.get(client_id, 0) + 1
+            return waiter
+
+    def _release(self, client_id: str, duration: Optional[float]) -> None:
+        """Освобождает слот клиента и передает его первому ожидающему"""
+        with self._lock:
+            remaining = self.clients.get(client_id, 1) - 1
+            if remaining > 0:
+                self.clients[client_id] = remaining
+            else:
+                self.clients.pop(client_id, None)
+            if duration is None:
+                return
+            self.avg_duration = 0.8 * self.avg_duration + 0.2 * duration
+            self.active -= 1
+            self._grant_next()
+
+    def _abandon(self, waiter: asyncio.Future) -> None:
+        """Ожидающий запрос ушел по таймауту или отмене"""
+        with self._lock:
+            try:
+                self._waiters.remove(waiter)
+            except ValueError:
+                # Слот уже был передан этому запросу - возвращаем его
+                self.active -= 1
+                self._grant_next()
+
+    def _grant_next(self) -> None:
+        # Слот переходит ожидающему сразу, чтобы его не занял новый запрос
+        while self._waiters and self.active < self.max_concurrent:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.active += 1
+                waiter.get_loop().call_soon_threadsafe(_grant, waiter)
+
+    @asynccontextmanager
+    async def admit(self, client_id: str):
+        """Допускает запрос клиента или отклоняет его с 429/503 и заголовком Retry-After"""
+        queued_at = time.monotonic()
+        waiter = self._enter(client_id)
+        started = None
+        try:
+            if waiter is not None:
+                try:
+                    await asyncio.wait_for(asyncio.shield(waiter), timeout=self.queue_timeout)
+                except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+                    self._abandon(waiter)
+                    if isinstance(e, asyncio.CancelledError):
+                        raise
+                    self._reject("timeout", 503, "Сервис перегружен, попробуйте позже", self.avg_duration)
+            ADMISSION_QUEUE_WAIT.labels(endpoint=self.name).observe(time.monotonic() - queued_at)
+            ADMISSION_DECISIONS.labels(endpoint=self.name, outcome="admitted").inc()
+            started = time.monotonic()
+            yield
+        finally:
+            self._release(client_id, None if started is None else time.monotonic() - started)
+
+
+def _grant(waiter: asyncio.Future) -> None:
+    if not waiter.done():
+        waiter.set_result(True)
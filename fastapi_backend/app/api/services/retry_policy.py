@@ -0,0 +1,142 @@
+import os
+import time
+import random
+import logging
+import threading
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class RetryPolicy:
+    """
+    Политика повторных запросов к внешнему API:
+    общий бюджет времени на запрос пользователя, таймаут одной попытки,
+    экспоненциальная задержка со случайным разбросом и хеджирование
+    """
+
+    def __init__(self, deadline: float = 15.0, attempt_timeout: float = 8.0, max_attempts: int = 3,
+                 backoff_base: float = 0.25, backoff_max: float = 2.0, hedge_delay: float = 0.0,
+                 min_attempt_timeout: float = 0.5):
+        self.deadline = deadline
+        self.attempt_timeout = attempt_timeout
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        # Через сколько секунд без ответа отправлять параллельный (хеджирующий) запрос; 0 - не отправлять
+        self.hedge_delay = hedge_delay
+        # Попытку с меньшим оставшимся временем не начинаем
+        self.min_attempt_timeout = min_attempt_timeout
+
+    @classmethod
+    def from_env(cls, prefix: str) -> "RetryPolicy":
+        """Создает политику из переменных окружения <PREFIX>_DEADLINE, <PREFIX>_ATTEMPT_TIMEOUT и т.д."""
+        defaults = cls()
+
+        def env_float(name: str, default: float) -> float:
+            return float(os.getenv(f"{prefix}_{name}", default))
+
+        return cls(
+            deadline=env_float("DEADLINE", defaults.deadline),
+            attempt_timeout=env_float("ATTEMPT_TIMEOUT", defaults.attempt_timeout),
+            max_attempts=int(env_float("MAX_ATTEMPTS", defaults.max_attempts)),
+            backoff_base=env_float("BACKOFF_BASE", defaults.backoff_base),
+            backoff_max=env_float("BACKOFF_MAX", defaults.backoff_max),
+            hedge_delay=env_float("HEDGE_DELAY", defaults.hedge_delay),
+            min_attempt_timeout=env_float("MIN_ATTEMPT_TIMEOUT", defaults.min_attempt_timeout),
+        )
+
+    def backoff(self, attempt: int) -> float:
+        """Задержка перед следующей попыткой ("full jitter"): случайное значение от 0 до base * 2^attempt"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+
+class Deadline:
+    """Оставшийся бюджет времени на запрос"""
+
+    def __init__(self, seconds: float):
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Разбирает заголовок Retry-After (секунды или HTTP-дата) в секунды ожидания"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at is None:
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+class CircuitBreaker:
+    """
+    Автоматический выключатель для внешнего API.
+
+    Считает только отказы самого сервиса (таймауты, ошибки соединения, 5xx, 429).
+    После failure_threshold отказов подряд переходит в состояние open и сразу
+    отклоняет запросы; через recovery_timeout пропускает один пробный запрос
+    (half_open), успех которого снова замыкает цепь
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self._probe_started_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.recovery_timeout:
+                self.state = self.HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == self.HALF_OPEN:
+                # Пробный запрос мог потеряться - через recovery_timeout разрешаем новый
+                probe_stale = time.monotonic() - self._probe_started_at >= self.recovery_timeout
+                if not self._probe_in_flight or probe_stale:
+                    self._probe_in_flight = True
+                    self._probe_started_at = time.monotonic()
+                    return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info("Circuit breaker: внешний API снова доступен")
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning(f"Circuit breaker: внешний API недоступен, запросы приостановлены на {self.recovery_timeout} с")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self._probe_in_flight = False
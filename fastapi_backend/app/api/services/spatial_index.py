@@ -0,0 +1,247 @@
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+BBox = Tuple[float, float, float, float]  # (min_x, min_y, max_x, max_y)
+Ring = List[List[float]]  # Кольцо в виде исходного списка координат GeoJSON
+
+# Число дочерних элементов в узле R-дерева
+NODE_CAPACITY = 16
+
+
+def geometry_polygons(geometry: Optional[Dict[str, Any]]) -> List[List[Ring]]:
+    """
+    Возвращает полигоны геометрии (Polygon/MultiPolygon) как списки колец.
+    Координаты не копируются, чтобы индекс большого слоя не удваивал потребление памяти
+    """
+    if not isinstance(geometry, dict):
+        return []
+    geo_type = geometry.get("type")
+    coords = geometry.get("coordinates") or []
+    if geo_type == "Polygon":
+        polygons = [coords]
+    elif geo_type == "MultiPolygon":
+        polygons = coords
+    else:
+        return []
+    if not isinstance(polygons, list) or not all(isinstance(rings, list) for rings in polygons):
+        return []
+    return polygons
+
+
+def geometry_bbox(geometry: Optional[Dict[str, Any]]) -> Optional[BBox]:
+    """Экстент любой геометрии GeoJSON"""
+    if not isinstance(geometry, dict):
+        return None
+    if geometry.get("type") == "GeometryCollection":
+        boxes = [b for b in (geometry_bbox(g) for g in geometry.get("geometries", [])) if b]
+        if not boxes:
+            return None
+        return (min(b[0] for b in boxes), min(b[1] for b in boxes),
+                max(b[2] for b in boxes), max(b[3] for b in boxes))
+    xs, ys = [], []
+
+    def walk(coords):
+        if coords and isinstance(coords[0], (int, float)):
+            xs.append(coords[0])
+            ys.append(coords[1])
+        else:
+            for c in coords:
+                walk(c)
+
+    try:
+        walk(geometry.get("coordinates") or [])
+    except (TypeError, IndexError):
+        return None
+    if not xs:
+        return None
+    return (min(xs), min(ys), max(xs), max(ys))
+
+
+def point_in_ring(x: float, y: float, ring: Ring) -> bool:
+    """Проверка точки в кольце методом трассировки луча"""
+    inside = False
+    n = len(ring)
+    if n < 3:
+        return False
+    x1, y1 = ring[-1][0], ring[-1][1]
+    for p in ring:
+        x2, y2 = p[0], p[1]
+        if (y2 > y) != (y1 > y):
+            cross_x = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+            if x < cross_x:
+                inside = not inside
+        x1, y1 = x2, y2
+    return inside
+
+
+def point_in_polygons(x: float, y: float, polygons: List[List[Ring]]) -> bool:
+    """Точка внутри внешнего кольца одного из полигонов и вне его дыр"""
+    for rings in polygons:
+        if rings and point_in_ring(x, y, rings[0]) and not any(point_in_ring(x, y, hole) for hole in rings[1:]):
+            return True
+    return False
+
+
+def _segment_intersects_bbox(x1: float, y1: float, x2: float, y2: float, bbox: BBox) -> bool:
+    """Пересекает ли отрезок прямоугольник (отсечение Лианга-Барски)"""
+    t0, t1 = 0.0, 1.0
+    dx, dy = x2 - x1, y2 - y1
+    for p, q in ((-dx, x1 - bbox[0]), (dx, bbox[2] - x1), (-dy, y1 - bbox[1]), (dy, bbox[3] - y1)):
+        if p == 0:
+            if q < 0:
+                return False
+        else:
+            t = q / p
+            if p < 0:
+                t0 = max(t0, t)
+            else:
+                t1 = min(t1, t)
+            if t0 > t1:
+                return False
+    return True
+
+
+def polygons_intersect_bbox(polygons: List[List[Ring]], bbox: BBox) -> bool:
+    """Пересекаются ли полигоны с прямоугольником"""
+    cx, cy = (bbox[0] + bbox[2]) / 2, (bbox[1] + bbox[3]) / 2
+    # Прямоугольник целиком внутри полигона
+    if point_in_polygons(cx, cy, polygons):
+        return True
+    for rings in polygons:
+        for ring in rings:
+            for i in range(1, len(ring)):
+                if _segment_intersects_bbox(ring[i - 1][0], ring[i - 1][1], ring[i][0], ring[i][1], bbox):
+                    return True
+    return False
+
+
+def representative_point(geometry: Optional[Dict[str, Any]]) -> Optional[Tuple[float, float]]:
+    """
+    Точка, по которой объект привязывается к полигонам слоя: сама точка,
+    центроид внешнего кольца полигона (если он внутри) или центр экстента
+    """
+    if not isinstance(geometry, dict):
+        return None
+    geo_type = geometry.get("type")
+    coords = geometry.get("coordinates")
+    try:
+        if geo_type == "Point":
+            return (coords[0], coords[1])
+        if geo_type == "MultiPoint" and coords:
+            return (coords[0][0], coords[0][1])
+    except (TypeError, IndexError):
+        return None
+
+    polygons = geometry_polygons(geometry)
+    if polygons and polygons[0] and len(polygons[0][0]) >= 3:
+        ring = polygons[0][0]
+        area = cx = cy = 0.0
+        for p1, p2 in zip(ring, ring[1:] + ring[:1]):
+            x1, y1, x2, y2 = p1[0], p1[1], p2[0], p2[1]
+            cross = x1 * y2 - x2 * y1
+            area += cross
+            cx += (x1 + x2) * cross
+            cy += (y1 + y2) * cross
+        if area:
+            point = (cx / (3 * area), cy / (3 * area))
+            if point_in_polygons(point[0], point[1], polygons):
+                return point
+    bbox = geometry_bbox(geometry)
+    if bbox is None:
+        return None
+    return ((bbox[0] + bbox[2]) / 2, (bbox[1] + bbox[3]) / 2)
+
+
+def _bbox_intersects(a: BBox, b: BBox) -> bool:
+    return a[0] <= b[2] and a[2] >= b[0] and a[1] <= b[3] and a[3] >= b[1]
+
+
+def _ring_bbox(ring: Ring) -> BBox:
+    xs = [p[0] for p in ring]
+    ys = [p[1] for p in ring]
+    return (min(xs), min(ys), max(xs), max(ys))
+
+
+def _union(boxes: Sequence[BBox]) -> BBox:
+    return (min(b[0] for b in boxes), min(b[1] for b in boxes),
+            max(b[2] for b in boxes), max(b[3] for b in boxes))
+
+
+class STRTree:
+    """
+    Статическое R-дерево, упакованное методом Sort-Tile-Recursive.
+    Строится один раз по экстентам объектов и отвечает на запросы по прямоугольнику
+    """
+
+    def __init__(self, items: List[Tuple[BBox, int]], capacity: int = NODE_CAPACITY):
+        self.capacity = capacity
+        self.size = len(items)
+        # Узел: (экстент, является ли листом, дети - индексы объектов или узлы)
+        self.root = self._build([(bbox, value) for bbox, value in items], leaf=True) if items else None
+
+    def _build(self, entries: List[Tuple[BBox, Any]], leaf: bool):
+        nodes = []
+        count = len(entries)
+        slices = max(1, int((count / self.capacity) ** 0.5 + 0.999))
+        per_slice = self.capacity * slices
+        entries = sorted(entries, key=lambda e: e[0][0] + e[0][2])
+        for i in range(0, count, per_slice):
+            column = sorted(entries[i:i + per_slice], key=lambda e: e[0][1] + e[0][3])
+            for j in range(0, len(column), self.capacity):
+                group = column[j:j + self.capacity]
+                nodes.append((_union([e[0] for e in group]), leaf, group))
+        if len(nodes) == 1:
+            return nodes[0]
+        return self._build([(node[0], node) for node in nodes], leaf=False)
+
+    def query(self, bbox: BBox) -> Iterator[int]:
+        """Значения объектов, экстент которых пересекается с bbox"""
+        if self.root is None:
+            return
+        stack = [self.root]
+        while stack:
+            node_bbox, leaf, children = stack.pop()
+            if not _bbox_intersects(node_bbox, bbox):
+                continue
+            for child_bbox, child in children:
+                if not _bbox_intersects(child_bbox, bbox):
+                    continue
+                if leaf:
+                    yield child
+                else:
+                    stack.append(child)
+
+
+class PolygonLayerIndex:
+    """
+    Подготовленный пространственный индекс полигонального слоя:
+    R-дерево по экстентам и заранее разобранные кольца для точной проверки
+    """
+
+    def __init__(self, features: List[Dict[str, Any]]):
+        self.features = features
+        self.polygons: Dict[int, List[List[Ring]]] = {}
+        items = []
+        for i, feature in enumerate(features):
+            if not isinstance(feature, dict):
+                continue
+            polygons = geometry_polygons(feature.get("geometry"))
+            if not polygons:
+                continue
+            outer_rings = [rings[0] for rings in polygons if rings and rings[0]]
+            if not outer_rings:
+                continue
+            bbox = _union([_ring_bbox(ring) for ring in outer_rings])
+            self.polygons[i] = polygons
+            items.append((bbox, i))
+        self.tree = STRTree(items)
+
+    def __len__(self) -> int:
+        return len(self.polygons)
+
+    def query_point(self, x: float, y: float) -> List[int]:
+        """Индексы полигонов, содержащих точку"""
+        return [i for i in self.tree.query((x, y, x, y)) if point_in_polygons(x, y, self.polygons[i])]
+
+    def query_bbox(self, bbox: BBox) -> List[int]:
+        """Индексы полигонов, пересекающихся с прямоугольником"""
+        return [i for i in self.tree.query(bbox) if polygons_intersect_bbox(self.polygons[i], bbox)]
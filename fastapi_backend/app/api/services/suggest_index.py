@@ -0,0 +1,163 @@
+import os
+import bisect
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from app.api.services.spatial_index import geometry_bbox
+
+# Сколько записей из ответов НСПД хранить в индексе подсказок (старые вытесняются)
+SUGGEST_MAX_NSPD_ENTRIES = int(os.getenv("SUGGEST_MAX_NSPD_ENTRIES", "20000"))
+# С какого по счету слова названия еще ищется совпадение префикса
+SUGGEST_MAX_WORDS = 8
+# Сколько кандидатов просматривается для ранжирования подсказок
+SUGGEST_MAX_CANDIDATES = 200
+
+
+def normalize_text(text: str) -> str:
+    """Приводит текст к виду для поиска по префиксу: нижний регистр, ё -> е, одиночные пробелы"""
+    return " ".join(str(text).lower().replace("ё", "е").split())
+
+
+class PrefixIndex:
+    """
+    Индекс подсказок по префиксу: отсортированный массив ключей и двоичный поиск.
+    Ключи - название целиком и его окончания, начиная с каждого слова, поэтому
+    "тест" находит "ул. Тестовая". Записи сгруппированы по источникам: источник
+    можно целиком заменить (новая версия слоя), у источника nspd старые записи вытесняются
+    """
+
+    def __init__(self, max_nspd_entries: int = SUGGEST_MAX_NSPD_ENTRIES):
+        self.max_nspd_entries = max_nspd_entries
+        # Отсортированные пары (ключ, номер записи)
+        self._keys: List[Tuple[str, int]] = []
+        self._entries: Dict[int, Dict[str, Any]] = {}
+        self._entry_keys: Dict[int, List[str]] = {}
+        # Источник -> (идентификатор записи в источнике -> номер записи)
+        self._sources: Dict[str, "OrderedDict[Any, int]"] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def has_source(self, source: str) -> bool:
+        return source in self._sources
+
+    @staticmethod
+    def _keys_for(text: str) -> List[str]:
+        words = normalize_text(text).split(" ")
+        return [" ".join(words[i:]) for i in range(min(len(words), SUGGEST_MAX_WORDS)) if words[i]]
+
+    def _new_entry(self, text: str, entry: Dict[str, Any]) -> Tuple[int, List[str]]:
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries[entry_id] = dict(entry, text=text)
+        keys = self._keys_for(text)
+        self._entry_keys[entry_id] = keys
+        return entry_id, keys
+
+    def _remove_entry(self, entry_id: int) -> None:
+        for key in self._entry_keys.pop(entry_id, []):
+            i = bisect.bisect_left(self._keys, (key, entry_id))
+            if i < len(self._keys) and self._keys[i] == (key, entry_id):
+                del self._keys[i]
+        self._entries.pop(entry_id, None)
+
+    def add(self, source: str, ident: Any, text: str, entry: Dict[str, Any]) -> None:
+        """
+        Добавляет или обновляет запись источника. Источник, пополняемый по одной
+        записи (ответы НСПД), хранит не больше max_nspd_entries последних записей
+        """
+        if not text:
+            return
+        with self._lock:
+            records = self._sources.setdefault(source, OrderedDict())
+            old = records.pop(ident, None)
+            if old is not None:
+                self._remove_entry(old)
+            entry_id, keys = self._new_entry(text, entry)
+            records[ident] = entry_id
+            for key in keys:
+                bisect.insort(self._keys, (key, entry_id))
+            while len(records) > self.max_nspd_entries:
+                _, oldest = records.popitem(last=False)
+                self._remove_entry(oldest)
+
+    def replace_source(self, source: str, items: Iterable[Tuple[Any, str, Dict[str, Any]]]) -> None:
+        """Заменяет все записи источника (например, после загрузки новой версии слоя)"""
+        new_records: "OrderedDict[Any, int]" = OrderedDict()
+        new_keys = []
+        with self._lock:
+            for ident, text, entry in items:
+                if not text:
+                    continue
+                entry_id, keys = self._new_entry(text, entry)
+                new_records[ident] = entry_id
+                new_keys.extend((key, entry_id) for key in keys)
+            old_ids = set((self._sources.get(source) or {}).values())
+            for entry_id in old_ids:
+                self._entries.pop(entry_id, None)
+                self._entry_keys.pop(entry_id, None)
+            # Пересобираем массив ключей один раз вместо удаления по одному
+            kept = [item for item in self._keys if item[1] not in old_ids] if old_ids else self._keys
+            self._keys = sorted(kept + new_keys)
+            self._sources[source] = new_records
+
+    def search(self, prefix: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """
+        Записи, название которых (или одно из слов названия) начинается с prefix.
+        Сначала совпадения с начала названия, затем более короткие названия
+        """
+        prefix = normalize_text(prefix)
+        if not prefix:
+            return []
+        candidates: Dict[int, int] = {}
+        with self._lock:
+            i = bisect.bisect_left(self._keys, (prefix,))
+            while i < len(self._keys) and len(candidates) < SUGGEST_MAX_CANDIDATES:
+                key, entry_id = self._keys[i]
+                if not key.startswith(prefix):
+                    break
+                # Номер слова, с которого начинается совпадение (0 - с начала названия)
+                position = self._entry_keys[entry_id].index(key)
+                candidates[entry_id] = min(candidates.get(entry_id, position), position)
+                i += 1
+            ranked = sorted(candidates, key=lambda e: (candidates[e] > 0, len(self._entries[e]["text"]), e))
+            return [dict(self._entries[e]) for e in ranked[:limit]]
+
+
+# Общий индекс подсказок процесса: названия объектов статических слоев и ответов НСПД
+suggest_index = PrefixIndex()
+
+
+def index_nspd_features(features: List[Dict[str, Any]], thematic_search: str) -> None:
+    """Запоминает названия и адреса объектов из ответа НСПД для подсказок"""
+    for feature in features:
+        properties = feature.get("properties") or {}
+        feature_id = feature.get("id")
+        name = properties.get("name")
+        if feature_id is None or not name:
+            continue
+        entry = {"source": "nspd", "id": feature_id, "thematic_search": thematic_search,
+                 "bbox": geometry_bbox(feature.get("geometry"))}
+        suggest_index.add("nspd", (thematic_search, feature_id), str(name), entry)
+        address = properties.get("readable_address")
+        if address and address != name:
+            suggest_index.add("nspd", (thematic_search, feature_id, "address"), str(address),
+                              dict(entry, name=str(name)))
+
+
+def index_layer_features(layer_id: str, features: List[Any], field: str = "name") -> None:
+    """Заменяет подсказки слоя названиями его объектов (свойство field)"""
+    items = []
+    for position, feature in enumerate(features):
+        if not isinstance(feature, dict):
+            continue
+        name = (feature.get("properties") or {}).get(field)
+        if not name:
+            continue
+        entry: Dict[str, Optional[Any]] = {"source": layer_id, "id": feature.get("id", position),
+                                           "bbox": geometry_bbox(feature.get("geometry"))}
+        items.append((position, str(name), entry))
+    suggest_index.replace_source(layer_id, items)
@@ -0,0 +1,115 @@
+import os
+import math
+from typing import List, Optional, Tuple
+
+# Максимальный уровень масштаба тайлов
+MAX_TILE_ZOOM = 22
+# Сколько тайлов прогревать за один запрос подсказок
+PREFETCH_MAX_TILES = int(os.getenv("PREFETCH_MAX_TILES", "12"))
+# Кольцо соседей длиннее этого не перебирается (экран на весь мир при крупном масштабе)
+PREFETCH_MAX_RING_TILES = 4096
+
+Tile = Tuple[int, int, int]  # (z, x, y) в схеме XYZ (Web Mercator, как у OpenStreetMap)
+
+# Широта, на которой обрезается проекция Web Mercator
+MAX_LATITUDE = 85.0511287798
+# Половина длины экватора в метрах Web Mercator (EPSG:3857)
+MERCATOR_EXTENT = 20037508.34
+
+
+def lnglat_to_tile(lng: float, lat: float, zoom: int) -> Tuple[int, int]:
+    """Номер тайла XYZ, содержащего точку"""
+    n = 2 ** zoom
+    lat = max(-MAX_LATITUDE, min(MAX_LATITUDE, lat))
+    x = int((lng + 180.0) / 360.0 * n)
+    lat_rad = math.radians(lat)
+    y = int((1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tile_bbox(z: int, x: int, y: int) -> Tuple[float, float, float, float]:
+    """Экстент тайла в градусах: (min_lng, min_lat, max_lng, max_lat)"""
+    n = 2 ** z
+
+    def lat(row: int) -> float:
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+
+    return (x / n * 360.0 - 180.0, lat(y + 1), (x + 1) / n * 360.0 - 180.0, lat(y))
+
+
+def tile_bbox_mercator(z: int, x: int, y: int) -> Tuple[float, float, float, float]:
+    """Экстент тайла в метрах EPSG:3857: (min_x, min_y, max_x, max_y)"""
+    size = 2 * MERCATOR_EXTENT / 2 ** z
+    return (-MERCATOR_EXTENT + x * size, MERCATOR_EXTENT - (y + 1) * size,
+            -MERCATOR_EXTENT + (x + 1) * size, MERCATOR_EXTENT - y * size)
+
+
+def is_valid_tile(z: int, x: int, y: int) -> bool:
+    return 0 <= z <= MAX_TILE_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def tile_range_for_bbox(bbox: List[float], zoom: int) -> Tuple[int, int, int, int]:
+    """Диапазон номеров тайлов (min_x, max_x, min_y, max_y), покрывающих прямоугольник"""
+    min_x, max_y = lnglat_to_tile(bbox[0], bbox[1], zoom)
+    max_x, min_y = lnglat_to_tile(bbox[2], bbox[3], zoom)
+    return min_x, max_x, min_y, max_y
+
+
+def count_tiles_for_bbox(bbox: List[float], zoom: int) -> int:
+    """Число тайлов уровня zoom в прямоугольнике - без построения их списка"""
+    min_x, max_x, min_y, max_y = tile_range_for_bbox(bbox, zoom)
+    return max(0, max_x - min_x + 1) * max(0, max_y - min_y + 1)
+
+
+def tiles_for_bbox(bbox: List[float], zoom: int) -> List[Tile]:
+    """Тайлы уровня zoom, покрывающие прямоугольник [min_lng, min_lat, max_lng, max_lat]"""
+    min_x, max_x, min_y, max_y = tile_range_for_bbox(bbox, zoom)
+    return [(zoom, x, y) for x in range(min_x, max_x + 1) for y in range(min_y, max_y + 1)]
+
+
+def prefetch_tiles(bbox: List[float], zoom: float, dx: float = 0.0, dy: float = 0.0,
+                   limit: Optional[int] = None) -> List[Tile]:
+    """
+    Тайлы для прогрева кэша: сначала тайлы текущего экрана, затем соседние тайлы
+    вокруг него. Если известно направление перемещения карты (dx - на восток,
+    dy - на север), соседи в этом направлении идут первыми, а позади экрана - не берутся.
+    Если экран покрывает больше limit тайлов, подсказываются только соседние тайлы
+    """
+    limit = PREFETCH_MAX_TILES if limit is None else limit
+    z = max(0, min(MAX_TILE_ZOOM, int(zoom)))
+    n = 2 ** z
+    if limit <= 0:
+        return []
+    # Размер экрана считается по угловым тайлам: перечислять тайлы большой области
+    # на крупных масштабах означало бы строить список из миллиардов элементов
+    min_x, max_x, min_y, max_y = tile_range_for_bbox(bbox, z)
+    width, height = max_x - min_x + 1, max_y - min_y + 1
+    viewport = tiles_for_bbox(bbox, z) if width * height <= limit else []
+    if 2 * (width + height) + 4 > PREFETCH_MAX_RING_TILES:
+        return viewport[:limit]
+    center_x, center_y = (min_x + max_x) / 2, (min_y + max_y) / 2
+
+    def in_viewport(x: int, y: int) -> bool:
+        # Экран шириной во весь мир пересекает антимеридиан, поэтому x сравнивается по модулю n
+        return min_y <= y <= max_y and (x - min_x) % n < width
+
+    # Соседи - только кольцо тайлов вокруг экрана, без перебора самого экрана
+    border = [(x, y) for x in range(min_x - 1, max_x + 2) for y in (min_y - 1, max_y + 1)]
+    border += [(x, y) for x in (min_x - 1, max_x + 1) for y in range(min_y, max_y + 1)]
+    ring = []
+    for x, y in border:
+        if not 0 <= y < n or in_viewport(x, y):
+            continue
+        # Номер строки тайла растет к югу, поэтому северное направление - это -y
+        score = (x - center_x) * dx - (y - center_y) * dy
+        if (dx or dy) and score < 0:
+            continue
+        ring.append((-score, abs(x - center_x) + abs(y - center_y), (z, x % n, y)))
+    ring.sort()
+    neighbors = []
+    seen = set()
+    for _, _, tile in ring:
+        if tile not in seen:
+            seen.add(tile)
+            neighbors.append(tile)
+    return (viewport + neighbors)[:limit]
@@ -0,0 +1,121 @@
+"""
+Проверка отмены поиска в НСПД при отключении клиента.
+
+Поднимает заглушку НСПД, которая долго отвечает ошибкой 503, и сервер
+с одним слотом допуска (NSPD_MAX_CONCURRENT=1). Клиент отправляет поиск
+и разрывает соединение, не дождавшись ответа, затем сразу отправляет второй.
+Работа по брошенному запросу должна прекратиться:
+
+- второй поиск получает слот допуска сразу, а не после всех попыток первого;
+- по брошенному запросу не выполняются повторные попытки (по одному запросу к НСПД на поиск);
+- соединение брошенной попытки закрывается и поток пула освобождается сразу, а не
+  после ответа НСПД (nspd_upstream_in_flight в /metrics возвращается к 0);
+- в /metrics растет nspd_cancelled_total.
+
+    python -m benchmarks.disconnect
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import httpx
+
+from benchmarks.run import BACKEND_DIR, free_port, start_backend
+from benchmarks.stub_nspd import StubNSPDServer
+
+
+def abandoned_search(base_url: str, query: str, wait: float) -> None:
+    """Поиск, соединение которого клиент закрывает через wait секунд"""
+    try:
+        httpx.get(f"{base_url}/api/nspd/thematic-search/",
+                  params={"query": query, "thematic_search": "objects"}, timeout=wait)
+    except httpx.TimeoutException:
+        pass
+
+
+def wait_for(condition, timeout: float) -> float:
+    """Ждет выполнения условия; возвращает затраченное время или -1"""
+    started = time.monotonic()
+    while time.monotonic() - started < timeout:
+        if condition():
+            return time.monotonic() - started
+        time.sleep(0.01)
+    return -1
+
+
+def read_metric(base_url: str, name: str) -> float:
+    """Сумма значений метрики по всем меткам"""
+    total = 0.0
+    for line in httpx.get(f"{base_url}/metrics", timeout=5).text.splitlines():
+        if line.startswith(name) and line[len(name)] in " {":
+            total += float(line.rsplit(" ", 1)[1])
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Проверка отмены поиска в НСПД при отключении клиента")
+    parser.add_argument("--latency", type=float, default=1.0, help="Задержка ответа заглушки НСПД, с")
+    parser.add_argument("--abort-after", type=float, default=0.3, help="Через сколько секунд клиент отключается")
+    args = parser.parse_args()
+
+    stub = StubNSPDServer(latency=args.latency, failure_rate=1.0).start()
+    workdir = Path(tempfile.mkdtemp(prefix="mgis_disconnect_"))
+    env = dict(os.environ)
+    env.update({
+        "NSPD_SEARCH_URL": stub.url,
+        "DATABASE_URL": f"sqlite:///{workdir / 'bench.db'}",
+        "PYTHONPATH": str(BACKEND_DIR),
+        "NSPD_MAX_CONCURRENT": "1",
+        "NSPD_CLIENT_MAX_CONCURRENT": "0",
+        "NSPD_HEDGE_DELAY": "0",
+        "NSPD_BACKOFF_BASE": "0.05",
+    })
+    port = free_port()
+    process = start_backend(workdir, port, env)
+    base_url = f"http://127.0.0.1:{port}"
+
+    failures = []
+    try:
+        abandoned_search(base_url, "Первый", args.abort_after)
+        sent = stub.requests_served
+        # Второй поиск займет слот, только если первый его освободил. Повторная попытка
+        # первого поиска (если он не отменен) пришла бы не раньше чем через latency
+        second = threading.Thread(target=abandoned_search, args=(base_url, "Второй", args.abort_after))
+        second.start()
+        admitted = wait_for(lambda: stub.requests_served > sent, args.latency / 2)
+        second.join()
+        # Заглушка ответит только через latency: если поток пула занят до ответа, он не освобожден
+        released = wait_for(lambda: read_metric(base_url, "nspd_upstream_in_flight") == 0, args.latency / 2)
+        # Даем брошенным запросам время на повторные попытки, если они не отменены
+        time.sleep(args.latency * 3)
+        upstream = stub.requests_served
+        cancelled = read_metric(base_url, "nspd_cancelled_total")
+
+        print(f"Второй поиск допущен через: {'не допущен' if admitted < 0 else f'{admitted:.2f} с'}")
+        print(f"Поток пула освобожден через: {'не освобожден' if released < 0 else f'{released:.2f} с'}")
+        print(f"Запросов к НСПД: {upstream} (поисков: 2)")
+        print(f"nspd_cancelled_total: {cancelled:.0f}")
+        if admitted < 0:
+            failures.append("слот допуска не освобожден после отключения клиента")
+        if released < 0:
+            failures.append("поток брошенной попытки занят до ответа НСПД")
+        if upstream > 2:
+            failures.append("по брошенным запросам выполнялись повторные попытки")
+        if cancelled < 2:
+            failures.append("отмена не отражена в метриках")
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+        stub.stop()
+
+    for failure in failures:
+        print(f"ОШИБКА: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Генератор синтетического статического слоя большого размера.
+
+Создает FeatureCollection из полигонов (по структуре похожих на
+layer_category_39892.geojson) в EPSG:4326.
+
+    python -m benchmarks.generate_layer static/layers/bench_layer.geojson --features 5000 --vertices 200
+"""
+import argparse
+import json
+import math
+import random
+from pathlib import Path
+from typing import Any, Dict
+
+
+def generate_layer(features: int = 2000, vertices: int = 200, seed: int = 42) -> Dict[str, Any]:
+    """Генерирует FeatureCollection из полигонов и мультиполигонов"""
+    rng = random.Random(seed)
+    columns = max(1, int(math.sqrt(features)))
+    result = []
+    for i in range(features):
+        # Раскладываем объекты по сетке в пределах европейской части России
+        cx = 30.0 + (i % columns) * (30.0 / columns)
+        cy = 45.0 + (i // columns) * (20.0 / columns)
+        radius = 10.0 / columns * (0.3 + rng.random() * 0.2)
+
+        ring = []
+        for v in range(vertices):
+            angle = 2 * math.pi * v / vertices
+            r = radius * (0.8 + rng.random() * 0.2)
+            ring.append([cx + r * math.cos(angle), cy + r * math.sin(angle)])
+        ring.append(ring[0])
+
+        if i % 10 == 0:
+            geometry = {"type": "MultiPolygon", "coordinates": [[ring]]}
+        else:
+            geometry = {"type": "Polygon", "coordinates": [ring]}
+
+        result.append({
+            "type": "Feature",
+            "id": i,
+            "geometry": geometry,
+            "properties": {
+                "name": f"Муниципальное образование {i}",
+                "oktmo": f"{rng.randint(10000000, 99999999)}",
+                "region": f"Регион {i % 85}",
+                "population": rng.randint(100, 1000000),
+                "area": rng.random() * 1000,
+            },
+        })
+    return {"type": "FeatureCollection", "features": result}
+
+
+def write_layer(path: Path, features: int = 2000, vertices: int = 200, seed: int = 42) -> int:
+    """Записывает синтетический слой в файл и возвращает его размер в байтах"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(generate_layer(features, vertices, seed), f, ensure_ascii=False)
+    return path.stat().st_size
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Генератор синтетического GeoJSON слоя")
+    parser.add_argument("path", type=Path)
+    parser.add_argument("--features", type=int, default=2000)
+    parser.add_argument("--vertices", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    size = write_layer(args.path, args.features, args.vertices, args.seed)
+    print(f"Записан слой {args.path}: {size / 1024 / 1024:.1f} МБ")
+
+
+if __name__ == "__main__":
+    main()
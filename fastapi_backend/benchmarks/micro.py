@@ -0,0 +1,64 @@
+"""
+Микробенчмарки горячих функций сервисного слоя без HTTP.
+
+    python -m benchmarks.micro
+"""
+import copy
+import json
+import statistics
+import time
+from typing import Any, Callable, Dict
+
+from benchmarks.generate_layer import generate_layer
+from benchmarks.stub_nspd import build_response
+
+
+def measure(func: Callable[[], Any], repeat: int = 20, setup: Callable[[], Any] = None) -> Dict[str, float]:
+    """Выполняет функцию repeat раз и возвращает статистику времени в миллисекундах"""
+    timings = []
+    for _ in range(repeat):
+        arg = setup() if setup else None
+        start = time.perf_counter()
+        func(arg) if setup else func()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        "repeat": repeat,
+        "min_ms": round(timings[0], 3),
+        "median_ms": round(statistics.median(timings), 3),
+        "max_ms": round(timings[-1], 3),
+    }
+
+
+def run_micro_benchmarks(repeat: int = 20) -> Dict[str, Dict[str, float]]:
+    """Запускает все микробенчмарки и возвращает результаты по имени"""
+    import logging
+    from app.api.services.nspd_service import transform_geometry_coordinates
+
+    # Отладочное логирование в nspd_service искажает замеры
+    logging.getLogger("app.api.services.nspd_service").setLevel(logging.WARNING)
+
+    results = {}
+
+    nspd_polygons = build_response(2, 200, seed=1)["data"]["features"]
+    results["transform_geometry_coordinates[200 polygons]"] = measure(
+        lambda features: [transform_geometry_coordinates(f["geometry"]) for f in features],
+        repeat,
+        setup=lambda: copy.deepcopy(nspd_polygons),
+    )
+
+    layer = generate_layer(features=500, vertices=200)
+    layer_bytes = json.dumps(layer, ensure_ascii=False).encode("utf-8")
+    results["json.loads[layer 500x200]"] = measure(lambda: json.loads(layer_bytes), repeat)
+    results["json.dumps[layer 500x200]"] = measure(lambda: json.dumps(layer, ensure_ascii=False), repeat)
+
+    return results
+
+
+def main():
+    for name, stats in run_micro_benchmarks().items():
+        print(f"{name:50s} median={stats['median_ms']:9.3f} мс  min={stats['min_ms']:9.3f} мс")
+
+
+if __name__ == "__main__":
+    main()
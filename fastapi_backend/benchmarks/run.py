@@ -0,0 +1,308 @@
+"""
+Нагрузочный тест эндпоинтов бэкенда против заглушки НСПД.
+
+Поднимает заглушку НСПД и отдельный процесс uvicorn во временном каталоге
+с синтетическим слоем, затем измеряет p50/p95/p99 задержки, пропускную
+способность и пиковое потребление памяти (RSS) процесса сервера для:
+
+- GET  /api/maps/layer-data/{id}
+- GET  /api/nspd/thematic-search/
+- POST /api/maps/upload-layer/
+
+Результаты сохраняются в benchmarks/results/<время>.json и сравниваются
+с предыдущим запуском.
+
+    python -m benchmarks.run --requests 200 --concurrency 16 --latency 0.1 --failure-rate 0.05
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import httpx
+
+from benchmarks.generate_layer import write_layer
+from benchmarks.micro import run_micro_benchmarks
+from benchmarks.stub_nspd import StubNSPDServer
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+SEARCH_QUERIES = ["77:01:0001001", "Москва", "Тверская", "50:21", "Зеленоград", "77:05:0004007:1"]
+THEMATIC_TYPES = ["objects", "cad_del", "admin_del", "zouit", "ter_zone"]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def read_rss_kb(pid: int, field: str = "VmRSS") -> Optional[int]:
+    """Читает поле VmRSS/VmHWM процесса из /proc (только Linux)"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+class RSSSampler:
+    """Фоновый замер пикового RSS процесса во время сценария"""
+
+    def __init__(self, pid: int, interval: float = 0.02):
+        self.pid = pid
+        self.interval = interval
+        self.peak_kb: Optional[int] = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            rss = read_rss_kb(self.pid)
+            if rss is not None:
+                self.peak_kb = max(self.peak_kb or 0, rss)
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(q / 100 * (len(values) - 1)))))
+    return values[index]
+
+
+async def run_scenario(base_url: str, make_request: Callable[[httpx.AsyncClient, int], Any],
+                       total: int, concurrency: int) -> Dict[str, Any]:
+    """Выполняет total запросов с заданной параллельностью и собирает статистику"""
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    response_bytes = 0
+    counter = iter(range(total))
+
+    async def worker(client: httpx.AsyncClient):
+        nonlocal response_bytes
+        for i in counter:
+            start = time.perf_counter()
+            try:
+                response = await make_request(client, i)
+                status = str(response.status_code)
+                response_bytes += len(response.content)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            latencies.append((time.perf_counter() - start) * 1000)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "requests": total,
+        "concurrency": concurrency,
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+        "max_ms": round(max(latencies), 2),
+        "throughput_rps": round(total / elapsed, 2),
+        "response_bytes_avg": int(response_bytes / total),
+        "statuses": statuses,
+    }
+
+
+def start_backend(workdir: Path, port: int, env: Dict[str, str]) -> subprocess.Popen:
+    """Запускает uvicorn с приложением в отдельном процессе"""
+    log = open(workdir / "backend.log", "w")
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--app-dir", str(BACKEND_DIR), "--log-level", "warning"],
+        cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Сервер завершился при запуске, см. {workdir / 'backend.log'}")
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/health", timeout=1).status_code == 200:
+                return process
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("Сервер не ответил на /health за 30 секунд")
+
+
+def run_load_tests(args) -> Dict[str, Any]:
+    stub = StubNSPDServer(latency=args.latency, latency_jitter=args.latency_jitter,
+                          failure_rate=args.failure_rate, features=args.nspd_features).start()
+    workdir = Path(tempfile.mkdtemp(prefix="mgis_bench_"))
+    layer_path = workdir / "static" / "layers" / "bench_layer.geojson"
+    layer_size = write_layer(layer_path, args.layer_features, args.layer_vertices)
+    upload_path = workdir / "upload_layer.geojson"
+    upload_size = write_layer(upload_path, args.upload_features, args.layer_vertices, seed=7)
+    upload_body = upload_path.read_bytes()
+
+    env = dict(os.environ)
+    env.update({
+        "NSPD_SEARCH_URL": stub.url,
+        "DATABASE_URL": f"sqlite:///{workdir / 'bench.db'}",
+        "PYTHONPATH": str(BACKEND_DIR),
+        # Все виртуальные клиенты приходят с одного адреса: лимит на клиента
+        # превратил бы замер поиска в замер ответов 429
+        "NSPD_CLIENT_MAX_CONCURRENT": "0",
+    })
+    port = free_port()
+    process = start_backend(workdir, port, env)
+    base_url = f"http://127.0.0.1:{port}"
+    rng = random.Random(1)
+
+    async def layer_data(client, i):
+        return await client.get("/api/maps/layer-data/static_bench_layer")
+
+    async def thematic_search(client, i):
+        return await client.get("/api/nspd/thematic-search/", params={
+            "query": rng.choice(SEARCH_QUERIES),
+            "thematic_search": rng.choice(THEMATIC_TYPES),
+        })
+
+    async def upload_layer(client, i):
+        files = {"file": (f"bench_upload_{i % 4}.geojson", upload_body, "application/geo+json")}
+        return await client.post("/api/maps/upload-layer/", files=files)
+
+    scenarios = {
+        "layer-data": (layer_data, args.layer_requests),
+        "thematic-search": (thematic_search, args.requests),
+        "upload-layer": (upload_layer, args.upload_requests),
+    }
+
+    results = {}
+    try:
+        for name, (make_request, total) in scenarios.items():
+            if args.only and name not in args.only:
+                continue
+            print(f"Сценарий {name}: {total} запросов, параллельность {args.concurrency}...")
+            with RSSSampler(process.pid) as sampler:
+                stats = asyncio.run(run_scenario(base_url, make_request, total, args.concurrency))
+            stats["peak_rss_mb"] = round(sampler.peak_kb / 1024, 1) if sampler.peak_kb else None
+            results[name] = stats
+        hwm = read_rss_kb(process.pid, "VmHWM")
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+        stub.stop()
+
+    return {
+        "scenarios": results,
+        "server_peak_rss_mb": round(hwm / 1024, 1) if hwm else None,
+        "nspd_stub_requests": stub.requests_served,
+        "layer_size_mb": round(layer_size / 1024 / 1024, 2),
+        "upload_size_mb": round(upload_size / 1024 / 1024, 2),
+        "workdir": str(workdir),
+    }
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def latest_result(results_dir: Path) -> Optional[Path]:
+    files = sorted(results_dir.glob("*.json"))
+    return files[-1] if files else None
+
+
+def print_comparison(current: Dict[str, Any], previous: Dict[str, Any]) -> None:
+    """Печатает изменение ключевых метрик относительно предыдущего запуска"""
+    print(f"\nСравнение с запуском {previous.get('timestamp')} ({previous.get('git_revision')}):")
+    metrics = ["p50_ms", "p95_ms", "p99_ms", "throughput_rps", "peak_rss_mb"]
+    for name, stats in current.get("scenarios", {}).items():
+        old = previous.get("scenarios", {}).get(name)
+        if not old:
+            continue
+        parts = []
+        for metric in metrics:
+            new_value, old_value = stats.get(metric), old.get(metric)
+            if new_value is None or not old_value:
+                continue
+            change = (new_value - old_value) / old_value * 100
+            parts.append(f"{metric}={new_value} ({change:+.1f}%)")
+        print(f"  {name:16s} " + "  ".join(parts))
+    for name, stats in current.get("micro", {}).items():
+        old = previous.get("micro", {}).get(name)
+        if old and old.get("median_ms"):
+            change = (stats["median_ms"] - old["median_ms"]) / old["median_ms"] * 100
+            print(f"  {name:50s} median={stats['median_ms']} мс ({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест и микробенчмарки бэкенда")
+    parser.add_argument("--requests", type=int, default=200, help="Запросов тематического поиска")
+    parser.add_argument("--layer-requests", type=int, default=30, help="Запросов данных слоя")
+    parser.add_argument("--upload-requests", type=int, default=10, help="Загрузок слоя")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.05, help="Задержка заглушки НСПД, с")
+    parser.add_argument("--latency-jitter", type=float, default=0.05, help="Случайная добавка к задержке, с")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Доля ответов 503 от заглушки")
+    parser.add_argument("--nspd-features", type=int, default=50, help="Объектов в ответе заглушки")
+    parser.add_argument("--layer-features", type=int, default=2000)
+    parser.add_argument("--layer-vertices", type=int, default=200)
+    parser.add_argument("--upload-features", type=int, default=300)
+    parser.add_argument("--only", nargs="*", help="Запустить только указанные сценарии")
+    parser.add_argument("--skip-micro", action="store_true", help="Не запускать микробенчмарки")
+    parser.add_argument("--label", default="", help="Метка запуска")
+    parser.add_argument("--results-dir", type=Path, default=RESULTS_DIR)
+    parser.add_argument("--compare", type=Path, help="Файл результатов для сравнения (по умолчанию последний)")
+    args = parser.parse_args()
+
+    previous_path = args.compare or latest_result(args.results_dir)
+    result = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "label": args.label,
+        "git_revision": git_revision(),
+        "config": {k: (str(v) if isinstance(v, Path) else v) for k, v in vars(args).items()},
+    }
+    result.update(run_load_tests(args))
+    if not args.skip_micro:
+        result["micro"] = run_micro_benchmarks()
+
+    print(json.dumps({k: result[k] for k in ("scenarios", "server_peak_rss_mb")}, ensure_ascii=False, indent=2))
+
+    args.results_dir.mkdir(parents=True, exist_ok=True)
+    output = args.results_dir / f"{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"Результаты сохранены в {output}")
+
+    if previous_path and previous_path.exists():
+        with open(previous_path, encoding="utf-8") as f:
+            print_comparison(result, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""
+Заглушка API НСПД для нагрузочного тестирования.
+
+Отдает заранее сгенерированные ответы в EPSG:3857 (в том же формате, что и
+https://nspd.gov.ru/api/geoportal/v2/search/geoportal) с настраиваемой задержкой
+и долей ошибок.
+
+Запуск отдельно:
+    python -m benchmarks.stub_nspd --port 8900 --latency 0.2 --failure-rate 0.05
+"""
+import argparse
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+# Радиус Земли * π, как в nspd_service.transform_web_mercator_to_wgs84
+R_EARTH_PI = 20037508.34
+
+
+def wgs84_to_web_mercator(lng: float, lat: float) -> List[float]:
+    """Преобразует координаты из EPSG:4326 в EPSG:3857"""
+    x = lng * R_EARTH_PI / 180
+    y = math.log(math.tan((90 + lat) * math.pi / 360)) / (math.pi / 180)
+    y = y * R_EARTH_PI / 180
+    return [x, y]
+
+
+def make_feature(index: int, thematic_id: int, rng: random.Random, vertices: int = 32) -> Dict[str, Any]:
+    """Создает объект НСПД: точку для объектов (thematicSearchId=1), полигон для остальных"""
+    lng = 37.0 + rng.random() * 1.5
+    lat = 55.3 + rng.random() * 0.9
+    cad_number = f"77:{rng.randint(1, 17):02d}:{rng.randint(1, 9999999):07d}:{index}"
+
+    if thematic_id == 1:
+        geometry = {"type": "Point", "coordinates": wgs84_to_web_mercator(lng, lat)}
+    else:
+        radius = 0.002 + rng.random() * 0.01
+        ring = []
+        for i in range(vertices):
+            angle = 2 * math.pi * i / vertices
+            ring.append(wgs84_to_web_mercator(lng + radius * math.cos(angle), lat + radius * math.sin(angle)))
+        ring.append(ring[0])
+        geometry = {"type": "Polygon", "coordinates": [ring]}
+
+    geometry["crs"] = {"type": "name", "properties": {"name": "EPSG:3857"}}
+    return {
+        "id": 100000 + index,
+        "type": "Feature",
+        "geometry": geometry,
+        "properties": {
+            "category": thematic_id,
+            "categoryName": "Земельные участки",
+            "descr": cad_number,
+            "options": {
+                "cad_number": cad_number,
+                "readable_address": f"г. Москва, ул. Тестовая, д. {index}",
+                "land_record_area": rng.randint(100, 100000),
+                "cost_value": rng.random() * 1e7,
+                "status": "Учтенный",
+            },
+        },
+    }
+
+
+def build_response(thematic_id: int, count: int, seed: int) -> Dict[str, Any]:
+    """Строит ответ НСПД с заданным числом объектов"""
+    rng = random.Random(seed)
+    return {
+        "data": {
+            "type": "FeatureCollection",
+            "features": [make_feature(i, thematic_id, rng) for i in range(count)],
+        }
+    }
+
+
+class StubNSPDServer:
+    """HTTP-сервер, имитирующий НСПД, работающий в фоновом потоке"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.05,
+                 latency_jitter: float = 0.0, failure_rate: float = 0.0,
+                 features: int = 50, seed: int = 42):
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.failure_rate = failure_rate
+        self.rng = random.Random(seed)
+        self.requests_served = 0
+        # Ответы готовятся заранее, чтобы заглушка не влияла на измерения
+        self.responses = {
+            thematic_id: json.dumps(build_response(thematic_id, features, seed + thematic_id)).encode("utf-8")
+            for thematic_id in (1, 2, 4, 5, 7)
+        }
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/api/geoportal/v2/search/geoportal"
+
+    def _make_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                params = parse_qs(urlparse(self.path).query)
+                with stub._lock:
+                    stub.requests_served += 1
+                    failed = stub.rng.random() < stub.failure_rate
+                    delay = stub.latency + stub.rng.random() * stub.latency_jitter
+                time.sleep(delay)
+
+                if failed:
+                    self.send_response(503)
+                    self.end_headers()
+                    return
+
+                try:
+                    thematic_id = int(params.get("thematicSearchId", ["1"])[0])
+                except ValueError:
+                    thematic_id = 1
+                body = stub.responses.get(thematic_id)
+                if body is None:
+                    self.send_response(400)
+                    self.end_headers()
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # Не засоряем вывод бенчмарка
+                pass
+
+        return Handler
+
+    def start(self) -> "StubNSPDServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Заглушка API НСПД")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", type=float, default=0.05, help="Задержка ответа, с")
+    parser.add_argument("--latency-jitter", type=float, default=0.0, help="Случайная добавка к задержке, с")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Доля ответов 503")
+    parser.add_argument("--features", type=int, default=50, help="Число объектов в ответе")
+    args = parser.parse_args()
+
+    stub = StubNSPDServer(args.host, args.port, args.latency, args.latency_jitter,
+                          args.failure_rate, args.features).start()
+    print(f"Заглушка НСПД запущена: {stub.url}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    main()
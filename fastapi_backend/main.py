@@ -1,14 +1,23 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
 from app.api.endpoints import maps, nspd
 from fastapi.exceptions import RequestValidationError
 from starlette.exceptions import HTTPException as StarletteHTTPException
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 import logging
 import os
+import time
 from pathlib import Path
+from app.api.services.metrics import HTTP_REQUEST_DURATION, render_metrics
+from app.api.services.geometry_executor import geometry_executor
+from app.api.services.profiling import (
+    PROFILE_TOKEN, PROFILE_HEADER, RequestProfiler, profile_requested,
+    track_request_start, track_request_end, load_report, collapsed_stacks
+)
+from starlette.concurrency import run_in_threadpool
+from app.database import Base, engine
 
 logger = logging.getLogger(__name__)
 
@@ -48,6 +57,54 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Метрики длительности запросов по маршрутам
+@app.middleware("http")
+async def metrics_middleware(request: Request, call_next):
+    start = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        # Используем шаблон маршрута, а не фактический путь, чтобы не плодить метки
+        route = request.scope.get("route")
+        route_path = getattr(route, "path", None) or "unmatched"
+        HTTP_REQUEST_DURATION.labels(
+            method=request.method, route=route_path, status=status_code
+        ).observe(time.perf_counter() - start)
+
+# Профилирование отдельных запросов по токену администратора (PROFILE_TOKEN).
+# Без токена middleware не подключается и не добавляет накладных расходов
+if PROFILE_TOKEN:
+    @app.middleware("http")
+    async def profiling_middleware(request: Request, call_next):
+        track_request_start()
+        try:
+            if request.url.path.startswith("/api/profiles/") or not profile_requested(request.headers.get(PROFILE_HEADER)):
+                return await call_next(request)
+            profiler = RequestProfiler.acquire()
+            if profiler is None:
+                # Одновременно профилируется только один запрос
+                response = await call_next(request)
+                response.headers["X-Profile-Status"] = "busy"
+                return response
+            await run_in_threadpool(profiler.start)
+            status_code = 500
+            try:
+                response = await call_next(request)
+                status_code = response.status_code
+            finally:
+                report = await run_in_threadpool(
+                    profiler.finish, request.method, request.url.path, request.url.query, status_code
+                )
+                logger.info(f"Профиль запроса {request.method} {request.url.path}: {report['id']}, {report['duration']:.3f} с")
+            response.headers["X-Profile-Id"] = report["id"]
+            response.headers["X-Profile-Url"] = f"/api/profiles/{report['id']}"
+            return response
+        finally:
+            track_request_end()
+
 # Обработчик ошибок валидации
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request, exc):
@@ -71,7 +128,8 @@ async def http_exception_handler(request, exc):
             "type": "FeatureCollection",
             "features": [],
             "message": str(exc.detail)
-        }
+        },
+        headers=getattr(exc, "headers", None)
     )
 
 # Обработчик всех остальных исключений
@@ -91,6 +149,16 @@ async def general_exception_handler(request, exc):
 app.include_router(maps.router, prefix="/api")
 app.include_router(nspd.router, prefix="/api")
 
+@app.on_event("startup")
+def create_tables():
+    """Создает недостающие таблицы БД (существующие таблицы не изменяются)"""
+    Base.metadata.create_all(bind=engine)
+
+@app.on_event("shutdown")
+def shutdown_geometry_executor():
+    """Останавливает пул процессов для обработки геометрий"""
+    geometry_executor.shutdown()
+
 @app.get("/health")
 async def health_check():
     """
@@ -98,5 +166,29 @@ async def health_check():
     """
     return {"status": "healthy"}
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """
+    Метрики в текстовом формате Prometheus
+    """
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+# Под /api/, чтобы отчет был доступен через nginx
+@app.get("/api/profiles/{profile_id}", include_in_schema=False)
+async def read_profile(profile_id: str, request: Request, format: str = "json"):
+    """
+    Отчет профилирования запроса (только с токеном администратора):
+    функции по времени, стеки и выделения памяти; format=collapsed - стеки
+    в формате collapsed stacks для flamegraph.pl и speedscope
+    """
+    if not profile_requested(request.headers.get(PROFILE_HEADER)):
+        raise StarletteHTTPException(status_code=403, detail="Нужен токен профилирования")
+    report = await run_in_threadpool(load_report, profile_id)
+    if report is None:
+        raise StarletteHTTPException(status_code=404, detail=f"Отчет {profile_id} не найден")
+    if format == "collapsed":
+        return PlainTextResponse(collapsed_stacks(report))
+    return report
+
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True) 
\ No newline at end of file